@@ -0,0 +1,177 @@
+/*
+ * Microbenchmark of k-mer hash set lookups.
+ *
+ * Compares the Robin Hood hash set in c/hash_set.c, with and without the
+ * Bloom filter in c/bloom_filter.c in front of it, against the original
+ * table it replaced, which kept occupancy in a separate `full` array,
+ * used `%` to find and step between slots, and truncated hashes to 32
+ * bits. Both tables are filled with the same random canonical k-mers and
+ * queried with the same random k-mers, most of which are not in the set,
+ * as is the case for the windows of an offspring read.
+ *
+ * Build and run from the root of the repository:
+ *
+ *     gcc -O2 -DKMERS_NO_MAIN -Ic -o hash_set_bench \
+ *         benchmarks/hash_set_bench.c c/kmers.c c/hash_set.c \
+ *         c/hash_set_128.c c/sorted_set.c c/compressed_set.c c/bloom_filter.c \
+ *         c/parallel.c -pthread
+ *     ./hash_set_bench [num_kmers] [num_lookups] [hit_percent]
+ */
+#include "kmers.h"
+#include <time.h>
+
+#define BENCH_K 21
+
+/*
+ * The original hash set, kept here for comparison
+ */
+typedef struct {
+    uint64_t* kmers;
+    unsigned char* full;
+    uint64_t hash_size;
+} legacy_hash_set;
+
+unsigned int legacy_hash_function(uint64_t x) {
+    x = ((x >> 16) ^ x) * 0x45d9f3b;
+    x = ((x >> 16) ^ x) * 0x45d9f3b;
+    x = (x >> 16) ^ x;
+    return (unsigned int) x;
+}
+
+legacy_hash_set* legacy_initialize_hash_set(uint64_t num_kmers) {
+    legacy_hash_set* set = malloc(sizeof(legacy_hash_set));
+    set->hash_size = num_kmers * 4 / 3 + 1;
+    set->kmers = malloc(set->hash_size * sizeof(uint64_t));
+    set->full = calloc(set->hash_size, sizeof(unsigned char));
+    return set;
+}
+
+void legacy_add_to_hash(legacy_hash_set* set, uint64_t kmer_int) {
+    uint64_t position = legacy_hash_function(kmer_int) % set->hash_size;
+    while (set->full[position])
+    {
+        if (set->kmers[position] == kmer_int)
+            return;
+        position = (position + 1) % set->hash_size;
+    }
+    set->full[position] = 1;
+    set->kmers[position] = kmer_int;
+}
+
+char legacy_kmer_in_hash_set(uint64_t kmer_int, legacy_hash_set* set) {
+    uint64_t position = legacy_hash_function(kmer_int) % set->hash_size;
+    while (set->full[position])
+    {
+        if (set->kmers[position] == kmer_int)
+            return 1;
+        position = (position + 1) % set->hash_size;
+    }
+    return 0;
+}
+
+/*
+ * splitmix64, for generating reproducible random k-mers
+ */
+uint64_t next_random(uint64_t* state) {
+    uint64_t z = (*state += UINT64_C(0x9e3779b97f4a7c15));
+    z = (z ^ (z >> 30)) * UINT64_C(0xbf58476d1ce4e5b9);
+    z = (z ^ (z >> 27)) * UINT64_C(0x94d049bb133111eb);
+    return z ^ (z >> 31);
+}
+
+uint64_t random_canonical_kmer(uint64_t* state) {
+    uint64_t kmer_int = next_random(state) >> (64 - 2 * BENCH_K);
+    uint64_t revcomp_int = reverse_complement_int(kmer_int, BENCH_K);
+    return kmer_int < revcomp_int ? kmer_int : revcomp_int;
+}
+
+double seconds_since(struct timespec* start) {
+    struct timespec end;
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    return (end.tv_sec - start->tv_sec) + (end.tv_nsec - start->tv_nsec) / 1e9;
+}
+
+int main(int argc, char** argv) {
+    uint64_t num_kmers = argc > 1 ? strtoull(argv[1], NULL, 10) : 10000000;
+    uint64_t num_lookups = argc > 2 ? strtoull(argv[2], NULL, 10) : 50000000;
+    int hit_percent = argc > 3 ? atoi(argv[3]) : 5;
+    uint64_t state = 42, i, hits;
+    uint64_t* inserted = malloc(num_kmers * sizeof(uint64_t));
+    uint64_t* queries = malloc(num_lookups * sizeof(uint64_t));
+    hash_set* set;
+    bloom_filter* bloom;
+    legacy_hash_set* legacy_set;
+    struct timespec start;
+    double elapsed;
+
+    for (i = 0; i < num_kmers; i++)
+        inserted[i] = random_canonical_kmer(&state);
+    for (i = 0; i < num_lookups; i++)
+    {
+        if (next_random(&state) % 100 < (uint64_t) hit_percent)
+            queries[i] = inserted[next_random(&state) % num_kmers];
+        else
+            queries[i] = random_canonical_kmer(&state);
+    }
+
+    set = initialize_hash_set(num_kmers);
+    bloom = initialize_bloom_filter(num_kmers);
+    legacy_set = legacy_initialize_hash_set(num_kmers);
+    for (i = 0; i < num_kmers; i++)
+    {
+        add_int_to_hash(set, inserted[i], i % 2 ? HAPLOTYPE_B : HAPLOTYPE_A);
+        add_int_to_bloom_filter(bloom, inserted[i]);
+        legacy_add_to_hash(legacy_set, inserted[i]);
+    }
+
+    printf("table\tnum_kmers\tbytes_per_kmer\tlookups_per_sec\thits\n");
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (i = 0, hits = 0; i < num_lookups; i++)
+        hits += legacy_kmer_in_hash_set(queries[i], legacy_set) != 0;
+    elapsed = seconds_since(&start);
+    printf(
+        "legacy\t%" PRIu64 "\t%.2f\t%.0f\t%" PRIu64 "\n",
+        num_kmers,
+        (double) legacy_set->hash_size * 9 / num_kmers,
+        num_lookups / elapsed,
+        hits
+    );
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (i = 0, hits = 0; i < num_lookups; i++)
+        hits += kmer_in_hash_set(queries[i], set) != EMPTY;
+    elapsed = seconds_since(&start);
+    printf(
+        "robin_hood\t%" PRIu64 "\t%.2f\t%.0f\t%" PRIu64 "\n",
+        num_kmers,
+        (double) set->hash_size * 9 / num_kmers,
+        num_lookups / elapsed,
+        hits
+    );
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (i = 0, hits = 0; i < num_lookups; i++)
+    {
+        hits += kmer_in_bloom_filter(queries[i], bloom)
+            && kmer_in_hash_set(queries[i], set) != EMPTY;
+    }
+    elapsed = seconds_since(&start);
+    printf(
+        "robin_hood_bloom\t%" PRIu64 "\t%.2f\t%.0f\t%" PRIu64 "\n",
+        num_kmers,
+        (double) set->hash_size * 9 / num_kmers
+            + (double) bloom->num_blocks * BLOOM_WORDS_PER_BLOCK * 8 / num_kmers,
+        num_lookups / elapsed,
+        hits
+    );
+
+    free_hash_set(set);
+    free_bloom_filter(bloom);
+    free(legacy_set->kmers);
+    free(legacy_set->full);
+    free(legacy_set);
+    free(inserted);
+    free(queries);
+    return 0;
+}
@@ -0,0 +1,129 @@
+/*
+ * Benchmark of memory use against lookup speed for each type of k-mer
+ * index: the hash set in c/hash_set.c, the sorted set in c/sorted_set.c,
+ * and the compressed set in c/compressed_set.c.
+ *
+ * Each set is filled with the same random canonical k-mers, half of them
+ * labelled with each haplotype, and queried with the same random k-mers,
+ * most of which are not in the set, as is the case for the windows of an
+ * offspring read. For every set, it prints the bytes used per k-mer and
+ * the number of lookups per second. The sorted set is searched one k-mer
+ * at a time here, whereas classifying reads searches it a read at a time.
+ *
+ * Build and run from the root of the repository:
+ *
+ *     gcc -O2 -DKMERS_NO_MAIN -Ic -o kmer_index_bench \
+ *         benchmarks/kmer_index_bench.c c/kmers.c c/hash_set.c \
+ *         c/hash_set_128.c c/sorted_set.c c/compressed_set.c c/bloom_filter.c \
+ *         c/parallel.c -pthread
+ *     ./kmer_index_bench [num_kmers] [num_lookups] [hit_percent] [k]
+ */
+#include "kmers.h"
+#include <time.h>
+
+/*
+ * splitmix64, for generating reproducible random k-mers
+ */
+uint64_t next_random(uint64_t* state) {
+    uint64_t z = (*state += UINT64_C(0x9e3779b97f4a7c15));
+    z = (z ^ (z >> 30)) * UINT64_C(0xbf58476d1ce4e5b9);
+    z = (z ^ (z >> 27)) * UINT64_C(0x94d049bb133111eb);
+    return z ^ (z >> 31);
+}
+
+uint64_t random_canonical_kmer(uint64_t* state, unsigned char k) {
+    uint64_t kmer_int = next_random(state) >> (64 - 2 * k);
+    uint64_t revcomp_int = reverse_complement_int(kmer_int, k);
+    return kmer_int < revcomp_int ? kmer_int : revcomp_int;
+}
+
+double seconds_since(struct timespec* start) {
+    struct timespec end;
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    return (end.tv_sec - start->tv_sec) + (end.tv_nsec - start->tv_nsec) / 1e9;
+}
+
+void print_result(
+    char* table,
+    uint64_t num_kmers,
+    uint64_t bytes,
+    uint64_t num_lookups,
+    double elapsed,
+    uint64_t hits
+) {
+    printf(
+        "%s\t%" PRIu64 "\t%.2f\t%.0f\t%" PRIu64 "\n",
+        table,
+        num_kmers,
+        (double) bytes / num_kmers,
+        num_lookups / elapsed,
+        hits
+    );
+}
+
+int main(int argc, char** argv) {
+    uint64_t num_kmers = argc > 1 ? strtoull(argv[1], NULL, 10) : 10000000;
+    uint64_t num_lookups = argc > 2 ? strtoull(argv[2], NULL, 10) : 20000000;
+    int hit_percent = argc > 3 ? atoi(argv[3]) : 5;
+    unsigned char k = argc > 4 ? atoi(argv[4]) : 21;
+    uint64_t state = 42, i, hits, num_A = num_kmers / 2;
+    uint64_t* kmers_A = malloc(num_kmers * sizeof(uint64_t));
+    uint64_t* kmers_B = kmers_A + num_A;
+    uint64_t* queries = malloc(num_lookups * sizeof(uint64_t));
+    hash_set* hash;
+    sorted_set* sorted;
+    compressed_set* compressed;
+    struct timespec start;
+
+    for (i = 0; i < num_kmers; i++)
+        kmers_A[i] = random_canonical_kmer(&state, k);
+    for (i = 0; i < num_lookups; i++)
+    {
+        if (next_random(&state) % 100 < (uint64_t) hit_percent)
+            queries[i] = kmers_A[next_random(&state) % num_kmers];
+        else
+            queries[i] = random_canonical_kmer(&state, k);
+    }
+
+    hash = initialize_hash_set(num_kmers);
+    for (i = 0; i < num_kmers; i++)
+        add_int_to_hash(hash, kmers_A[i], i < num_A ? HAPLOTYPE_A : HAPLOTYPE_B);
+    sorted = create_sorted_set(
+        kmers_A, num_A, kmers_B, num_kmers - num_A, k, 1
+    );
+    compressed = create_compressed_set(sorted, k);
+
+    printf("table\tnum_kmers\tbytes_per_kmer\tlookups_per_sec\thits\n");
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (i = 0, hits = 0; i < num_lookups; i++)
+        hits += kmer_in_hash_set(queries[i], hash) != EMPTY;
+    print_result(
+        "hash", num_kmers, estimate_hash_set_memory(num_kmers),
+        num_lookups, seconds_since(&start), hits
+    );
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (i = 0, hits = 0; i < num_lookups; i++)
+        hits += kmer_in_sorted_set(queries[i], sorted) != EMPTY;
+    print_result(
+        "sorted", num_kmers, estimate_sorted_set_memory(sorted->num_kmers),
+        num_lookups, seconds_since(&start), hits
+    );
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (i = 0, hits = 0; i < num_lookups; i++)
+        hits += kmer_in_compressed_set(queries[i], compressed) != EMPTY;
+    print_result(
+        "compressed", num_kmers,
+        estimate_compressed_set_memory(compressed->num_kmers, k),
+        num_lookups, seconds_since(&start), hits
+    );
+
+    free_hash_set(hash);
+    free_sorted_set(sorted);
+    free_compressed_set(compressed);
+    free(kmers_A);
+    free(queries);
+    return 0;
+}
@@ -0,0 +1,178 @@
+#include "kmers.h"
+
+/*
+ * Odd multipliers used to derive the bit set in each word of a block from
+ * a single 32-bit hash, as in the split block Bloom filters of Parquet
+ */
+static const uint32_t bloom_salts[BLOOM_WORDS_PER_BLOCK] = {
+    0x47b6137bU, 0x44974d91U, 0x8824ad5bU, 0xa2b7289dU,
+    0x705495c7U, 0x2df1424bU, 0x9efc4947U, 0x5c6bfb31U,
+};
+
+/*
+ * Choose the number of blocks in a Bloom filter: enough to give each k-mer
+ * BLOOM_BITS_PER_KMER bits, which makes about 1% of lookups of k-mers that
+ * are not in the filter pass it anyway.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: the number of blocks the Bloom filter should have
+ */
+uint64_t bloom_filter_size(uint64_t num_kmers) {
+    uint64_t block_bits = BLOOM_WORDS_PER_BLOCK * 64;
+    return (num_kmers * BLOOM_BITS_PER_KMER + block_bits - 1) / block_bits + 1;
+}
+
+/*
+ * Estimate the memory needed for a Bloom filter, so that it can be
+ * reported before attempting to allocate it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: the number of bytes `initialize_bloom_filter` will allocate
+ */
+uint64_t estimate_bloom_filter_memory(uint64_t num_kmers) {
+    return sizeof(bloom_filter)
+        + bloom_filter_size(num_kmers) * BLOOM_WORDS_PER_BLOCK * sizeof(uint64_t);
+}
+
+/*
+ * Initialize a new, empty Bloom filter. The blocks are aligned to cache
+ * lines, so that checking a k-mer touches exactly one.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: a new Bloom filter, or NULL if there is not enough memory for it
+ */
+bloom_filter* initialize_bloom_filter(uint64_t num_kmers) {
+    bloom_filter* out_bloom_filter;
+    size_t size;
+
+    out_bloom_filter = malloc(sizeof(bloom_filter));
+    out_bloom_filter->num_blocks = bloom_filter_size(num_kmers);
+    size = out_bloom_filter->num_blocks * BLOOM_WORDS_PER_BLOCK * sizeof(uint64_t);
+
+    fprintf(
+        stderr,
+        "Allocating Bloom filter of %" PRIu64 " blocks, which needs %.2f GiB "
+        "of memory.\n",
+        out_bloom_filter->num_blocks,
+        (double) estimate_bloom_filter_memory(num_kmers) / (1 << 30)
+    );
+
+    if (posix_memalign((void**) &out_bloom_filter->blocks, 64, size))
+    {
+        fprintf(stderr, "Could not allocate memory for Bloom filter.\n");
+        free(out_bloom_filter);
+        return NULL;
+    }
+    memset(out_bloom_filter->blocks, 0, size);
+
+    return out_bloom_filter;
+}
+
+/*
+ * Free a Bloom filter and the blocks inside of it.
+ */
+void free_bloom_filter(bloom_filter* filter) {
+    free(filter->blocks);
+    free(filter);
+}
+
+/*
+ * Find the block of a Bloom filter that a k-mer belongs in, and the bit it
+ * sets in each word of that block.
+ *
+ * The high half of the hash picks the block, by multiplying it into the
+ * range of block numbers rather than by the slower `%`, and the low half
+ * picks one bit out of each of the eight words.
+ *
+ * Args:
+ *     filter: the Bloom filter
+ *     kmer_int: the canonical integer representation of the k-mer
+ *     masks: set to the bit of each word of the block
+ *
+ * Returns: the first word of the block
+ */
+static inline uint64_t* bloom_filter_block(
+    bloom_filter* filter,
+    uint64_t kmer_int,
+    uint64_t* masks
+) {
+    uint64_t hash = hash_function(kmer_int);
+    uint32_t low = (uint32_t) hash;
+    uint64_t block = ((hash >> 32) * filter->num_blocks) >> 32;
+    int i;
+
+    for (i = 0; i < BLOOM_WORDS_PER_BLOCK; i++)
+    {
+        masks[i] = UINT64_C(1) << ((low * bloom_salts[i]) >> 26);
+    }
+
+    return filter->blocks + block * BLOOM_WORDS_PER_BLOCK;
+}
+
+/*
+ * Add a canonical integer k-mer to a Bloom filter.
+ *
+ * Args:
+ *     filter: the Bloom filter to add the k-mer to (modifies)
+ *     kmer_int: the canonical integer representation of the k-mer
+ */
+void add_int_to_bloom_filter(bloom_filter* filter, uint64_t kmer_int) {
+    uint64_t masks[BLOOM_WORDS_PER_BLOCK];
+    uint64_t* block = bloom_filter_block(filter, kmer_int, masks);
+    int i;
+
+    for (i = 0; i < BLOOM_WORDS_PER_BLOCK; i++)
+    {
+        block[i] |= masks[i];
+    }
+}
+
+/*
+ * Add a canonical integer k-mer to a Bloom filter that other threads may be
+ * adding to at the same time.
+ *
+ * Args:
+ *     filter: the Bloom filter to add the k-mer to (modifies)
+ *     kmer_int: the canonical integer representation of the k-mer
+ */
+void add_int_to_bloom_filter_atomic(bloom_filter* filter, uint64_t kmer_int) {
+    uint64_t masks[BLOOM_WORDS_PER_BLOCK];
+    uint64_t* block = bloom_filter_block(filter, kmer_int, masks);
+    int i;
+
+    for (i = 0; i < BLOOM_WORDS_PER_BLOCK; i++)
+    {
+        __atomic_fetch_or(&block[i], masks[i], __ATOMIC_RELAXED);
+    }
+}
+
+/*
+ * Check whether a canonical integer k-mer might be in a Bloom filter.
+ *
+ * Args:
+ *     kmer_int: the canonical integer representation of the k-mer
+ *     filter: the Bloom filter in which to look up the k-mer
+ *
+ * Returns: 0 if the k-mer is definitely not in the filter, 1 if it might be
+ */
+int kmer_in_bloom_filter(uint64_t kmer_int, bloom_filter* filter) {
+    uint64_t masks[BLOOM_WORDS_PER_BLOCK];
+    uint64_t* block = bloom_filter_block(filter, kmer_int, masks);
+    uint64_t missing = 0;
+    int i;
+
+    // checking every word without branching is cheaper than stopping at the
+    // first missing bit, since the whole block is in one cache line anyway
+    for (i = 0; i < BLOOM_WORDS_PER_BLOCK; i++)
+    {
+        missing |= masks[i] & ~block[i];
+    }
+
+    return missing == 0;
+}
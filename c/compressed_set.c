@@ -0,0 +1,342 @@
+#include "kmers.h"
+
+/*
+ * Choose the number of low bits of each k-mer that a compressed set stores
+ * explicitly: the rest, the high bits, number about log2(num_kmers), so
+ * that there are about as many buckets as k-mers.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers in the set
+ *     k: the k-mer size
+ *
+ * Returns: the number of low bits
+ */
+unsigned char compressed_set_low_bits(uint64_t num_kmers, unsigned char k) {
+    unsigned char high_bits = 0;
+
+    while (high_bits < 2 * k && (UINT64_C(1) << high_bits) < num_kmers)
+    {
+        high_bits++;
+    }
+
+    return 2 * k - high_bits;
+}
+
+/*
+ * Get the number of buckets of a compressed set, i.e., the number of
+ * possible values of the high bits of a k-mer
+ */
+static uint64_t compressed_set_buckets(unsigned char low_bits, unsigned char k) {
+    return UINT64_C(1) << (2 * k - low_bits);
+}
+
+/*
+ * Get the sizes, in 64-bit words, of the arrays of a compressed set.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers in the set
+ *     k: the k-mer size
+ *     high_words: set to the length of `high`
+ *     low_words: set to the length of `low`
+ *     sample_words: set to the length of `samples`
+ */
+void compressed_set_sizes(
+    uint64_t num_kmers,
+    unsigned char k,
+    uint64_t* high_words,
+    uint64_t* low_words,
+    uint64_t* sample_words
+) {
+    unsigned char low_bits = compressed_set_low_bits(num_kmers, k);
+    uint64_t num_buckets = compressed_set_buckets(low_bits, k);
+
+    // one extra word on the end of each bit array, so that reading a value
+    // that ends in the last word never needs to check for the end
+    *high_words = (num_kmers + num_buckets + 63) / 64 + 1;
+    *low_words = (num_kmers * low_bits + 63) / 64 + 1;
+    *sample_words = num_buckets / COMPRESSED_SAMPLE_RATE + 1;
+}
+
+/*
+ * Estimate the memory needed for a compressed set, so that it can be
+ * reported before attempting to allocate it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *     k: the k-mer size
+ *
+ * Returns: the number of bytes the finished compressed set takes up
+ */
+uint64_t estimate_compressed_set_memory(uint64_t num_kmers, unsigned char k) {
+    uint64_t high_words, low_words, sample_words;
+
+    compressed_set_sizes(num_kmers, k, &high_words, &low_words, &sample_words);
+    return sizeof(compressed_set)
+        + (high_words + low_words + sample_words
+            + sorted_set_labels_size(num_kmers)) * sizeof(uint64_t);
+}
+
+/*
+ * Get the high bits of a k-mer, i.e., its bucket
+ */
+static inline uint64_t high_part(uint64_t kmer_int, unsigned char low_bits) {
+    return low_bits < 64 ? kmer_int >> low_bits : 0;
+}
+
+/*
+ * Get the `low_bits` low bits of the i-th k-mer in a compressed set
+ */
+static inline uint64_t get_low_part(compressed_set* set, uint64_t i) {
+    uint64_t position = i * set->low_bits;
+    uint64_t word = position / 64, offset = position % 64;
+    uint64_t value;
+
+    if (set->low_bits == 0)
+        return 0;
+
+    value = set->low[word] >> offset;
+    if (offset + set->low_bits > 64)
+        value |= set->low[word + 1] << (64 - offset);
+
+    return set->low_bits < 64
+        ? value & ((UINT64_C(1) << set->low_bits) - 1)
+        : value;
+}
+
+/*
+ * Compress a sorted set into a new compressed set.
+ *
+ * This is an Elias-Fano encoding: the low bits of each k-mer are packed
+ * one after another into `low`, and its high bits, which pick one of about
+ * num_kmers buckets, are written in unary into `high`, as a one for each
+ * k-mer followed by a zero at the end of each bucket. The sorted k-mers
+ * can then be stored in about 2 + 2k - log2(num_kmers) bits each.
+ *
+ * Args:
+ *     sorted: the sorted set to compress
+ *     k: the k-mer size
+ *
+ * Returns: the compressed set, or NULL if there is not enough memory for it
+ */
+compressed_set* create_compressed_set(sorted_set* sorted, unsigned char k) {
+    uint64_t high_words, low_words, sample_words, label_words, i, bucket;
+    uint64_t position, zeros = 0, low_value, low_position;
+    compressed_set* out_compressed_set;
+
+    compressed_set_sizes(
+        sorted->num_kmers, k, &high_words, &low_words, &sample_words
+    );
+    label_words = sorted_set_labels_size(sorted->num_kmers);
+
+    fprintf(
+        stderr,
+        "Compressing %" PRIu64 " k-mers, which needs %.2f GiB of memory.\n",
+        sorted->num_kmers,
+        (double) estimate_compressed_set_memory(sorted->num_kmers, k)
+            / (1 << 30)
+    );
+
+    out_compressed_set = malloc(sizeof(compressed_set));
+    out_compressed_set->num_kmers = sorted->num_kmers;
+    out_compressed_set->low_bits =
+        compressed_set_low_bits(sorted->num_kmers, k);
+    out_compressed_set->high = calloc(high_words, sizeof(uint64_t));
+    out_compressed_set->low = calloc(low_words, sizeof(uint64_t));
+    out_compressed_set->samples = malloc(sample_words * sizeof(uint64_t));
+    out_compressed_set->labels = malloc(label_words * sizeof(uint64_t) + 1);
+    if (
+        !out_compressed_set->high
+        || !out_compressed_set->low
+        || !out_compressed_set->samples
+        || !out_compressed_set->labels
+    )
+    {
+        fprintf(stderr, "Could not allocate memory for compressed set.\n");
+        free_compressed_set(out_compressed_set);
+        return NULL;
+    }
+
+    for (i = 0; i < sorted->num_kmers; i++)
+    {
+        // the i-th k-mer is the i-th one, so it goes after i ones and as
+        // many zeros as there are buckets before its own
+        bucket = high_part(sorted->kmers[i], out_compressed_set->low_bits);
+        position = bucket + i;
+        out_compressed_set->high[position / 64] |= UINT64_C(1) << (position % 64);
+
+        if (out_compressed_set->low_bits == 0)
+            continue;
+        low_value = out_compressed_set->low_bits < 64
+            ? sorted->kmers[i]
+                & ((UINT64_C(1) << out_compressed_set->low_bits) - 1)
+            : sorted->kmers[i];
+        low_position = i * out_compressed_set->low_bits;
+        out_compressed_set->low[low_position / 64] |=
+            low_value << (low_position % 64);
+        if (low_position % 64 + out_compressed_set->low_bits > 64)
+        {
+            out_compressed_set->low[low_position / 64 + 1] |=
+                low_value >> (64 - low_position % 64);
+        }
+    }
+
+    // record where every COMPRESSED_SAMPLE_RATE-th bucket starts, so that a
+    // lookup only has to scan from the nearest one
+    out_compressed_set->samples[0] = 0;
+    for (
+        position = 0;
+        position < sorted->num_kmers
+            + compressed_set_buckets(out_compressed_set->low_bits, k);
+        position++
+    )
+    {
+        if (!((out_compressed_set->high[position / 64] >> (position % 64)) & 1))
+        {
+            zeros++;
+            if (zeros % COMPRESSED_SAMPLE_RATE == 0)
+                out_compressed_set->samples[zeros / COMPRESSED_SAMPLE_RATE] =
+                    position + 1;
+        }
+    }
+
+    memcpy(
+        out_compressed_set->labels,
+        sorted->labels,
+        label_words * sizeof(uint64_t)
+    );
+
+    return out_compressed_set;
+}
+
+/*
+ * Free a compressed set and the arrays inside of it.
+ */
+void free_compressed_set(compressed_set* set) {
+    free(set->high);
+    free(set->low);
+    free(set->samples);
+    free(set->labels);
+    free(set);
+}
+
+/*
+ * Find where a bucket starts in the high bits of a compressed set, by
+ * skipping zeros from the nearest sampled bucket a word at a time.
+ *
+ * Args:
+ *     set: the compressed set
+ *     bucket: the bucket to find
+ *
+ * Returns: the position in `high` of the first bit of the bucket
+ */
+static inline uint64_t find_bucket(compressed_set* set, uint64_t bucket) {
+    uint64_t position = set->samples[bucket / COMPRESSED_SAMPLE_RATE];
+    uint64_t to_skip = bucket % COMPRESSED_SAMPLE_RATE;
+    uint64_t word = position / 64, zeros;
+    int i;
+
+    if (to_skip == 0)
+        return position;
+
+    // zeros in the current word, not counting those before `position`
+    zeros = ~set->high[word] & (~UINT64_C(0) << (position % 64));
+    while ((uint64_t) __builtin_popcountll(zeros) < to_skip)
+    {
+        to_skip -= __builtin_popcountll(zeros);
+        zeros = ~set->high[++word];
+    }
+
+    // the bucket starts just after the to_skip-th zero in this word
+    for (i = 1; (uint64_t) i < to_skip; i++)
+    {
+        zeros &= zeros - 1;
+    }
+    return word * 64 + __builtin_ctzll(zeros) + 1;
+}
+
+/*
+ * Look up a canonical integer k-mer in a compressed set.
+ *
+ * Args:
+ *     kmer_int: the canonical integer representation of the k-mer, i.e.,
+ *         the lesser of the k-mer and its reverse complement
+ *     set: compressed set in which to look up the k-mer
+ *
+ * Returns: the haplotype label of the k-mer if it is in the set, EMPTY
+ *     otherwise
+ */
+unsigned char kmer_in_compressed_set(uint64_t kmer_int, compressed_set* set) {
+    uint64_t bucket = high_part(kmer_int, set->low_bits);
+    uint64_t low_value = set->low_bits < 64
+        ? kmer_int & ((UINT64_C(1) << set->low_bits) - 1)
+        : kmer_int;
+    uint64_t position = find_bucket(set, bucket);
+    uint64_t i = position - bucket, value;
+
+    // the k-mers in a bucket are sorted by their low bits
+    while ((set->high[position / 64] >> (position % 64)) & 1)
+    {
+        value = get_low_part(set, i);
+        if (value == low_value)
+        {
+            return (set->labels[i / 64] >> (i % 64)) & 1
+                ? HAPLOTYPE_B
+                : HAPLOTYPE_A;
+        }
+        if (value > low_value)
+            break;
+        position++;
+        i++;
+    }
+
+    return EMPTY;
+}
+
+/*
+ * Count the k-mers in a read that are unique to each haplotype, looking
+ * each one up in a compressed set as soon as it is encoded.
+ *
+ * Args:
+ *     read: sequence of the read, which need not be null-terminated
+ *     read_length: the number of bases in `read`
+ *     set: compressed set of k-mers labelled by haplotype
+ *     bloom: Bloom filter of the k-mers in `set`, to rule out most k-mers
+ *         before looking them up, or NULL to look up every k-mer
+ *     k: the k-mer size of the compressed set
+ *     count_A: set to the number of k-mers in the read unique to haplotype A
+ *     count_B: set to the number of k-mers in the read unique to haplotype B
+ */
+void count_kmers_in_read_compressed(
+    char* read,
+    uint64_t read_length,
+    compressed_set* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    int* count_A,
+    int* count_B
+) {
+    kmer_roller roller;
+    uint64_t canonical;
+    uint64_t i;
+
+    *count_A = 0;
+    *count_B = 0;
+
+    init_kmer_roller(&roller, k);
+    for (i = 0; i < read_length; i++)
+    {
+        if (!roll_kmer(&roller, read[i], &canonical))
+            continue;
+        if (bloom && !kmer_in_bloom_filter(canonical, bloom))
+            continue;
+
+        switch (kmer_in_compressed_set(canonical, set)) {
+            case HAPLOTYPE_A:
+                (*count_A)++;
+                break;
+            case HAPLOTYPE_B:
+                (*count_B)++;
+                break;
+        }
+    }
+}
@@ -0,0 +1,278 @@
+#include "kmers.h"
+
+/*
+ * The 64-bit finalizer of MurmurHash3, which mixes every bit of the input
+ * into every bit of the output.
+ */
+uint64_t hash_function(uint64_t x) {
+    x ^= x >> 33;
+    x *= UINT64_C(0xff51afd7ed558ccd);
+    x ^= x >> 33;
+    x *= UINT64_C(0xc4ceb9fe1a85ec53);
+    x ^= x >> 33;
+    return x;
+}
+
+/*
+ * Choose the size of a hash set: the smallest power of two that keeps the
+ * load factor below HASH_MAX_LOAD_PERCENT percent.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: the number of slots the hash set should have
+ */
+uint64_t hash_set_size(uint64_t num_kmers) {
+    uint64_t hash_size = 1;
+
+    while (hash_size * HASH_MAX_LOAD_PERCENT <= num_kmers * 100)
+    {
+        hash_size <<= 1;
+    }
+
+    return hash_size;
+}
+
+/*
+ * Estimate the memory needed for a hash set, so that it can be reported
+ * before attempting to allocate it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: the number of bytes `initialize_hash_set` will allocate
+ */
+uint64_t estimate_hash_set_memory(uint64_t num_kmers) {
+    uint64_t hash_size = hash_set_size(num_kmers);
+    return sizeof(hash_set)
+        + hash_size * (sizeof(uint64_t) + sizeof(unsigned char));
+}
+
+/*
+ * Initialize a new hash_set struct. Allocate memory for both the
+ * struct itself and the arrays inside of it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside.
+ *         This information is needed to figure out how much space to
+ *         allocate for it.
+ *
+ * Returns: a new hash set that's ready to start adding stuff to, or NULL
+ *     if there is not enough memory for it
+ */
+hash_set* initialize_hash_set(uint64_t num_kmers) {
+    uint64_t i, hash_size, memory;
+    hash_set* out_hash_set;
+
+    hash_size = hash_set_size(num_kmers);
+    memory = estimate_hash_set_memory(num_kmers);
+
+    fprintf(
+        stderr,
+        "Allocating hash of %" PRIu64 " slots for %" PRIu64 " k-mers, "
+        "%.0f%% full, which needs %.2f GiB of memory, or %.1f bytes per "
+        "k-mer.\n",
+        hash_size,
+        num_kmers,
+        100.0 * num_kmers / hash_size,
+        (double) memory / (1 << 30),
+        (double) memory / (num_kmers ? num_kmers : 1)
+    );
+
+    out_hash_set = malloc(sizeof(hash_set));
+    out_hash_set->hash_size = hash_size;
+    //NOLINTNEXTLINE
+    out_hash_set->kmers = (uint64_t*) malloc(
+        out_hash_set->hash_size * sizeof(uint64_t)
+    );
+    out_hash_set->labels = (unsigned char*) malloc(
+        out_hash_set->hash_size * sizeof(unsigned char)
+    );
+    if (!out_hash_set->kmers || !out_hash_set->labels)
+    {
+        fprintf(stderr, "Could not allocate memory for hash.\n");
+        free_hash_set(out_hash_set);
+        return NULL;
+    }
+    for (i = 0; i < out_hash_set->hash_size; i++) {
+        out_hash_set->kmers[i] = EMPTY_KMER;
+    }
+
+    return out_hash_set;
+}
+
+/*
+ * Free a hash set and the arrays inside of it.
+ */
+void free_hash_set(hash_set* set) {
+    free(set->kmers);
+    free(set->labels);
+    free(set);
+}
+
+/*
+ * Add a canonical integer k-mer to the hash, unless it would have to be
+ * placed at or beyond a given slot.
+ *
+ * If the k-mer is already in the hash, it keeps the lesser of its
+ * existing label and the new one, so that a k-mer listed for both
+ * haplotypes counts towards haplotype A.
+ *
+ * Args:
+ *     set: the set to add the k-mer to (modifies)
+ *     kmer_int: the canonical integer representation of the k-mer. If the
+ *         insertion stops at `limit`, set to the k-mer that still needs a
+ *         place, which may be one that the new k-mer displaced. (modifies)
+ *     label: the haplotype label of the k-mer, likewise set to the label
+ *         of the k-mer that still needs a place (modifies)
+ *     limit: the slot at which to stop, or hash_size to never stop. Slots
+ *         from the k-mer's home slot up to, but not including, this one may
+ *         be written to.
+ *
+ * Returns: 1 if the k-mer was added, 0 if the insertion stopped at `limit`
+ */
+int add_int_to_hash_within(
+    hash_set* set,
+    uint64_t* kmer_int,
+    unsigned char* label,
+    uint64_t limit
+) {
+    uint64_t mask = set->hash_size - 1;
+    uint64_t position = hash_function(*kmer_int) & mask;
+    uint64_t distance = 0, resident_distance, swap_kmer;
+    unsigned char swap_label;
+
+    while (set->kmers[position] != EMPTY_KMER)
+    {
+        if (position == limit)
+            return 0;
+
+        if (set->kmers[position] == *kmer_int)
+        {
+            if (*label < set->labels[position])
+                set->labels[position] = *label;
+            return 1;
+        }
+
+        // if the resident k-mer is closer to its home slot than this one
+        // is, this one takes its place and the search continues for a new
+        // place for the resident
+        resident_distance =
+            (position - hash_function(set->kmers[position])) & mask;
+        if (resident_distance < distance)
+        {
+            swap_kmer = set->kmers[position];
+            swap_label = set->labels[position];
+            set->kmers[position] = *kmer_int;
+            set->labels[position] = *label;
+            *kmer_int = swap_kmer;
+            *label = swap_label;
+            distance = resident_distance;
+        }
+
+        position = (position + 1) & mask;
+        distance++;
+    }
+
+    if (position == limit)
+        return 0;
+
+    set->kmers[position] = *kmer_int;
+    set->labels[position] = *label;
+    return 1;
+}
+
+/*
+ * Add a canonical integer k-mer to the hash.
+ *
+ * Args:
+ *     set: the set to add the k-mer to (modifies)
+ *     kmer_int: the canonical integer representation of the k-mer
+ *     label: the haplotype label of the k-mer
+ */
+void add_int_to_hash(hash_set* set, uint64_t kmer_int, unsigned char label) {
+    add_int_to_hash_within(set, &kmer_int, &label, set->hash_size);
+}
+
+/*
+ * Look up a canonical integer k-mer in a hash set.
+ *
+ * Args:
+ *     kmer_int: the canonical integer representation of the k-mer, i.e.,
+ *         the lesser of the k-mer and its reverse complement
+ *     set: hash set in which to look up the k-mer
+ *
+ * Returns: the haplotype label of the k-mer if it is in the set, EMPTY
+ *     otherwise
+ */
+unsigned char kmer_in_hash_set(uint64_t kmer_int, hash_set* set) {
+    uint64_t mask = set->hash_size - 1;
+    uint64_t position = hash_function(kmer_int) & mask;
+    uint64_t distance = 0, resident;
+
+    while ((resident = set->kmers[position]) != kmer_int)
+    {
+        // Robin Hood placement means the k-mer would have displaced any
+        // resident closer to its home slot than the k-mer is to its own
+        if (
+            resident == EMPTY_KMER
+            || ((position - hash_function(resident)) & mask) < distance
+        )
+        {
+            return EMPTY;
+        }
+        position = (position + 1) & mask;
+        distance++;
+    }
+
+    return set->labels[position];
+}
+
+/*
+ * Count the k-mers in a read that are unique to each haplotype, looking
+ * each one up in a hash set as soon as it is encoded.
+ *
+ * Args:
+ *     read: sequence of the read, which need not be null-terminated
+ *     read_length: the number of bases in `read`
+ *     set: hash set of k-mers labelled by haplotype
+ *     bloom: Bloom filter of the k-mers in `set`, to rule out most k-mers
+ *         before looking them up, or NULL to look up every k-mer
+ *     k: the k-mer size of the hash set
+ *     count_A: set to the number of k-mers in the read unique to haplotype A
+ *     count_B: set to the number of k-mers in the read unique to haplotype B
+ */
+void count_kmers_in_read_hash(
+    char* read,
+    uint64_t read_length,
+    hash_set* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    int* count_A,
+    int* count_B
+) {
+    kmer_roller roller;
+    uint64_t canonical;
+    uint64_t i;
+
+    *count_A = 0;
+    *count_B = 0;
+
+    init_kmer_roller(&roller, k);
+    for (i = 0; i < read_length; i++)
+    {
+        if (!roll_kmer(&roller, read[i], &canonical))
+            continue;
+        if (bloom && !kmer_in_bloom_filter(canonical, bloom))
+            continue;
+
+        switch (kmer_in_hash_set(canonical, set)) {
+            case HAPLOTYPE_A:
+                (*count_A)++;
+                break;
+            case HAPLOTYPE_B:
+                (*count_B)++;
+                break;
+        }
+    }
+}
@@ -0,0 +1,209 @@
+#include "kmers.h"
+
+/*
+ * Hash a 128-bit k-mer
+ */
+static inline uint64_t hash_function_128(uint128_t x) {
+    return hash_function(fold_kmer_128(x));
+}
+
+/*
+ * Estimate the memory needed for a 128-bit hash set, so that it can be
+ * reported before attempting to allocate it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: the number of bytes `initialize_hash_set_128` will allocate
+ */
+uint64_t estimate_hash_set_128_memory(uint64_t num_kmers) {
+    uint64_t hash_size = hash_set_size(num_kmers);
+    return sizeof(hash_set_128)
+        + hash_size * (sizeof(uint128_t) + sizeof(unsigned char));
+}
+
+/*
+ * Initialize a new hash_set_128 struct. Allocate memory for both the
+ * struct itself and the arrays inside of it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: a new hash set that's ready to start adding stuff to, or NULL
+ *     if there is not enough memory for it
+ */
+hash_set_128* initialize_hash_set_128(uint64_t num_kmers) {
+    uint64_t i, hash_size, memory;
+    hash_set_128* out_hash_set;
+
+    hash_size = hash_set_size(num_kmers);
+    memory = estimate_hash_set_128_memory(num_kmers);
+
+    fprintf(
+        stderr,
+        "Allocating hash of %" PRIu64 " slots for %" PRIu64 " long k-mers, "
+        "%.0f%% full, which needs %.2f GiB of memory, or %.1f bytes per "
+        "k-mer.\n",
+        hash_size,
+        num_kmers,
+        100.0 * num_kmers / hash_size,
+        (double) memory / (1 << 30),
+        (double) memory / (num_kmers ? num_kmers : 1)
+    );
+
+    out_hash_set = malloc(sizeof(hash_set_128));
+    out_hash_set->hash_size = hash_size;
+    out_hash_set->kmers = malloc(hash_size * sizeof(uint128_t));
+    out_hash_set->labels = malloc(hash_size * sizeof(unsigned char));
+    if (!out_hash_set->kmers || !out_hash_set->labels)
+    {
+        fprintf(stderr, "Could not allocate memory for hash.\n");
+        free_hash_set_128(out_hash_set);
+        return NULL;
+    }
+    for (i = 0; i < hash_size; i++) {
+        out_hash_set->kmers[i] = EMPTY_KMER_128;
+    }
+
+    return out_hash_set;
+}
+
+/*
+ * Free a 128-bit hash set and the arrays inside of it.
+ */
+void free_hash_set_128(hash_set_128* set) {
+    free(set->kmers);
+    free(set->labels);
+    free(set);
+}
+
+/*
+ * Add a canonical 128-bit k-mer to the hash, in the same way as
+ * `add_int_to_hash`.
+ *
+ * Args:
+ *     set: the set to add the k-mer to (modifies)
+ *     kmer_int: the canonical integer representation of the k-mer
+ *     label: the haplotype label of the k-mer
+ */
+void add_int_to_hash_128(
+    hash_set_128* set,
+    uint128_t kmer_int,
+    unsigned char label
+) {
+    uint64_t mask = set->hash_size - 1;
+    uint64_t position = hash_function_128(kmer_int) & mask;
+    uint64_t distance = 0, resident_distance;
+    uint128_t swap_kmer;
+    unsigned char swap_label;
+
+    while (set->kmers[position] != EMPTY_KMER_128)
+    {
+        if (set->kmers[position] == kmer_int)
+        {
+            if (label < set->labels[position])
+                set->labels[position] = label;
+            return;
+        }
+
+        resident_distance =
+            (position - hash_function_128(set->kmers[position])) & mask;
+        if (resident_distance < distance)
+        {
+            swap_kmer = set->kmers[position];
+            swap_label = set->labels[position];
+            set->kmers[position] = kmer_int;
+            set->labels[position] = label;
+            kmer_int = swap_kmer;
+            label = swap_label;
+            distance = resident_distance;
+        }
+
+        position = (position + 1) & mask;
+        distance++;
+    }
+
+    set->kmers[position] = kmer_int;
+    set->labels[position] = label;
+}
+
+/*
+ * Look up a canonical 128-bit k-mer in a hash set.
+ *
+ * Args:
+ *     kmer_int: the canonical integer representation of the k-mer
+ *     set: hash set in which to look up the k-mer
+ *
+ * Returns: the haplotype label of the k-mer if it is in the set, EMPTY
+ *     otherwise
+ */
+unsigned char kmer_in_hash_set_128(uint128_t kmer_int, hash_set_128* set) {
+    uint64_t mask = set->hash_size - 1;
+    uint64_t position = hash_function_128(kmer_int) & mask;
+    uint64_t distance = 0;
+    uint128_t resident;
+
+    while ((resident = set->kmers[position]) != kmer_int)
+    {
+        if (
+            resident == EMPTY_KMER_128
+            || ((position - hash_function_128(resident)) & mask) < distance
+        )
+        {
+            return EMPTY;
+        }
+        position = (position + 1) & mask;
+        distance++;
+    }
+
+    return set->labels[position];
+}
+
+/*
+ * Count the k-mers in a read that are unique to each haplotype, looking
+ * each one up in a 128-bit hash set as soon as it is encoded.
+ *
+ * Args:
+ *     read: sequence of the read, which need not be null-terminated
+ *     read_length: the number of bases in `read`
+ *     set: hash set of k-mers labelled by haplotype
+ *     bloom: Bloom filter of the folded k-mers in `set` (see
+ *         `fold_kmer_128`), or NULL to look up every k-mer
+ *     k: the k-mer size of the hash set
+ *     count_A: set to the number of k-mers in the read unique to haplotype A
+ *     count_B: set to the number of k-mers in the read unique to haplotype B
+ */
+void count_kmers_in_read_hash_128(
+    char* read,
+    uint64_t read_length,
+    hash_set_128* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    int* count_A,
+    int* count_B
+) {
+    kmer_roller_128 roller;
+    uint128_t canonical;
+    uint64_t i;
+
+    *count_A = 0;
+    *count_B = 0;
+
+    init_kmer_roller_128(&roller, k);
+    for (i = 0; i < read_length; i++)
+    {
+        if (!roll_kmer_128(&roller, read[i], &canonical))
+            continue;
+        if (bloom && !kmer_in_bloom_filter(fold_kmer_128(canonical), bloom))
+            continue;
+
+        switch (kmer_in_hash_set_128(canonical, set)) {
+            case HAPLOTYPE_A:
+                (*count_A)++;
+                break;
+            case HAPLOTYPE_B:
+                (*count_B)++;
+                break;
+        }
+    }
+}
@@ -1,41 +1,79 @@
-#define _GNU_SOURCE
-#include <stdint.h>
-#include <stdlib.h>
-#include <stdio.h>
-#include <sys/types.h>
-#include <string.h>
+#include "kmers.h"
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/vfs.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <unistd.h>
 #include <time.h>
 
 /*
- * Contains a hash set full of k-mers.
+ * Magic bytes and current format version of a binary k-mer index file
+ */
+#define INDEX_MAGIC "TRIOKIDX"
+#define INDEX_FORMAT_VERSION 4
+
+/*
+ * Header of a binary k-mer index file. The header is followed by the
+ * arrays of the index's Bloom filter and table (see `get_index_arrays`),
+ * exactly as they are laid out in memory, so that a file can be
+ * memory-mapped and used without any parsing. All values are in native byte order.
  */
 typedef struct {
-    /*
-     * Contains the integer-representation of kmers
-     */
-    uint64_t* kmers;
+    char magic[8];
+    uint32_t version;
+    uint32_t k;
+    uint32_t index_type;
+    uint32_t reserved;
 
     /*
-     * full[i] = 1 if kmers[i] contains a kmer, 0 otherwise
+     * The number of slots in a hash index, or of k-mers in a sorted or
+     * compressed index
      */
-    unsigned char* full;
+    uint64_t table_size;
 
     /*
-     * The size of the hash set, to be used as the length of `kmers` and `full`
-     * and as the divisor of the modulo operation during lookup
+     * The number of blocks in the Bloom filter, or 0 if there is none. The
+     * header is exactly one cache line long, so that the blocks that follow
+     * it stay aligned to cache lines when the file is memory-mapped.
      */
-    int hash_size;
+    uint64_t bloom_filter_blocks;
+    uint64_t num_kmers_A;
+    uint64_t num_kmers_B;
 
     /*
-     * The k-mer size
+     * Checksum of the arrays following the header
      */
-    unsigned char k;
+    uint64_t checksum;
+} index_header;
 
-    /*
-     * The number of k-mers in the hash set
-     */
-    int num_kmers;
-} hash_set;
+/*
+ * One of the arrays that make up the Bloom filter and table of a k-mer index
+ */
+typedef struct {
+    void* data;
+    size_t size;
+} index_array;
+
+#define NUM_INDEX_ARRAYS 5
+
+/*
+ * Prefix of the "path" of an index stored in a named POSIX shared memory
+ * object rather than a file
+ */
+#define SHARED_MEMORY_PREFIX "shm:"
+
+/*
+ * Magic number of hugetlbfs in the f_type of `struct statfs`
+ */
+#define HUGETLBFS_MAGIC 0x958458f6
+
+const unsigned char base_codes[256] = {
+    [0 ... 255] = 4,
+    ['A'] = 0, ['C'] = 1, ['G'] = 2, ['T'] = 3,
+    ['a'] = 0, ['c'] = 1, ['g'] = 2, ['t'] = 3,
+};
 
 
 /*
@@ -93,50 +131,135 @@ void reverse_complement(char* kmer_in, char* kmer_out, unsigned char k) {
 }
 
 /*
- * https://stackoverflow.com/questions/664014/
+ * Reverse complement the integer representation of a k-mer
+ *
+ * Args:
+ *     kmer_int: the integer representation of the k-mer
+ *     k: the length of the kmer (max 32)
+ *
+ * Returns: the integer representation of the reverse complement
+ */
+uint64_t reverse_complement_int(uint64_t kmer_int, unsigned char k) {
+    uint64_t revcomp_int = 0;
+    int i;
+
+    for (i = 0; i < k; i++)
+    {
+        revcomp_int = (revcomp_int << 2) | (3 - (kmer_int & 3));
+        kmer_int >>= 2;
+    }
+
+    return revcomp_int;
+}
+
+/*
+ * Convert a kmer string to the canonical integer representation, i.e.,
+ * the lesser of the k-mer and its reverse complement
+ */
+uint64_t kmer_to_canonical_int(char* kmer, unsigned char k) {
+    uint64_t kmer_int = kmer_to_int(kmer, k);
+    uint64_t revcomp_int = reverse_complement_int(kmer_int, k);
+
+    return kmer_int < revcomp_int ? kmer_int : revcomp_int;
+}
+
+/*
+ * Convert a kmer string to a 128-bit integer representation, in the same
+ * way as `kmer_to_int`
+ *
+ * Args:
+ *     kmer: the kmer string to convert
+ *     k: the length of the kmer (max 64)
+ *
+ * Returns: an integer representation of the k-mer
  */
-unsigned int hash_function(uint64_t x) {
-    x = ((x >> 16) ^ x) * 0x45d9f3b;
-    x = ((x >> 16) ^ x) * 0x45d9f3b;
-    x = (x >> 16) ^ x;
-    return (unsigned int) x;
+uint128_t kmer_to_int_128(char* kmer, unsigned char k) {
+    uint128_t kmer_int = 0;
+    int i;
+
+    for (i = 0; i < k; i++)
+    {
+        kmer_int |=
+            (uint128_t) (base_codes[(unsigned char) kmer[i]] & 3) << (i*2);
+    }
+
+    return kmer_int;
 }
 
 /*
- * Add a k-mer to the hash.
+ * Reverse complement the 128-bit integer representation of a k-mer
  *
  * Args:
- *     set: the set to add the k-mer to (modifies)
- *     kmer: the k-mer string to add to the set
+ *     kmer_int: the integer representation of the k-mer
+ *     k: the length of the kmer (max 64)
+ *
+ * Returns: the integer representation of the reverse complement
  */
-void add_to_hash(hash_set* set, char* kmer) {
-    uint64_t kmer_int = kmer_to_int(kmer, set->k);
-    unsigned int position = hash_function(kmer_int) % set->hash_size;
-    while (set->full[position])
+uint128_t reverse_complement_int_128(uint128_t kmer_int, unsigned char k) {
+    uint128_t revcomp_int = 0;
+    int i;
+
+    for (i = 0; i < k; i++)
     {
-        position = (position + 1) % set->hash_size;
+        revcomp_int = (revcomp_int << 2) | (3 - (unsigned int) (kmer_int & 3));
+        kmer_int >>= 2;
     }
 
-    set->full[position] = 1;
-    set->kmers[position] = kmer_int;
+    return revcomp_int;
+}
+
+/*
+ * Convert a kmer string to the canonical 128-bit integer representation
+ */
+static uint128_t kmer_to_canonical_int_128(char* kmer, unsigned char k) {
+    uint128_t kmer_int = kmer_to_int_128(kmer, k);
+    uint128_t revcomp_int = reverse_complement_int_128(kmer_int, k);
+
+    return kmer_int < revcomp_int ? kmer_int : revcomp_int;
 }
 
+/*
+ * Count the k-mers in a file, one per line, and find their size.
+ *
+ * Args:
+ *     kmer_file_path: path to the file of k-mers
+ *     num_kmers: set to the number of k-mers in the file
+ *
+ * Returns: the k-mer size, i.e., the length of the first line, 0 if the
+ *     file is empty, or -1 if it cannot be opened
+ */
 int peek_at_file(char* kmer_file_path, uint64_t* num_kmers) {
     FILE* fp;
-    char* line_buffer = malloc(33 * sizeof(char));
+    char* line_buffer = NULL;
     int k;
-    size_t length = 0, characters;
+    size_t length = 0;
+    ssize_t characters;
 
+    *num_kmers = 0;
     fp = fopen(kmer_file_path, "r");
-    *num_kmers = 1;
+    if (!fp)
+    {
+        perror(kmer_file_path);
+        return -1;
+    }
     characters = getline(&line_buffer, &length, fp);
-    k = (int) characters - 1;
+    if (characters < 1)
+    {
+        free(line_buffer);
+        fclose(fp);
+        fprintf(stderr, "Found no k-mers in %s.\n", kmer_file_path);
+        return 0;
+    }
+    *num_kmers = 1;
+    k = (int) characters - (line_buffer[characters - 1] == '\n');
     while (getline(&line_buffer, &length, fp) != -1) {
         (*num_kmers)++;
     }
+    free(line_buffer);
+    fclose(fp);
     fprintf(
         stderr,
-        "Found %lu %d-mers in %s.\n",
+        "Found %" PRIu64 " %d-mers in %s.\n",
         *num_kmers,
         k,
         kmer_file_path
@@ -146,72 +269,63 @@ int peek_at_file(char* kmer_file_path, uint64_t* num_kmers) {
 }
 
 /*
- * Initialize a new hash_set struct. Allocate memory for both the
- * struct itself and the arrays inside of it.
+ * Function called by `read_kmer_file` with each k-mer in a file
  *
  * Args:
- *     k: the k-mer size of the hash
- *     num_kmers: the number of k-mers that are going to be put inside.
- *         This information is needed to figure out how much space to
- *         allocate for it.
- *
- * Returns: a new hash set that's ready to start adding stuff to
+ *     kmer: a line of the file, which starts with the k-mer
+ *     k: the k-mer size
+ *     label: the haplotype label of the k-mer
+ *     data: whatever was passed to `read_kmer_file` as `data`
  */
-hash_set* initialize_hash_set(int k, uint64_t num_kmers) {
-    int i;
-    hash_set* out_hash_set;
-
-    out_hash_set = malloc(sizeof(hash_set));
-    out_hash_set->k = k;
-    out_hash_set->num_kmers = num_kmers;
-    out_hash_set->hash_size = num_kmers * 4 / 3;
-    //NOLINTNEXTLINE
-    out_hash_set->kmers = (uint64_t*) malloc(
-        out_hash_set->hash_size * sizeof(uint64_t)
-    );
-    out_hash_set->full = (unsigned char*) malloc(
-        out_hash_set->hash_size * sizeof(unsigned char)
-    );
-    for (i = 0; i < out_hash_set->hash_size; i++) {
-        out_hash_set->full[i] = 0;
-    }
-
-    return out_hash_set;
-}
+typedef void (*kmer_callback)(
+    char* kmer,
+    unsigned char k,
+    unsigned char label,
+    void* data
+);
 
 /*
- * Create a new k-mer hash set from a file full of k-mers, one per line
+ * Read every k-mer in a file, one per line, reporting progress.
+ *
+ * Args:
+ *     kmer_file_path: path to the file of k-mers
+ *     k: the k-mer size
+ *     num_kmers: the number of k-mers in the file, for progress reports
+ *     label: the haplotype label to give the k-mers
+ *     callback: function to call with each k-mer
+ *     data: passed through to `callback`
  */
-hash_set* create_kmer_hash_set(char* kmer_file_path) {
-    int percent_done, i, k;
-    uint64_t num_kmers;
+void read_kmer_file(
+    char* kmer_file_path,
+    unsigned char k,
+    uint64_t num_kmers,
+    unsigned char label,
+    kmer_callback callback,
+    void* data
+) {
+    int percent_done;
+    uint64_t i;
     size_t length = 0;
     FILE* fp;
-    hash_set* out_hash_set;
     clock_t start, end;
     double time_elapsed;
 
-    char* line_buffer = malloc(33 * sizeof(char));
+    char* line_buffer = NULL;
 
-    // read through once to count number of kmers
-    k = peek_at_file(kmer_file_path, &num_kmers);
-
-    out_hash_set = initialize_hash_set(k, num_kmers);
-
-    fprintf(stderr, "Creating hash...\n");
+    fprintf(stderr, "Adding k-mers in %s to index...\n", kmer_file_path);
     fp = fopen(kmer_file_path, "r");
     start = clock();
     for (i = 0; getline(&line_buffer, &length, fp) != -1; i++) {
-        add_to_hash(out_hash_set, line_buffer);
+        callback(line_buffer, k, label, data);
         if (i % (num_kmers/10 + 1) == 0)
         {
             end = clock();
             time_elapsed = ((double) (end - start)) / CLOCKS_PER_SEC;
             start = end;
-            percent_done = 100 * (unsigned long) i / num_kmers;
+            percent_done = 100 * i / num_kmers;
             fprintf(
                 stderr,
-                "%d/%lu (%d%%) done in %fs\n",
+                "%" PRIu64 "/%" PRIu64 " (%d%%) done in %fs\n",
                 i,
                 num_kmers,
                 percent_done,
@@ -220,108 +334,1358 @@ hash_set* create_kmer_hash_set(char* kmer_file_path) {
         }
     }
 
-    fprintf(stderr, "Done!\n");
     // free up memory
     free(line_buffer);
     fclose(fp);
+}
+
+static void add_kmer_to_hash_set(
+    char* kmer,
+    unsigned char k,
+    unsigned char label,
+    void* data
+) {
+    add_int_to_hash((hash_set*) data, kmer_to_canonical_int(kmer, k), label);
+}
 
-    return out_hash_set;
+static void add_kmer_to_hash_set_128(
+    char* kmer,
+    unsigned char k,
+    unsigned char label,
+    void* data
+) {
+    add_int_to_hash_128(
+        (hash_set_128*) data, kmer_to_canonical_int_128(kmer, k), label
+    );
 }
 
+/*
+ * Destination of `append_kmer_to_array`
+ */
+typedef struct {
+    uint64_t* kmers;
+    uint64_t num_kmers;
+} kmer_array;
+
+static void append_kmer_to_array(
+    char* kmer,
+    unsigned char k,
+    unsigned char label,
+    void* data
+) {
+    kmer_array* array = (kmer_array*) data;
+
+    (void) label;
+    array->kmers[array->num_kmers++] = kmer_to_canonical_int(kmer, k);
+}
 
 /*
- * Check membership of a k-mer in a hash set.
+ * Read the k-mers in two files into a sorted set.
+ *
+ * Returns: the sorted set, or NULL if there is not enough memory for it
+ */
+static sorted_set* create_sorted_set_from_files(
+    char* hap_A_file_path,
+    uint64_t num_kmers_A,
+    char* hap_B_file_path,
+    uint64_t num_kmers_B,
+    unsigned char k,
+    int num_threads
+) {
+    kmer_array kmers_A, kmers_B;
+    sorted_set* out_sorted_set;
+    uint64_t larger = num_kmers_A > num_kmers_B ? num_kmers_A : num_kmers_B;
+
+    // the k-mers are read into one array per haplotype, which are then
+    // sorted with the help of a scratch array and merged into the set
+    fprintf(
+        stderr,
+        "Allocating sorted array for %" PRIu64 " k-mers, which needs %.2f GiB "
+        "of memory, and up to %.2f GiB while it is being built.\n",
+        num_kmers_A + num_kmers_B,
+        (double) estimate_sorted_set_memory(num_kmers_A + num_kmers_B)
+            / (1 << 30),
+        (double) (
+            (num_kmers_A + num_kmers_B + larger) * sizeof(uint64_t)
+            + estimate_sorted_set_memory(num_kmers_A + num_kmers_B)
+        ) / (1 << 30)
+    );
+
+    if (num_threads > 1)
+    {
+        kmers_A.kmers = read_kmer_file_parallel(
+            hap_A_file_path, k, num_threads, &kmers_A.num_kmers
+        );
+        kmers_B.kmers = read_kmer_file_parallel(
+            hap_B_file_path, k, num_threads, &kmers_B.num_kmers
+        );
+    }
+    else
+    {
+        kmers_A.kmers = malloc(num_kmers_A * sizeof(uint64_t) + 1);
+        kmers_A.num_kmers = 0;
+        kmers_B.kmers = malloc(num_kmers_B * sizeof(uint64_t) + 1);
+        kmers_B.num_kmers = 0;
+        if (kmers_A.kmers && kmers_B.kmers)
+        {
+            read_kmer_file(
+                hap_A_file_path, k, num_kmers_A, HAPLOTYPE_A,
+                append_kmer_to_array, &kmers_A
+            );
+            read_kmer_file(
+                hap_B_file_path, k, num_kmers_B, HAPLOTYPE_B,
+                append_kmer_to_array, &kmers_B
+            );
+        }
+    }
+    if (!kmers_A.kmers || !kmers_B.kmers)
+    {
+        fprintf(stderr, "Could not allocate memory for k-mers.\n");
+        free(kmers_A.kmers);
+        free(kmers_B.kmers);
+        return NULL;
+    }
+
+    out_sorted_set = create_sorted_set(
+        kmers_A.kmers, kmers_A.num_kmers, kmers_B.kmers, kmers_B.num_kmers, k,
+        num_threads
+    );
+
+    free(kmers_A.kmers);
+    free(kmers_B.kmers);
+    return out_sorted_set;
+}
+
+/*
+ * Add the k-mers of a k-mer index to a new Bloom filter.
  *
  * Args:
- *     kmer: kmer string to look up
- *     empty_kmer_buffer: preallocated buffer of size sizeof(char)*(k+1) for
- *         putting reverse complements in. Just a temporary place for this
- *         function to put stuff without having to allocate the space every
- *         single time it is run, for speed reasons
- *     set: hash set in which to check for k-mer membership
+ *     index: the index (modifies)
+ *     kmers: the k-mers to add, which may include empty hash slots
+ *         (EMPTY_KMER), which are skipped
+ *     num_slots: the length of `kmers`
+ *     num_kmers: the number of k-mers to make room for in the filter
+ *     num_threads: the number of threads to fill the filter with
  *
- * Returns: 1 if k-mer is in set, 0 otherwise
+ * Returns: 0 on success, -1 if there is not enough memory for the filter
  */
-char kmer_in_hash_set(char* kmer, char* empty_kmer_buffer, hash_set* set) {
-    uint64_t kmer_int, kmer_revcomp_int;
-    unsigned int position;
+static int add_bloom_filter(
+    kmer_index* index,
+    uint64_t* kmers,
+    uint64_t num_slots,
+    uint64_t num_kmers,
+    int num_threads
+) {
+    uint64_t i;
+
+    index->bloom = initialize_bloom_filter(num_kmers);
+    if (!index->bloom)
+        return -1;
+
+    fprintf(stderr, "Creating Bloom filter...\n");
+    if (num_threads > 1)
+    {
+        fill_bloom_filter_parallel(index->bloom, kmers, num_slots, num_threads);
+        return 0;
+    }
+    for (i = 0; i < num_slots; i++)
+    {
+        if (kmers[i] != EMPTY_KMER)
+            add_int_to_bloom_filter(index->bloom, kmers[i]);
+    }
+
+    return 0;
+}
 
-    // calculate the int representations of the kmer and its reverse
-    // complement, looking up only the lesser of the two
-    kmer_int = kmer_to_int(kmer, set->k);
-    reverse_complement(kmer, empty_kmer_buffer, set->k);
-    kmer_revcomp_int = kmer_to_int(empty_kmer_buffer, set->k);
+/*
+ * Add the folded k-mers (see `fold_kmer_128`) of a k-mer index with a
+ * 128-bit hash set to a new Bloom filter.
+ *
+ * Args:
+ *     index: the index, whose hash set is already filled (modifies)
+ *
+ * Returns: 0 on success, -1 if there is not enough memory for the filter
+ */
+static int add_bloom_filter_128(kmer_index* index) {
+    uint64_t i;
 
-    kmer_int = kmer_int < kmer_revcomp_int ? kmer_int : kmer_revcomp_int;
+    index->bloom = initialize_bloom_filter(
+        index->num_kmers_A + index->num_kmers_B
+    );
+    if (!index->bloom)
+        return -1;
 
-    position = hash_function(kmer_int) % set->hash_size;
-    while (set->full[position])
+    fprintf(stderr, "Creating Bloom filter...\n");
+    for (i = 0; i < index->hash_128->hash_size; i++)
     {
-        if (set->kmers[position] == kmer_int)
+        if (index->hash_128->kmers[i] != EMPTY_KMER_128)
         {
-            return 1;
+            add_int_to_bloom_filter(
+                index->bloom, fold_kmer_128(index->hash_128->kmers[i])
+            );
         }
-        position = (position + 1) % set->hash_size;
     }
 
     return 0;
 }
 
-void count_kmers_in_read(
+/*
+ * Create a new k-mer index from two files full of k-mers, one per line,
+ * containing the k-mers unique to haplotypes A and B respectively. Both
+ * haplotypes go into a single table, with each k-mer labelled by the
+ * haplotype it came from, so that a lookup needs only one search.
+ *
+ * Args:
+ *     hap_A_file_path: path to the file of k-mers unique to haplotype A
+ *     hap_B_file_path: path to the file of k-mers unique to haplotype B
+ *     index_type: the data structure to store the k-mers in, HASH_INDEX
+ *         for the fastest lookups, SORTED_INDEX to use less memory, or
+ *         COMPRESSED_INDEX to use the least
+ *     use_bloom_filter: if nonzero, also build a Bloom filter of the k-mers,
+ *         which rules out most k-mers that are not in the index before the
+ *         exact lookup, for about BLOOM_BITS_PER_KMER more bits per k-mer
+ *     num_threads: the number of threads to read the files and build the
+ *         index with. Indexes of k-mers longer than MAX_SHORT_K are always
+ *         built with one.
+ *
+ * Returns: the index, or NULL if the two files have different or
+ *     unsupported k-mer sizes or there is not enough memory for it
+ */
+kmer_index* create_kmer_index(
+    char* hap_A_file_path,
+    char* hap_B_file_path,
+    int index_type,
+    int use_bloom_filter,
+    int num_threads
+) {
+    int k_A, k_B;
+    uint64_t num_kmers_A, num_kmers_B;
+    kmer_index* out_index;
+    sorted_set* uncompressed;
+
+    // read through once to count number of kmers
+    if (num_threads > 1)
+    {
+        k_A = peek_at_file_parallel(hap_A_file_path, &num_kmers_A, num_threads);
+        k_B = peek_at_file_parallel(hap_B_file_path, &num_kmers_B, num_threads);
+    }
+    else
+    {
+        k_A = peek_at_file(hap_A_file_path, &num_kmers_A);
+        k_B = peek_at_file(hap_B_file_path, &num_kmers_B);
+    }
+    if (k_A < 0 || k_B < 0)
+        return NULL;
+    if (k_A != k_B)
+    {
+        fprintf(
+            stderr,
+            "k-mer sizes differ between %s (%d) and %s (%d).\n",
+            hap_A_file_path,
+            k_A,
+            hap_B_file_path,
+            k_B
+        );
+        return NULL;
+    }
+    if (k_A < 1 || k_A > MAX_K)
+    {
+        fprintf(
+            stderr,
+            "k-mer size %d is not supported; k must be between 1 and %d.\n",
+            k_A,
+            MAX_K
+        );
+        return NULL;
+    }
+    if (k_A > MAX_SHORT_K && index_type != HASH_INDEX)
+    {
+        fprintf(
+            stderr,
+            "Only hash indexes support k-mers longer than %d.\n",
+            MAX_SHORT_K
+        );
+        return NULL;
+    }
+
+    out_index = malloc(sizeof(kmer_index));
+    out_index->index_type = index_type;
+    out_index->k = k_A;
+    out_index->num_kmers_A = num_kmers_A;
+    out_index->num_kmers_B = num_kmers_B;
+    out_index->hash = NULL;
+    out_index->hash_128 = NULL;
+    out_index->sorted = NULL;
+    out_index->compressed = NULL;
+    out_index->bloom = NULL;
+    out_index->mapping = NULL;
+    out_index->mapping_size = 0;
+
+    switch (index_type) {
+        case HASH_INDEX:
+            if (k_A > MAX_SHORT_K)
+            {
+                out_index->hash_128 = initialize_hash_set_128(
+                    num_kmers_A + num_kmers_B
+                );
+                if (!out_index->hash_128)
+                    break;
+                fprintf(stderr, "Creating hash...\n");
+                read_kmer_file(
+                    hap_A_file_path, k_A, num_kmers_A, HAPLOTYPE_A,
+                    add_kmer_to_hash_set_128, out_index->hash_128
+                );
+                read_kmer_file(
+                    hap_B_file_path, k_A, num_kmers_B, HAPLOTYPE_B,
+                    add_kmer_to_hash_set_128, out_index->hash_128
+                );
+                if (use_bloom_filter)
+                    add_bloom_filter_128(out_index);
+                break;
+            }
+            out_index->hash = initialize_hash_set(num_kmers_A + num_kmers_B);
+            if (!out_index->hash)
+                break;
+            fprintf(stderr, "Creating hash...\n");
+            if (num_threads > 1)
+            {
+                if (
+                    fill_hash_set_parallel(
+                        out_index->hash, hap_A_file_path, k_A, HAPLOTYPE_A,
+                        num_threads
+                    )
+                    || fill_hash_set_parallel(
+                        out_index->hash, hap_B_file_path, k_A, HAPLOTYPE_B,
+                        num_threads
+                    )
+                )
+                {
+                    free_hash_set(out_index->hash);
+                    out_index->hash = NULL;
+                    break;
+                }
+            }
+            else
+            {
+                read_kmer_file(
+                    hap_A_file_path, k_A, num_kmers_A, HAPLOTYPE_A,
+                    add_kmer_to_hash_set, out_index->hash
+                );
+                read_kmer_file(
+                    hap_B_file_path, k_A, num_kmers_B, HAPLOTYPE_B,
+                    add_kmer_to_hash_set, out_index->hash
+                );
+            }
+            if (use_bloom_filter)
+            {
+                add_bloom_filter(
+                    out_index,
+                    out_index->hash->kmers,
+                    out_index->hash->hash_size,
+                    num_kmers_A + num_kmers_B,
+                    num_threads
+                );
+            }
+            break;
+        case SORTED_INDEX:
+            out_index->sorted = create_sorted_set_from_files(
+                hap_A_file_path, num_kmers_A, hap_B_file_path, num_kmers_B, k_A,
+                num_threads
+            );
+            if (out_index->sorted && use_bloom_filter)
+            {
+                add_bloom_filter(
+                    out_index,
+                    out_index->sorted->kmers,
+                    out_index->sorted->num_kmers,
+                    out_index->sorted->num_kmers,
+                    num_threads
+                );
+            }
+            break;
+        case COMPRESSED_INDEX:
+            // the k-mers are sorted first, and then compressed once it is
+            // known how many distinct ones there are
+            uncompressed = create_sorted_set_from_files(
+                hap_A_file_path, num_kmers_A, hap_B_file_path, num_kmers_B, k_A,
+                num_threads
+            );
+            if (!uncompressed)
+                break;
+            if (
+                !use_bloom_filter
+                || !add_bloom_filter(
+                    out_index,
+                    uncompressed->kmers,
+                    uncompressed->num_kmers,
+                    uncompressed->num_kmers,
+                    num_threads
+                )
+            )
+            {
+                out_index->compressed = create_compressed_set(uncompressed, k_A);
+            }
+            free_sorted_set(uncompressed);
+            break;
+        default:
+            fprintf(stderr, "Unknown index type %d.\n", index_type);
+    }
+
+    if (
+        (
+            !out_index->hash
+            && !out_index->hash_128
+            && !out_index->sorted
+            && !out_index->compressed
+        )
+        || (use_bloom_filter && !out_index->bloom)
+    )
+    {
+        free_kmer_index(out_index);
+        return NULL;
+    }
+
+    fprintf(stderr, "Done!\n");
+    return out_index;
+}
+
+/*
+ * Free a k-mer index and the table and Bloom filter inside of it.
+ */
+void free_kmer_index(kmer_index* index) {
+    if (index->mapping)
+    {
+        // the arrays of the table are part of the mapping
+        munmap(index->mapping, index->mapping_size);
+        free(index->hash);
+        free(index->hash_128);
+        free(index->sorted);
+        free(index->compressed);
+        free(index->bloom);
+    }
+    else
+    {
+        if (index->hash)
+            free_hash_set(index->hash);
+        if (index->hash_128)
+            free_hash_set_128(index->hash_128);
+        if (index->sorted)
+            free_sorted_set(index->sorted);
+        if (index->compressed)
+            free_compressed_set(index->compressed);
+        if (index->bloom)
+            free_bloom_filter(index->bloom);
+    }
+    free(index);
+}
+
+/*
+ * Get the arrays that make up the Bloom filter and table of a k-mer index,
+ * in the order they are stored in an index file. The Bloom filter comes
+ * first, so that its blocks directly follow the header; its array is empty
+ * if the index has no Bloom filter.
+ *
+ * Args:
+ *     index: the index
+ *     arrays: set to the NUM_INDEX_ARRAYS arrays of the index
+ *
+ * Returns: the number of slots or k-mers in the table
+ */
+static uint64_t get_index_arrays(kmer_index* index, index_array* arrays) {
+    uint64_t high_words, low_words, sample_words;
+    int i;
+
+    // index types with fewer arrays leave the rest empty
+    for (i = 0; i < NUM_INDEX_ARRAYS; i++)
+    {
+        arrays[i].data = NULL;
+        arrays[i].size = 0;
+    }
+
+    if (index->bloom)
+    {
+        arrays[0].data = index->bloom->blocks;
+        arrays[0].size =
+            index->bloom->num_blocks * BLOOM_WORDS_PER_BLOCK * sizeof(uint64_t);
+    }
+
+    switch (index->index_type) {
+        case HASH_INDEX:
+            if (index->hash_128)
+            {
+                arrays[1].data = index->hash_128->kmers;
+                arrays[1].size = index->hash_128->hash_size * sizeof(uint128_t);
+                arrays[2].data = index->hash_128->labels;
+                arrays[2].size =
+                    index->hash_128->hash_size * sizeof(unsigned char);
+                return index->hash_128->hash_size;
+            }
+            arrays[1].data = index->hash->kmers;
+            arrays[1].size = index->hash->hash_size * sizeof(uint64_t);
+            arrays[2].data = index->hash->labels;
+            arrays[2].size = index->hash->hash_size * sizeof(unsigned char);
+            return index->hash->hash_size;
+        case COMPRESSED_INDEX:
+            compressed_set_sizes(
+                index->compressed->num_kmers,
+                index->k,
+                &high_words,
+                &low_words,
+                &sample_words
+            );
+            arrays[1].data = index->compressed->high;
+            arrays[1].size = high_words * sizeof(uint64_t);
+            arrays[2].data = index->compressed->low;
+            arrays[2].size = low_words * sizeof(uint64_t);
+            arrays[3].data = index->compressed->samples;
+            arrays[3].size = sample_words * sizeof(uint64_t);
+            arrays[4].data = index->compressed->labels;
+            arrays[4].size =
+                sorted_set_labels_size(index->compressed->num_kmers)
+                * sizeof(uint64_t);
+            return index->compressed->num_kmers;
+        default:
+            arrays[1].data = index->sorted->kmers;
+            arrays[1].size = index->sorted->num_kmers * sizeof(uint64_t);
+            arrays[2].data = index->sorted->labels;
+            arrays[2].size =
+                sorted_set_labels_size(index->sorted->num_kmers)
+                * sizeof(uint64_t);
+            return index->sorted->num_kmers;
+    }
+}
+
+/*
+ * Point the Bloom filter and table of a k-mer index at arrays stored one
+ * after another in memory, as they are in an index file.
+ *
+ * Args:
+ *     index: the index, whose index_type and k are already set (modifies)
+ *     table_size: the number of slots or k-mers in the table
+ *     bloom_filter_blocks: the number of blocks in the Bloom filter, or 0
+ *         if there is none
+ *     data: the start of the arrays
+ *
+ * Returns: the total size of the arrays in bytes, or 0 if the table is
+ *     invalid
+ */
+static size_t set_index_arrays(
+    kmer_index* index,
+    uint64_t table_size,
+    uint64_t bloom_filter_blocks,
+    char* data
+) {
+    size_t bloom_filter_bytes =
+        bloom_filter_blocks * BLOOM_WORDS_PER_BLOCK * sizeof(uint64_t);
+    size_t table_bytes;
+    uint64_t high_words, low_words, sample_words;
+
+    if (index->k == 0 || index->k > MAX_K)
+        return 0;
+    if (index->k > MAX_SHORT_K && index->index_type != HASH_INDEX)
+        return 0;
+
+    if (bloom_filter_blocks)
+    {
+        index->bloom = malloc(sizeof(bloom_filter));
+        index->bloom->num_blocks = bloom_filter_blocks;
+        index->bloom->blocks = (uint64_t*) data;
+        data += bloom_filter_bytes;
+    }
+
+    switch (index->index_type) {
+        case HASH_INDEX:
+            // hash sizes are always powers of two
+            if (table_size == 0 || (table_size & (table_size - 1)))
+                return 0;
+            if (index->k > MAX_SHORT_K)
+            {
+                index->hash_128 = malloc(sizeof(hash_set_128));
+                index->hash_128->hash_size = table_size;
+                index->hash_128->kmers = (uint128_t*) data;
+                index->hash_128->labels = (unsigned char*) (
+                    data + table_size * sizeof(uint128_t)
+                );
+                table_bytes =
+                    table_size * (sizeof(uint128_t) + sizeof(unsigned char));
+                break;
+            }
+            index->hash = malloc(sizeof(hash_set));
+            index->hash->hash_size = table_size;
+            index->hash->kmers = (uint64_t*) data;
+            index->hash->labels = (unsigned char*) (
+                data + table_size * sizeof(uint64_t)
+            );
+            table_bytes =
+                table_size * (sizeof(uint64_t) + sizeof(unsigned char));
+            break;
+        case SORTED_INDEX:
+            index->sorted = malloc(sizeof(sorted_set));
+            index->sorted->num_kmers = table_size;
+            index->sorted->kmers = (uint64_t*) data;
+            index->sorted->labels = (uint64_t*) (
+                data + table_size * sizeof(uint64_t)
+            );
+            table_bytes = (table_size + sorted_set_labels_size(table_size))
+                * sizeof(uint64_t);
+            break;
+        case COMPRESSED_INDEX:
+            compressed_set_sizes(
+                table_size, index->k, &high_words, &low_words, &sample_words
+            );
+            index->compressed = malloc(sizeof(compressed_set));
+            index->compressed->num_kmers = table_size;
+            index->compressed->low_bits =
+                compressed_set_low_bits(table_size, index->k);
+            index->compressed->high = (uint64_t*) data;
+            index->compressed->low = index->compressed->high + high_words;
+            index->compressed->samples = index->compressed->low + low_words;
+            index->compressed->labels =
+                index->compressed->samples + sample_words;
+            table_bytes = (
+                high_words + low_words + sample_words
+                + sorted_set_labels_size(table_size)
+            ) * sizeof(uint64_t);
+            break;
+        default:
+            return 0;
+    }
+
+    return bloom_filter_bytes + table_bytes;
+}
+
+/*
+ * Compute a checksum of a block of memory, eight bytes at a time.
+ *
+ * Args:
+ *     data: the memory to checksum
+ *     size: the number of bytes to checksum
+ *     checksum: the checksum of any preceding blocks, or 0 for the first
+ *
+ * Returns: the updated checksum
+ */
+uint64_t update_checksum(const void* data, size_t size, uint64_t checksum) {
+    const unsigned char* bytes = data;
+    uint64_t word;
+    size_t i;
+
+    for (i = 0; i + sizeof(uint64_t) <= size; i += sizeof(uint64_t))
+    {
+        memcpy(&word, bytes + i, sizeof(uint64_t));
+        checksum = (checksum ^ word) * UINT64_C(0x100000001b3);
+        checksum ^= checksum >> 29;
+    }
+    for (; i < size; i++)
+    {
+        checksum = (checksum ^ bytes[i]) * UINT64_C(0x100000001b3);
+    }
+
+    return checksum;
+}
+
+/*
+ * Compute the checksum of the Bloom filter and table of a k-mer index
+ */
+uint64_t kmer_index_checksum(kmer_index* index) {
+    index_array arrays[NUM_INDEX_ARRAYS];
+    uint64_t checksum = 0;
+    int i;
+
+    get_index_arrays(index, arrays);
+    for (i = 0; i < NUM_INDEX_ARRAYS; i++)
+    {
+        checksum = update_checksum(arrays[i].data, arrays[i].size, checksum);
+    }
+
+    return checksum;
+}
+
+/*
+ * Find the name of the shared memory object an index "path" refers to, if
+ * it refers to one.
+ *
+ * Args:
+ *     index_file_path: path of an index file, or SHARED_MEMORY_PREFIX
+ *         followed by the name of a POSIX shared memory object
+ *     name: set to the name of the shared memory object, as passed to
+ *         `shm_open`, if there is one; must have room for NAME_MAX + 1
+ *         characters (modifies)
+ *
+ * Returns: 1 if the path refers to a shared memory object, 0 if it refers
+ *     to a file, or -1 with errno set if the name is not a valid one
+ */
+static int get_shared_memory_name(char* index_file_path, char* name) {
+    size_t prefix_length = strlen(SHARED_MEMORY_PREFIX);
+
+    if (strncmp(index_file_path, SHARED_MEMORY_PREFIX, prefix_length))
+        return 0;
+
+    // shared memory object names have a leading slash and no other one
+    index_file_path += prefix_length;
+    if (
+        !*index_file_path
+        || strchr(index_file_path, '/')
+        || strlen(index_file_path) + 1 > NAME_MAX
+    )
+    {
+        errno = EINVAL;
+        return -1;
+    }
+    name[0] = '/';
+    strcpy(name + 1, index_file_path);
+    return 1;
+}
+
+/*
+ * Open the file or shared memory object of an index.
+ *
+ * Args:
+ *     index_file_path: path of the index file, or SHARED_MEMORY_PREFIX
+ *         followed by the name of a POSIX shared memory object
+ *     flags: flags to open it with, as for `open`
+ *
+ * Returns: a file descriptor, or -1 on failure
+ */
+static int open_index_file(char* index_file_path, int flags) {
+    char name[NAME_MAX + 1];
+
+    switch (get_shared_memory_name(index_file_path, name)) {
+        case 0:
+            return open(index_file_path, flags, 0644);
+        case 1:
+            return shm_open(name, flags, 0644);
+        default:
+            return -1;
+    }
+}
+
+/*
+ * Find the size of the pages of the file system that an open file is on,
+ * if it is one that can only be mapped with huge pages.
+ *
+ * Returns: the page size if the file is on hugetlbfs, 0 otherwise
+ */
+static size_t huge_page_size(int fd) {
+    struct statfs fs_stat;
+
+    if (fstatfs(fd, &fs_stat) || (uint32_t) fs_stat.f_type != HUGETLBFS_MAGIC)
+        return 0;
+    return fs_stat.f_bsize;
+}
+
+/*
+ * Write a k-mer index to a file on hugetlbfs, which cannot be written to
+ * directly, by memory-mapping it. The file's size must be a multiple of
+ * the huge page size, so it is padded out to one, which `load_kmer_index`
+ * allows for.
+ *
+ * Args:
+ *     fd: file descriptor of the file, opened for reading and writing
+ *     header: the header of the index
+ *     arrays: the arrays of the index
+ *     page_size: the huge page size of the file system
+ *
+ * Returns: 0 on success, -1 on failure
+ */
+static int write_kmer_index_to_huge_pages(
+    int fd,
+    index_header* header,
+    index_array* arrays,
+    size_t page_size
+) {
+    size_t size = sizeof(index_header), offset;
+    char* mapping;
+    int i;
+
+    for (i = 0; i < NUM_INDEX_ARRAYS; i++)
+        size += arrays[i].size;
+    size = (size + page_size - 1) / page_size * page_size;
+
+    if (ftruncate(fd, size))
+        return -1;
+    mapping = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    if (mapping == MAP_FAILED)
+        return -1;
+
+    offset = sizeof(index_header);
+    for (i = 0; i < NUM_INDEX_ARRAYS; i++)
+    {
+        memcpy(mapping + offset, arrays[i].data, arrays[i].size);
+        offset += arrays[i].size;
+    }
+    // the header goes in last, so that the index is not recognized until
+    // all of it is in place
+    memcpy(mapping, header, sizeof(index_header));
+
+    return munmap(mapping, size);
+}
+
+/*
+ * Write a k-mer index to a newly created file or shared memory object.
+ *
+ * Args:
+ *     fd: file descriptor of the file, opened for reading and writing,
+ *         which is closed
+ *     header: the header of the index
+ *     arrays: the arrays of the index
+ *     index_file_path: the path the index is being written to, for error
+ *         messages
+ *
+ * Returns: 0 on success, -1 on failure
+ */
+static int write_kmer_index_to_fd(
+    int fd,
+    index_header* header,
+    index_array* arrays,
+    char* index_file_path
+) {
+    FILE* fp;
+    size_t page_size;
+    int i;
+
+    page_size = huge_page_size(fd);
+    if (page_size)
+    {
+        if (write_kmer_index_to_huge_pages(fd, header, arrays, page_size))
+        {
+            perror(index_file_path);
+            close(fd);
+            return -1;
+        }
+        return close(fd);
+    }
+
+    fp = fdopen(fd, "wb");
+    if (!fp)
+    {
+        perror(index_file_path);
+        close(fd);
+        return -1;
+    }
+
+    if (fwrite(header, sizeof(index_header), 1, fp) != 1)
+    {
+        perror(index_file_path);
+        fclose(fp);
+        return -1;
+    }
+    for (i = 0; i < NUM_INDEX_ARRAYS; i++)
+    {
+        if (fwrite(arrays[i].data, 1, arrays[i].size, fp) != arrays[i].size)
+        {
+            perror(index_file_path);
+            fclose(fp);
+            return -1;
+        }
+    }
+
+    if (fclose(fp))
+    {
+        perror(index_file_path);
+        return -1;
+    }
+
+    return 0;
+}
+
+/*
+ * Write a k-mer index to a binary file that can later be loaded
+ * with `load_kmer_index`.
+ *
+ * The index can also be written to a file on a tmpfs or hugetlbfs file
+ * system, or to a named POSIX shared memory object, from which every
+ * process that loads it shares the same copy in memory.
+ *
+ * An existing index at the same path is replaced rather than written over,
+ * since a process that has it loaded would crash if the file it has
+ * mapped were truncated. A file is written next to it under a temporary
+ * name and renamed over it, and a shared memory object is removed and
+ * created again, so that processes that have the old index loaded keep
+ * using it, as after `remove_kmer_index`.
+ *
+ * Args:
+ *     index: the index to write
+ *     index_file_path: path of the file to write to, or
+ *         SHARED_MEMORY_PREFIX followed by the name of a shared memory
+ *         object to create or replace
+ *
+ * Returns: 0 on success, -1 on failure
+ */
+int write_kmer_index(kmer_index* index, char* index_file_path) {
+    index_header header;
+    index_array arrays[NUM_INDEX_ARRAYS];
+    char name[NAME_MAX + 1];
+    char* temp_path = NULL;
+    int fd, result;
+
+    memset(&header, 0, sizeof(index_header));
+    memcpy(header.magic, INDEX_MAGIC, sizeof(header.magic));
+    header.version = INDEX_FORMAT_VERSION;
+    header.k = index->k;
+    header.index_type = index->index_type;
+    header.table_size = get_index_arrays(index, arrays);
+    header.bloom_filter_blocks = index->bloom ? index->bloom->num_blocks : 0;
+    header.num_kmers_A = index->num_kmers_A;
+    header.num_kmers_B = index->num_kmers_B;
+    header.checksum = kmer_index_checksum(index);
+
+    switch (get_shared_memory_name(index_file_path, name)) {
+        case 0:
+            // in the same directory, so that it can be renamed over the
+            // index without being copied
+            temp_path = malloc(strlen(index_file_path) + 32);
+            if (!temp_path)
+            {
+                fprintf(stderr, "Could not allocate memory for a path.\n");
+                return -1;
+            }
+            sprintf(temp_path, "%s.tmp%ld", index_file_path, (long) getpid());
+            fd = open(temp_path, O_RDWR | O_CREAT | O_TRUNC, 0644);
+            break;
+        case 1:
+            if (shm_unlink(name) && errno != ENOENT)
+            {
+                fd = -1;
+                break;
+            }
+            fd = shm_open(name, O_RDWR | O_CREAT | O_EXCL, 0644);
+            break;
+        default:
+            fd = -1;
+            break;
+    }
+    if (fd < 0)
+    {
+        perror(index_file_path);
+        free(temp_path);
+        return -1;
+    }
+
+    result = write_kmer_index_to_fd(fd, &header, arrays, index_file_path);
+    if (!result && temp_path && rename(temp_path, index_file_path))
+    {
+        perror(index_file_path);
+        result = -1;
+    }
+    // don't leave a partly written index behind
+    if (result)
+        remove_kmer_index(temp_path ? temp_path : index_file_path);
+
+    free(temp_path);
+    return result;
+}
+
+/*
+ * Load a k-mer index written by `write_kmer_index`.
+ *
+ * The file is memory-mapped rather than read, so loading takes about the
+ * same time regardless of the size of the index; pages are read in from
+ * disk (or shared from the page cache) as lookups touch them. An index in
+ * shared memory, on tmpfs or on hugetlbfs is used in place, without any
+ * copy of it being made.
+ *
+ * Args:
+ *     index_file_path: path of the index file, or SHARED_MEMORY_PREFIX
+ *         followed by the name of a shared memory object
+ *     verify: if nonzero, check the checksum of the whole index, which
+ *         requires reading all of it
+ *
+ * Returns: the index, or NULL if the file could not be loaded
+ */
+kmer_index* load_kmer_index(char* index_file_path, int verify) {
+    int fd;
+    struct stat file_stat;
+    void* mapping;
+    index_header* header;
+    kmer_index* out_index;
+    size_t arrays_size, page_size;
+
+    fd = open_index_file(index_file_path, O_RDONLY);
+    if (fd < 0)
+    {
+        perror(index_file_path);
+        return NULL;
+    }
+    if (fstat(fd, &file_stat))
+    {
+        perror(index_file_path);
+        close(fd);
+        return NULL;
+    }
+    if ((size_t) file_stat.st_size < sizeof(index_header))
+    {
+        fprintf(stderr, "%s is too small to be a k-mer index.\n", index_file_path);
+        close(fd);
+        return NULL;
+    }
+
+    page_size = huge_page_size(fd);
+    mapping = mmap(NULL, file_stat.st_size, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (mapping == MAP_FAILED)
+    {
+        perror(index_file_path);
+        return NULL;
+    }
+    // a tmpfs or shared memory index can be backed by transparent huge
+    // pages if the system allows it, which makes random lookups cheaper;
+    // this fails harmlessly for other files
+    madvise(mapping, file_stat.st_size, MADV_HUGEPAGE);
+
+    header = (index_header*) mapping;
+    if (memcmp(header->magic, INDEX_MAGIC, sizeof(header->magic)))
+    {
+        fprintf(stderr, "%s is not a k-mer index.\n", index_file_path);
+        munmap(mapping, file_stat.st_size);
+        return NULL;
+    }
+    if (header->version != INDEX_FORMAT_VERSION)
+    {
+        fprintf(
+            stderr,
+            "%s has index format version %u, but only version %d is "
+            "supported.\n",
+            index_file_path,
+            header->version,
+            INDEX_FORMAT_VERSION
+        );
+        munmap(mapping, file_stat.st_size);
+        return NULL;
+    }
+
+    out_index = malloc(sizeof(kmer_index));
+    out_index->index_type = header->index_type;
+    out_index->k = header->k;
+    out_index->num_kmers_A = header->num_kmers_A;
+    out_index->num_kmers_B = header->num_kmers_B;
+    out_index->hash = NULL;
+    out_index->hash_128 = NULL;
+    out_index->sorted = NULL;
+    out_index->compressed = NULL;
+    out_index->bloom = NULL;
+    out_index->mapping = mapping;
+    out_index->mapping_size = file_stat.st_size;
+
+    arrays_size = set_index_arrays(
+        out_index,
+        header->table_size,
+        header->bloom_filter_blocks,
+        (char*) mapping + sizeof(index_header)
+    );
+    // files on hugetlbfs are padded out to a whole number of pages
+    if (
+        arrays_size == 0
+        || (size_t) file_stat.st_size < sizeof(index_header) + arrays_size
+        || (size_t) file_stat.st_size
+            >= sizeof(index_header) + arrays_size + (page_size ? page_size : 1)
+    )
+    {
+        fprintf(stderr, "%s is truncated or corrupt.\n", index_file_path);
+        free_kmer_index(out_index);
+        return NULL;
+    }
+
+    if (verify && kmer_index_checksum(out_index) != header->checksum)
+    {
+        fprintf(stderr, "%s failed checksum verification.\n", index_file_path);
+        free_kmer_index(out_index);
+        return NULL;
+    }
+
+    return out_index;
+}
+
+/*
+ * Remove an index file or shared memory object written by
+ * `write_kmer_index`. Processes that have already loaded the index can
+ * keep using it; its memory is freed once the last of them is done.
+ *
+ * Args:
+ *     index_file_path: path of the index file, or SHARED_MEMORY_PREFIX
+ *         followed by the name of a shared memory object
+ *
+ * Returns: 0 on success, -1 on failure
+ */
+int remove_kmer_index(char* index_file_path) {
+    char name[NAME_MAX + 1];
+
+    switch (get_shared_memory_name(index_file_path, name)) {
+        case 0:
+            return unlink(index_file_path);
+        case 1:
+            return shm_unlink(name);
+        default:
+            return -1;
+    }
+}
+
+/*
+ * Count the k-mers in a stretch of a read that are unique to each haplotype,
+ * with whichever type of set the index is stored in.
+ *
+ * Args:
+ *     read: sequence of the stretch of the read
+ *     read_length: the number of bases in `read`
+ *     index: index of k-mers labelled by haplotype
+ *     buffer: memory for looking up the k-mers in a sorted index, of at
+ *         least `2 * read_length + 1` k-mers
+ *     count_A: set to the number of k-mers unique to haplotype A
+ *     count_B: set to the number of k-mers unique to haplotype B
+ */
+static void count_kmers_in_stretch(
     char* read,
-    hash_set* haplotype_A,
-    hash_set* haplotype_B,
+    uint64_t read_length,
+    kmer_index* index,
+    uint64_t* buffer,
     int* count_A,
     int* count_B
 ) {
-    int i, j;
-    char* kmer = malloc((haplotype_A->k + 1) * sizeof(char));
-    char* kmer_revcomp = malloc((haplotype_A->k + 1) * sizeof(char));
-    kmer[haplotype_A->k] = '\0';
+    switch (index->index_type) {
+        case HASH_INDEX:
+            if (index->hash_128)
+            {
+                count_kmers_in_read_hash_128(
+                    read, read_length, index->hash_128, index->bloom,
+                    index->k, count_A, count_B
+                );
+                break;
+            }
+            count_kmers_in_read_hash(
+                read, read_length, index->hash, index->bloom, index->k,
+                count_A, count_B
+            );
+            break;
+        case SORTED_INDEX:
+            count_kmers_in_read_sorted(
+                read, read_length, index->sorted, index->bloom, index->k,
+                buffer, count_A, count_B
+            );
+            break;
+        case COMPRESSED_INDEX:
+            count_kmers_in_read_compressed(
+                read, read_length, index->compressed, index->bloom,
+                index->k, count_A, count_B
+            );
+            break;
+    }
+}
 
-    *count_A = 0;
-    *count_B = 0;
+/*
+ * Check whether the scores of a read are far enough apart to decide it.
+ *
+ * If the k-mers of a read that are found in the index were equally likely
+ * to come from either haplotype, the difference between their scores would
+ * have a standard deviation of about the square root of their sum. A read
+ * is decided once the difference is at least `bound` of those standard
+ * deviations, which is compared squared to do without a square root.
+ */
+static inline int read_is_decided(double score_A, double score_B, double bound)
+{
+    double difference = score_A - score_B;
 
-    int read_length = strlen(read);
+    return difference != 0
+        && difference * difference >= bound * bound * (score_A + score_B);
+}
 
-    for (i = 0; i < read_length - haplotype_A->k + 1; i++)
+/*
+ * Count the k-mers in each of a batch of reads that are unique to each
+ * haplotype, stopping early on each read once it is decided.
+ *
+ * With a positive `bound`, the k-mers of each read are counted in stretches
+ * of DECISION_SEGMENT_LENGTH bases, and counting stops once its scaled
+ * scores, the counts times `scale_A` and `scale_B`, are at least `bound`
+ * standard deviations apart, as for `read_is_decided`. Most of a long read
+ * that clearly comes from one haplotype is then never looked at, and its
+ * counts are only those of the part that was. Otherwise, this is the same as
+ * `count_kmers_in_reads`.
+ *
+ * Args:
+ *     reads: the sequences of the reads, one after another, which need
+ *         not be separated or null-terminated
+ *     offsets: the `num_reads + 1` offsets into `reads` at which each read
+ *         starts, followed by the offset at which the last one ends
+ *     num_reads: the number of reads
+ *     index: index of k-mers labelled by haplotype
+ *     scale_A: factor to multiply the counts of haplotype A by
+ *     scale_B: factor to multiply the counts of haplotype B by
+ *     bound: the number of standard deviations apart the scores of a read
+ *         must be to stop counting its k-mers, or 0 never to stop early
+ *     counts_A: set to the number of k-mers counted in each read unique to
+ *         haplotype A (modifies)
+ *     counts_B: set to the number of k-mers counted in each read unique to
+ *         haplotype B (modifies)
+ *     scanned: set to the number of bases at the start of each read whose
+ *         k-mers were counted, which is its length unless it was decided
+ *         early, or NULL (modifies)
+ *
+ * Returns: 0 on success, -1 if the offsets are out of order or there is not
+ *     enough memory
+ */
+int count_kmers_in_reads_until_decided(
+    char* reads,
+    uint64_t* offsets,
+    uint64_t num_reads,
+    kmer_index* index,
+    double scale_A,
+    double scale_B,
+    double bound,
+    int* counts_A,
+    int* counts_B,
+    uint64_t* scanned
+) {
+    uint64_t i, read_length, start, end, longest = 0;
+    uint64_t* buffer = NULL;
+    char* read;
+    int count_A, count_B;
+
+    for (i = 0; i < num_reads; i++)
+    {
+        if (offsets[i + 1] < offsets[i])
+        {
+            fprintf(stderr, "Offset of read %" PRIu64 " is out of order.\n", i);
+            return -1;
+        }
+        if (offsets[i + 1] - offsets[i] > longest)
+            longest = offsets[i + 1] - offsets[i];
+    }
+
+    if (index->index_type == SORTED_INDEX)
+    {
+        buffer = malloc(2 * longest * sizeof(uint64_t) + 1);
+        if (!buffer)
+        {
+            fprintf(stderr, "Could not allocate memory for k-mers.\n");
+            return -1;
+        }
+    }
+
+    for (i = 0; i < num_reads; i++)
     {
-        for (j = 0; j < haplotype_A->k; j++)
-            kmer[j] = read[i+j];
-        if (kmer_in_hash_set(kmer, kmer_revcomp, haplotype_A))
-            (*count_A)++;
-        else if (kmer_in_hash_set(kmer, kmer_revcomp, haplotype_B))
-            (*count_B)++;
+        read = reads + offsets[i];
+        read_length = offsets[i + 1] - offsets[i];
+
+        if (bound <= 0)
+        {
+            count_kmers_in_stretch(
+                read, read_length, index, buffer, &counts_A[i], &counts_B[i]
+            );
+            if (scanned)
+                scanned[i] = read_length;
+            continue;
+        }
+
+        /* each stretch overlaps the next by k - 1 bases, so that every
+         * k-mer is in exactly one of them */
+        counts_A[i] = 0;
+        counts_B[i] = 0;
+        end = 0;
+        for (start = 0; end < read_length; start += DECISION_SEGMENT_LENGTH)
+        {
+            end = start + DECISION_SEGMENT_LENGTH + index->k - 1;
+            if (end > read_length)
+                end = read_length;
+            count_kmers_in_stretch(
+                read + start, end - start, index, buffer, &count_A, &count_B
+            );
+            counts_A[i] += count_A;
+            counts_B[i] += count_B;
+            if (
+                read_is_decided(
+                    counts_A[i] * scale_A, counts_B[i] * scale_B, bound
+                )
+            )
+            {
+                break;
+            }
+        }
+        if (scanned)
+            scanned[i] = end;
     }
 
-    free(kmer);
-    free(kmer_revcomp);
+    free(buffer);
+    return 0;
 }
 
-int main() {
-    fprintf(stderr, "Reading hapA k-mers into hash...\n");
-    hash_set* hapA = create_kmer_hash_set("hapA.txt");
-    fprintf(
-        stderr,
-        "Finished reading %d-mers into hash of size %d.\n",
-        hapA->k,
-        hapA->hash_size
+/*
+ * Count the k-mers in each of a batch of reads that are unique to each
+ * haplotype.
+ *
+ * The reads are stored one after another in a single buffer, so that a
+ * whole batch can be handed over at once, and any memory needed to look
+ * them up is allocated once for the batch rather than once per read.
+ * Windows containing a character other than [ACGTacgt] are skipped.
+ *
+ * Args:
+ *     reads: the sequences of the reads, one after another, which need
+ *         not be separated or null-terminated
+ *     offsets: the `num_reads + 1` offsets into `reads` at which each read
+ *         starts, followed by the offset at which the last one ends
+ *     num_reads: the number of reads
+ *     index: index of k-mers labelled by haplotype
+ *     counts_A: set to the number of k-mers in each read unique to
+ *         haplotype A (modifies)
+ *     counts_B: set to the number of k-mers in each read unique to
+ *         haplotype B (modifies)
+ *
+ * Returns: 0 on success, -1 if the offsets are out of order or there is not
+ *     enough memory
+ */
+int count_kmers_in_reads(
+    char* reads,
+    uint64_t* offsets,
+    uint64_t num_reads,
+    kmer_index* index,
+    int* counts_A,
+    int* counts_B
+) {
+    return count_kmers_in_reads_until_decided(
+        reads, offsets, num_reads, index, 1, 1, 0, counts_A, counts_B, NULL
     );
+}
 
-    fprintf(stderr, "Reading hapB k-mers into hash...\n");
-    hash_set* hapB = create_kmer_hash_set("hapB.txt");
+/*
+ * Count the k-mers in a read that are unique to each haplotype.
+ *
+ * Windows containing a character other than [ACGTacgt] are skipped.
+ *
+ * Args:
+ *     read: null-terminated sequence of the read
+ *     index: index of k-mers labelled by haplotype
+ *     count_A: set to the number of k-mers in the read unique to haplotype A
+ *     count_B: set to the number of k-mers in the read unique to haplotype B
+ */
+void count_kmers_in_read(
+    char* read,
+    kmer_index* index,
+    int* count_A,
+    int* count_B
+) {
+    uint64_t offsets[2] = {0, strlen(read)};
+
+    if (count_kmers_in_reads(read, offsets, 1, index, count_A, count_B))
+    {
+        *count_A = 0;
+        *count_B = 0;
+    }
+}
+
+#ifndef KMERS_NO_MAIN
+int main() {
+    fprintf(stderr, "Reading hapA and hapB k-mers into index...\n");
+    kmer_index* index = create_kmer_index(
+        "hapA.txt", "hapB.txt", HASH_INDEX, 0, 1
+    );
     fprintf(
         stderr,
-        "Finished reading %d-mers into hash of size %d.\n",
-        hapA->k,
-        hapA->hash_size
+        "Finished reading %d-mers into hash of size %" PRIu64 ".\n",
+        index->k,
+        index->hash->hash_size
     );
 
     int count_A = 0, count_B = 0;
     count_kmers_in_read(
         "GAGGAGATTTAGAGTGTGAGTCGAGCATAGAGATATATA",
-        hapA,
-        hapB,
+        index,
         &count_A,
         &count_B
     );
@@ -332,7 +1696,7 @@ int main() {
         count_B
     );
 
-    free(hapA);
-    free(hapB);
+    free_kmer_index(index);
     return 0;
 }
+#endif
@@ -0,0 +1,604 @@
+#ifndef KMERS_H
+#define KMERS_H
+
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
+#include <inttypes.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <sys/types.h>
+#include <string.h>
+
+/*
+ * Labels marking which haplotype a k-mer in an index is unique to. A
+ * label of EMPTY means a k-mer is not in the index.
+ */
+#define EMPTY 0
+#define HAPLOTYPE_A 1
+#define HAPLOTYPE_B 2
+
+/*
+ * Value of an empty slot in a hash set. This can never be the integer
+ * representation of a canonical k-mer: it is the representation of a
+ * 32-mer of all Ts, whose reverse complement (all As, or 0) is lesser.
+ */
+#define EMPTY_KMER UINT64_MAX
+
+/*
+ * K-mers of up to MAX_SHORT_K bases fit in a 64-bit integer. Longer ones,
+ * up to MAX_K bases, are stored in 128-bit integers, which only the hash
+ * index supports.
+ */
+#define MAX_SHORT_K 32
+#define MAX_K 64
+
+typedef unsigned __int128 uint128_t;
+
+/*
+ * Value of an empty slot in a 128-bit hash set, which can never be the
+ * representation of a canonical k-mer for the same reason as EMPTY_KMER
+ */
+#define EMPTY_KMER_128 (~(uint128_t) 0)
+
+/*
+ * The data structures a k-mer index can be built in
+ */
+#define HASH_INDEX 0
+#define SORTED_INDEX 1
+#define COMPRESSED_INDEX 2
+
+/*
+ * A hash set has a power-of-two number of slots, so that finding a slot
+ * takes a mask rather than a division, and grows to the next power of two
+ * once more than HASH_MAX_LOAD_PERCENT of them would be full. Robin Hood
+ * placement keeps lookups fast at high loads. The load of a hash set lies
+ * between half this and this, so a set of k-mers of up to MAX_SHORT_K
+ * bases takes from about 10 to about 20 bytes per k-mer, depending on how
+ * close the number of k-mers is to the next size up.
+ */
+#define HASH_MAX_LOAD_PERCENT 90
+
+/*
+ * A compressed set records where every COMPRESSED_SAMPLE_RATE-th bucket
+ * starts, so that finding a bucket scans past at most this many others
+ */
+#define COMPRESSED_SAMPLE_RATE 64
+
+/*
+ * When counting the k-mers in a read until it is decided, the number of
+ * bases whose k-mers are counted between checks of whether it is decided
+ */
+#define DECISION_SEGMENT_LENGTH 4096
+
+/*
+ * Shape of a Bloom filter: each block is one 64-byte cache line of eight
+ * 64-bit words, and a k-mer sets one bit in each word of its block
+ */
+#define BLOOM_WORDS_PER_BLOCK 8
+#define BLOOM_BITS_PER_KMER 12
+
+/*
+ * Contains a hash set full of k-mers, each labelled with the haplotype
+ * it is unique to.
+ *
+ * This is an open-addressing hash table using Robin Hood linear probing:
+ * on insertion, a k-mer takes the slot of any k-mer that is closer to its
+ * own home slot, which keeps probe sequences short and lets a lookup stop
+ * as soon as it passes the point where the k-mer would have been placed.
+ */
+typedef struct {
+    /*
+     * Contains the canonical integer-representation of kmers, or EMPTY_KMER
+     * for empty slots
+     */
+    uint64_t* kmers;
+
+    /*
+     * labels[i] = the haplotype label of the kmer in kmers[i]. This is only
+     * read once a lookup has found its k-mer, so probing touches only
+     * `kmers`.
+     */
+    unsigned char* labels;
+
+    /*
+     * The size of the hash set, to be used as the length of `kmers` and
+     * `labels`. Always a power of two, so that `hash_size - 1` can be used
+     * to mask hashes and positions into range.
+     */
+    uint64_t hash_size;
+} hash_set;
+
+/*
+ * Contains a hash set full of k-mers longer than MAX_SHORT_K, each
+ * labelled with the haplotype it is unique to. This works exactly like
+ * `hash_set`, but with 128-bit k-mers.
+ */
+typedef struct {
+    /*
+     * Contains the canonical integer-representation of kmers, or
+     * EMPTY_KMER_128 for empty slots
+     */
+    uint128_t* kmers;
+
+    /*
+     * labels[i] = the haplotype label of the kmer in kmers[i]
+     */
+    unsigned char* labels;
+
+    /*
+     * The size of the hash set, which is always a power of two
+     */
+    uint64_t hash_size;
+} hash_set_128;
+
+/*
+ * Contains a sorted array full of k-mers, each labelled with the haplotype
+ * it is unique to. This takes a little over 8 bytes per k-mer, with no
+ * empty slots, at the cost of slower lookups than a hash set.
+ */
+typedef struct {
+    /*
+     * The canonical integer-representations of the kmers, sorted in
+     * increasing order with no duplicates
+     */
+    uint64_t* kmers;
+
+    /*
+     * Bit vector of labels: bit i is set if kmers[i] is unique to haplotype
+     * B, and unset if it is unique to haplotype A
+     */
+    uint64_t* labels;
+
+    /*
+     * The number of k-mers in `kmers`
+     */
+    uint64_t num_kmers;
+} sorted_set;
+
+/*
+ * Contains a sorted set of k-mers, each labelled with the haplotype it is
+ * unique to, compressed with Elias-Fano coding into a few bytes per k-mer
+ * (see `create_compressed_set`), at the cost of slower lookups than a
+ * hash set.
+ */
+typedef struct {
+    /*
+     * The high bits of the sorted k-mers, in unary: a one for each k-mer,
+     * and a zero at the end of each bucket
+     */
+    uint64_t* high;
+
+    /*
+     * The low bits of the sorted k-mers, `low_bits` bits each, packed one
+     * after another
+     */
+    uint64_t* low;
+
+    /*
+     * samples[i] = the position in `high` where bucket
+     * i * COMPRESSED_SAMPLE_RATE starts
+     */
+    uint64_t* samples;
+
+    /*
+     * Bit vector of labels: bit i is set if the i-th k-mer is unique to
+     * haplotype B, and unset if it is unique to haplotype A
+     */
+    uint64_t* labels;
+
+    /*
+     * The number of k-mers in the set
+     */
+    uint64_t num_kmers;
+
+    /*
+     * The number of low bits of each k-mer stored in `low`
+     */
+    unsigned char low_bits;
+} compressed_set;
+
+/*
+ * Contains a blocked Bloom filter of k-mers, which can say quickly and in
+ * little memory that a k-mer is definitely not in an index, so that the
+ * exact lookup can be skipped for most of the k-mers of a read. Each k-mer
+ * maps to a single block, so checking it costs at most one cache miss.
+ */
+typedef struct {
+    /*
+     * The bits of the filter, BLOOM_WORDS_PER_BLOCK words per block
+     */
+    uint64_t* blocks;
+
+    /*
+     * The number of blocks in `blocks`
+     */
+    uint64_t num_blocks;
+} bloom_filter;
+
+/*
+ * Contains an index of k-mers unique to haplotypes A and B, stored in
+ * one of the available data structures.
+ */
+typedef struct {
+    /*
+     * The data structure the index is stored in: HASH_INDEX, SORTED_INDEX,
+     * or COMPRESSED_INDEX
+     */
+    int index_type;
+
+    /*
+     * The k-mer size
+     */
+    unsigned char k;
+
+    /*
+     * The number of k-mers in the files for haplotypes A and B
+     */
+    uint64_t num_kmers_A;
+    uint64_t num_kmers_B;
+
+    /*
+     * The hash set containing the k-mers if index_type is HASH_INDEX and k
+     * is at most MAX_SHORT_K, NULL otherwise
+     */
+    hash_set* hash;
+
+    /*
+     * The hash set containing the k-mers if index_type is HASH_INDEX and k
+     * is more than MAX_SHORT_K, NULL otherwise
+     */
+    hash_set_128* hash_128;
+
+    /*
+     * The sorted set containing the k-mers if index_type is SORTED_INDEX,
+     * NULL otherwise
+     */
+    sorted_set* sorted;
+
+    /*
+     * The compressed set containing the k-mers if index_type is
+     * COMPRESSED_INDEX, NULL otherwise
+     */
+    compressed_set* compressed;
+
+    /*
+     * A Bloom filter of the k-mers, which is checked before the exact
+     * lookup, or NULL if the index was created without one
+     */
+    bloom_filter* bloom;
+
+    /*
+     * If the index was loaded from an index file, the memory mapping of
+     * that file, which the arrays of the index point into; NULL otherwise
+     */
+    void* mapping;
+
+    /*
+     * The size of `mapping` in bytes
+     */
+    size_t mapping_size;
+} kmer_index;
+
+/*
+ * 2-bit code of each possible character in a read, matching the encoding
+ * used by `kmer_to_int`. Characters other than A, C, G, and T (in either
+ * case) map to 4, which marks them as invalid.
+ */
+extern const unsigned char base_codes[256];
+
+/*
+ * State for encoding each window of a read in turn. The forward and
+ * reverse-complement integer representations of the current window are
+ * updated by one base at each step rather than re-encoded from scratch,
+ * so each position in the read costs O(1) work.
+ */
+typedef struct {
+    uint64_t forward;
+    uint64_t reverse;
+    uint64_t mask;
+    unsigned int shift;
+    unsigned char k;
+
+    /*
+     * The number of valid bases at the end of the window, up to k
+     */
+    unsigned char valid_bases;
+} kmer_roller;
+
+static inline void init_kmer_roller(kmer_roller* roller, unsigned char k) {
+    roller->forward = 0;
+    roller->reverse = 0;
+    roller->mask = k < 32 ? (UINT64_C(1) << (2 * k)) - 1 : UINT64_MAX;
+    roller->shift = 2 * (k - 1);
+    roller->k = k;
+    roller->valid_bases = 0;
+}
+
+/*
+ * Add the next base of a read to the window.
+ *
+ * Args:
+ *     roller: the state of the window (modifies)
+ *     base: the next character of the read. A character other than
+ *         [ACGTacgt] invalidates every window overlapping it.
+ *     canonical: set to the canonical integer representation of the
+ *         window, i.e., the lesser of the k-mer and its reverse complement,
+ *         if the window is valid
+ *
+ * Returns: 1 if the window now holds k valid bases, 0 otherwise
+ */
+static inline int roll_kmer(kmer_roller* roller, char base, uint64_t* canonical) {
+    unsigned char code = base_codes[(unsigned char) base];
+
+    if (code > 3)
+    {
+        roller->valid_bases = 0;
+        return 0;
+    }
+
+    // the new base becomes the last base of the forward k-mer and the
+    // (complemented) first base of the reverse complement
+    roller->forward =
+        (roller->forward >> 2) | ((uint64_t) code << roller->shift);
+    roller->reverse =
+        ((roller->reverse << 2) & roller->mask) | (uint64_t) (3 - code);
+
+    if (roller->valid_bases < roller->k)
+    {
+        roller->valid_bases++;
+        if (roller->valid_bases < roller->k)
+            return 0;
+    }
+
+    *canonical = roller->forward < roller->reverse
+        ? roller->forward
+        : roller->reverse;
+    return 1;
+}
+
+/*
+ * The same as `kmer_roller`, but for k-mers longer than MAX_SHORT_K
+ */
+typedef struct {
+    uint128_t forward;
+    uint128_t reverse;
+    uint128_t mask;
+    unsigned int shift;
+    unsigned char k;
+    unsigned char valid_bases;
+} kmer_roller_128;
+
+static inline void init_kmer_roller_128(kmer_roller_128* roller, unsigned char k) {
+    roller->forward = 0;
+    roller->reverse = 0;
+    roller->mask = k < MAX_K ? ((uint128_t) 1 << (2 * k)) - 1 : ~(uint128_t) 0;
+    roller->shift = 2 * (k - 1);
+    roller->k = k;
+    roller->valid_bases = 0;
+}
+
+/*
+ * The same as `roll_kmer`, but for k-mers longer than MAX_SHORT_K
+ */
+static inline int roll_kmer_128(
+    kmer_roller_128* roller,
+    char base,
+    uint128_t* canonical
+) {
+    unsigned char code = base_codes[(unsigned char) base];
+
+    if (code > 3)
+    {
+        roller->valid_bases = 0;
+        return 0;
+    }
+
+    roller->forward =
+        (roller->forward >> 2) | ((uint128_t) code << roller->shift);
+    roller->reverse =
+        ((roller->reverse << 2) & roller->mask) | (uint128_t) (3 - code);
+
+    if (roller->valid_bases < roller->k)
+    {
+        roller->valid_bases++;
+        if (roller->valid_bases < roller->k)
+            return 0;
+    }
+
+    *canonical = roller->forward < roller->reverse
+        ? roller->forward
+        : roller->reverse;
+    return 1;
+}
+
+/*
+ * Fold a 128-bit k-mer into 64 bits that depend on all of its bits, so that
+ * it can be hashed or put in a Bloom filter like a 64-bit k-mer
+ */
+static inline uint64_t fold_kmer_128(uint128_t kmer_int) {
+    return (uint64_t) kmer_int
+        ^ (UINT64_C(0x9e3779b97f4a7c15) * (uint64_t) (kmer_int >> 64));
+}
+
+/* kmers.c */
+uint64_t kmer_to_int(char* kmer, unsigned char k);
+void reverse_complement(char* kmer_in, char* kmer_out, unsigned char k);
+uint64_t reverse_complement_int(uint64_t kmer_int, unsigned char k);
+uint64_t kmer_to_canonical_int(char* kmer, unsigned char k);
+uint128_t kmer_to_int_128(char* kmer, unsigned char k);
+uint128_t reverse_complement_int_128(uint128_t kmer_int, unsigned char k);
+kmer_index* create_kmer_index(
+    char* hap_A_file_path,
+    char* hap_B_file_path,
+    int index_type,
+    int use_bloom_filter,
+    int num_threads
+);
+void free_kmer_index(kmer_index* index);
+int write_kmer_index(kmer_index* index, char* index_file_path);
+kmer_index* load_kmer_index(char* index_file_path, int verify);
+int remove_kmer_index(char* index_file_path);
+int count_kmers_in_reads(
+    char* reads,
+    uint64_t* offsets,
+    uint64_t num_reads,
+    kmer_index* index,
+    int* counts_A,
+    int* counts_B
+);
+int count_kmers_in_reads_until_decided(
+    char* reads,
+    uint64_t* offsets,
+    uint64_t num_reads,
+    kmer_index* index,
+    double scale_A,
+    double scale_B,
+    double bound,
+    int* counts_A,
+    int* counts_B,
+    uint64_t* scanned
+);
+void count_kmers_in_read(
+    char* read,
+    kmer_index* index,
+    int* count_A,
+    int* count_B
+);
+
+/* hash_set.c */
+uint64_t hash_function(uint64_t x);
+uint64_t hash_set_size(uint64_t num_kmers);
+uint64_t estimate_hash_set_memory(uint64_t num_kmers);
+hash_set* initialize_hash_set(uint64_t num_kmers);
+void free_hash_set(hash_set* set);
+int add_int_to_hash_within(
+    hash_set* set,
+    uint64_t* kmer_int,
+    unsigned char* label,
+    uint64_t limit
+);
+void add_int_to_hash(hash_set* set, uint64_t kmer_int, unsigned char label);
+unsigned char kmer_in_hash_set(uint64_t kmer_int, hash_set* set);
+void count_kmers_in_read_hash(
+    char* read,
+    uint64_t read_length,
+    hash_set* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    int* count_A,
+    int* count_B
+);
+
+/* hash_set_128.c */
+uint64_t estimate_hash_set_128_memory(uint64_t num_kmers);
+hash_set_128* initialize_hash_set_128(uint64_t num_kmers);
+void free_hash_set_128(hash_set_128* set);
+void add_int_to_hash_128(
+    hash_set_128* set,
+    uint128_t kmer_int,
+    unsigned char label
+);
+unsigned char kmer_in_hash_set_128(uint128_t kmer_int, hash_set_128* set);
+void count_kmers_in_read_hash_128(
+    char* read,
+    uint64_t read_length,
+    hash_set_128* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    int* count_A,
+    int* count_B
+);
+
+/* sorted_set.c */
+void radix_sort(uint64_t* keys, uint64_t* scratch, uint64_t n, int key_bits);
+uint64_t estimate_sorted_set_memory(uint64_t num_kmers);
+uint64_t sorted_set_labels_size(uint64_t num_kmers);
+sorted_set* create_sorted_set(
+    uint64_t* kmers_A,
+    uint64_t num_kmers_A,
+    uint64_t* kmers_B,
+    uint64_t num_kmers_B,
+    unsigned char k,
+    int num_threads
+);
+void free_sorted_set(sorted_set* set);
+unsigned char kmer_in_sorted_set(uint64_t kmer_int, sorted_set* set);
+void count_kmers_in_read_sorted(
+    char* read,
+    uint64_t read_length,
+    sorted_set* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    uint64_t* buffer,
+    int* count_A,
+    int* count_B
+);
+
+/* compressed_set.c */
+unsigned char compressed_set_low_bits(uint64_t num_kmers, unsigned char k);
+void compressed_set_sizes(
+    uint64_t num_kmers,
+    unsigned char k,
+    uint64_t* high_words,
+    uint64_t* low_words,
+    uint64_t* sample_words
+);
+uint64_t estimate_compressed_set_memory(uint64_t num_kmers, unsigned char k);
+compressed_set* create_compressed_set(sorted_set* sorted, unsigned char k);
+void free_compressed_set(compressed_set* set);
+unsigned char kmer_in_compressed_set(uint64_t kmer_int, compressed_set* set);
+void count_kmers_in_read_compressed(
+    char* read,
+    uint64_t read_length,
+    compressed_set* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    int* count_A,
+    int* count_B
+);
+
+/* bloom_filter.c */
+uint64_t bloom_filter_size(uint64_t num_kmers);
+uint64_t estimate_bloom_filter_memory(uint64_t num_kmers);
+bloom_filter* initialize_bloom_filter(uint64_t num_kmers);
+void free_bloom_filter(bloom_filter* filter);
+void add_int_to_bloom_filter(bloom_filter* filter, uint64_t kmer_int);
+void add_int_to_bloom_filter_atomic(bloom_filter* filter, uint64_t kmer_int);
+int kmer_in_bloom_filter(uint64_t kmer_int, bloom_filter* filter);
+
+/* parallel.c */
+int peek_at_file_parallel(
+    char* kmer_file_path,
+    uint64_t* num_kmers,
+    int num_threads
+);
+uint64_t* read_kmer_file_parallel(
+    char* kmer_file_path,
+    unsigned char k,
+    int num_threads,
+    uint64_t* num_kmers
+);
+int fill_hash_set_parallel(
+    hash_set* set,
+    char* kmer_file_path,
+    unsigned char k,
+    unsigned char label,
+    int num_threads
+);
+void fill_bloom_filter_parallel(
+    bloom_filter* filter,
+    uint64_t* kmers,
+    uint64_t num_slots,
+    int num_threads
+);
+void radix_sort_parallel(
+    uint64_t* keys,
+    uint64_t* scratch,
+    uint64_t n,
+    int key_bits,
+    int num_threads
+);
+
+#endif
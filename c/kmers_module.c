@@ -0,0 +1,667 @@
+/*
+ * The trio_binning.kmers_c extension module, through which python code
+ * builds, saves, loads and searches k-mer indexes.
+ *
+ * Sequences are accepted as any object supporting the buffer protocol,
+ * e.g., bytes, bytearray, memoryview or a numpy uint8 array, and are read
+ * in place rather than copied. The GIL is released while indexes are built
+ * and while reads are counted, so that other python threads can keep
+ * running.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <unistd.h>
+#include "kmers.h"
+
+/*
+ * A k-mer index, which is freed along with the python object that owns it
+ */
+typedef struct {
+    PyObject_HEAD
+    kmer_index* index;
+} KmerIndexObject;
+
+static PyTypeObject KmerIndexType;
+
+static void KmerIndex_dealloc(KmerIndexObject* self) {
+    if (self->index)
+        free_kmer_index(self->index);
+    Py_TYPE(self)->tp_free((PyObject*) self);
+}
+
+/*
+ * Wrap a k-mer index in a new python object, which takes ownership of it.
+ *
+ * Returns: the new object, or NULL with an exception set if it could not
+ *     be created, in which case the index is freed
+ */
+static PyObject* wrap_kmer_index(kmer_index* index) {
+    KmerIndexObject* self = PyObject_New(KmerIndexObject, &KmerIndexType);
+
+    if (!self)
+    {
+        free_kmer_index(index);
+        return NULL;
+    }
+    self->index = index;
+    return (PyObject*) self;
+}
+
+/*
+ * Get a one-dimensional, contiguous buffer of integers from an object.
+ *
+ * Args:
+ *     obj: the object to get the buffer from
+ *     view: set to the buffer, which must be released with
+ *         `PyBuffer_Release` if this succeeds (modifies)
+ *     codes: the struct format characters the buffer may have
+ *     itemsize: the size in bytes of each item
+ *     writable: nonzero if the buffer is going to be written to
+ *     name: the name of the argument, for error messages
+ *
+ * Returns: 0 on success, -1 with an exception set otherwise
+ */
+static int get_integer_buffer(
+    PyObject* obj,
+    Py_buffer* view,
+    const char* codes,
+    Py_ssize_t itemsize,
+    int writable,
+    const char* name
+) {
+    const char* format;
+    int flags = PyBUF_FORMAT | PyBUF_C_CONTIGUOUS;
+
+    if (writable)
+        flags |= PyBUF_WRITABLE;
+    if (PyObject_GetBuffer(obj, view, flags))
+        return -1;
+
+    // native byte order may be given explicitly or left out
+    format = view->format ? view->format : "B";
+    if (*format == '@' || *format == '=')
+        format++;
+#if PY_LITTLE_ENDIAN
+    else if (*format == '<')
+        format++;
+#endif
+
+    if (
+        view->ndim != 1
+        || view->itemsize != itemsize
+        || format[0] == '\0'
+        || format[1] != '\0'
+        || !strchr(codes, format[0])
+    )
+    {
+        PyErr_Format(
+            PyExc_ValueError,
+            "%s must be a one-dimensional array of %zd-byte integers of type "
+            "'%s', not '%s'",
+            name,
+            itemsize,
+            codes,
+            view->format ? view->format : "B"
+        );
+        PyBuffer_Release(view);
+        return -1;
+    }
+
+    return 0;
+}
+
+PyDoc_STRVAR(
+    KmerIndex_write_doc,
+    "write(path)\n"
+    "--\n\n"
+    "Write the index to a binary file that can be loaded again with\n"
+    "load_kmer_index."
+);
+
+static PyObject* KmerIndex_write(KmerIndexObject* self, PyObject* args) {
+    PyObject* path;
+    int result;
+
+    if (!PyArg_ParseTuple(args, "O&", PyUnicode_FSConverter, &path))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    result = write_kmer_index(self->index, PyBytes_AS_STRING(path));
+    Py_END_ALLOW_THREADS
+
+    if (result)
+    {
+        PyErr_Format(
+            PyExc_OSError,
+            "Could not write k-mer index to %s.",
+            PyBytes_AS_STRING(path)
+        );
+        Py_DECREF(path);
+        return NULL;
+    }
+
+    Py_DECREF(path);
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(
+    KmerIndex_count_kmers_in_read_doc,
+    "count_kmers_in_read(read)\n"
+    "--\n\n"
+    "Count the k-mers in a read, given as a bytes-like object, that are\n"
+    "unique to each haplotype, without holding the GIL, and return the two\n"
+    "counts as a tuple."
+);
+
+static PyObject* KmerIndex_count_kmers_in_read(
+    KmerIndexObject* self,
+    PyObject* args
+) {
+    Py_buffer read;
+    uint64_t offsets[2];
+    int count_A, count_B, result;
+
+    if (!PyArg_ParseTuple(args, "y*", &read))
+        return NULL;
+
+    offsets[0] = 0;
+    offsets[1] = read.len;
+    Py_BEGIN_ALLOW_THREADS
+    result = count_kmers_in_reads(
+        read.buf, offsets, 1, self->index, &count_A, &count_B
+    );
+    Py_END_ALLOW_THREADS
+    PyBuffer_Release(&read);
+
+    if (result)
+        return PyErr_NoMemory();
+    return Py_BuildValue("ii", count_A, count_B);
+}
+
+PyDoc_STRVAR(
+    KmerIndex_count_kmers_in_reads_doc,
+    "count_kmers_in_reads(reads, offsets, counts_a, counts_b, *,\n"
+    "                     scanned=None, bound=0.0, scale_a=1.0, scale_b=1.0)\n"
+    "--\n\n"
+    "Count the k-mers in each of a batch of reads that are unique to each\n"
+    "haplotype, without holding the GIL.\n\n"
+    "reads is a bytes-like object holding the reads one after another.\n"
+    "offsets is an array of unsigned 64-bit integers of the offsets at which\n"
+    "each read starts, followed by the offset at which the last one ends.\n"
+    "The counts for each read are written into counts_a and counts_b, which\n"
+    "are writable arrays of C ints with one item per read.\n\n"
+    "With a positive bound, counting the k-mers of a read stops once its\n"
+    "counts times scale_a and scale_b are at least bound standard\n"
+    "deviations apart, checked every few thousand bases, so the counts are\n"
+    "only those of the start of the read. The number of bases of each read\n"
+    "whose k-mers were counted is written into scanned, if given, a\n"
+    "writable array of unsigned 64-bit integers with one item per read."
+);
+
+static PyObject* KmerIndex_count_kmers_in_reads(
+    KmerIndexObject* self,
+    PyObject* args,
+    PyObject* kwargs
+) {
+    static char* keywords[] = {
+        "reads", "offsets", "counts_a", "counts_b", "scanned", "bound",
+        "scale_a", "scale_b", NULL
+    };
+    PyObject *offsets_obj, *counts_A_obj, *counts_B_obj, *scanned_obj = Py_None;
+    Py_buffer reads, offsets, counts_A, counts_B, scanned;
+    double bound = 0, scale_A = 1, scale_B = 1;
+    Py_ssize_t num_reads;
+    int result;
+
+    if (
+        !PyArg_ParseTupleAndKeywords(
+            args, kwargs, "y*OOO|$Oddd", keywords, &reads, &offsets_obj,
+            &counts_A_obj, &counts_B_obj, &scanned_obj, &bound, &scale_A,
+            &scale_B
+        )
+    )
+    {
+        return NULL;
+    }
+    if (
+        get_integer_buffer(
+            offsets_obj, &offsets, sizeof(long) == 8 ? "QL" : "Q", 8, 0,
+            "offsets"
+        )
+    )
+    {
+        PyBuffer_Release(&reads);
+        return NULL;
+    }
+    if (
+        get_integer_buffer(
+            counts_A_obj, &counts_A, "i", sizeof(int), 1, "counts_a"
+        )
+    )
+    {
+        PyBuffer_Release(&reads);
+        PyBuffer_Release(&offsets);
+        return NULL;
+    }
+    if (
+        get_integer_buffer(
+            counts_B_obj, &counts_B, "i", sizeof(int), 1, "counts_b"
+        )
+    )
+    {
+        PyBuffer_Release(&reads);
+        PyBuffer_Release(&offsets);
+        PyBuffer_Release(&counts_A);
+        return NULL;
+    }
+    if (
+        scanned_obj != Py_None
+        && get_integer_buffer(
+            scanned_obj, &scanned, sizeof(long) == 8 ? "QL" : "Q", 8, 1,
+            "scanned"
+        )
+    )
+    {
+        PyBuffer_Release(&reads);
+        PyBuffer_Release(&offsets);
+        PyBuffer_Release(&counts_A);
+        PyBuffer_Release(&counts_B);
+        return NULL;
+    }
+
+    num_reads = offsets.shape[0] - 1;
+    if (num_reads < 0)
+    {
+        PyErr_SetString(PyExc_ValueError, "offsets must not be empty");
+        result = -1;
+    }
+    else if (((uint64_t*) offsets.buf)[num_reads] > (uint64_t) reads.len)
+    {
+        PyErr_SetString(
+            PyExc_ValueError, "offsets must not go past the end of the reads"
+        );
+        result = -1;
+    }
+    else if (
+        counts_A.shape[0] != num_reads || counts_B.shape[0] != num_reads
+    )
+    {
+        PyErr_SetString(
+            PyExc_ValueError,
+            "counts_a and counts_b must have one item per read"
+        );
+        result = -1;
+    }
+    else if (scanned_obj != Py_None && scanned.shape[0] != num_reads)
+    {
+        PyErr_SetString(
+            PyExc_ValueError, "scanned must have one item per read"
+        );
+        result = -1;
+    }
+    else
+    {
+        Py_BEGIN_ALLOW_THREADS
+        result = count_kmers_in_reads_until_decided(
+            reads.buf, offsets.buf, num_reads, self->index, scale_A, scale_B,
+            bound, counts_A.buf, counts_B.buf,
+            scanned_obj != Py_None ? scanned.buf : NULL
+        );
+        Py_END_ALLOW_THREADS
+        if (result)
+        {
+            PyErr_SetString(
+                PyExc_ValueError, "Could not count the k-mers in the reads."
+            );
+        }
+    }
+
+    PyBuffer_Release(&reads);
+    PyBuffer_Release(&offsets);
+    PyBuffer_Release(&counts_A);
+    PyBuffer_Release(&counts_B);
+    if (scanned_obj != Py_None)
+        PyBuffer_Release(&scanned);
+
+    if (result)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef KmerIndex_methods[] = {
+    {
+        "write",
+        (PyCFunction) KmerIndex_write,
+        METH_VARARGS,
+        KmerIndex_write_doc,
+    },
+    {
+        "count_kmers_in_read",
+        (PyCFunction) KmerIndex_count_kmers_in_read,
+        METH_VARARGS,
+        KmerIndex_count_kmers_in_read_doc,
+    },
+    {
+        "count_kmers_in_reads",
+        (PyCFunction) (void (*)(void)) KmerIndex_count_kmers_in_reads,
+        METH_VARARGS | METH_KEYWORDS,
+        KmerIndex_count_kmers_in_reads_doc,
+    },
+    {NULL},
+};
+
+static PyObject* KmerIndex_get_index_type(
+    KmerIndexObject* self,
+    void* closure
+) {
+    return PyLong_FromLong(self->index->index_type);
+}
+
+static PyObject* KmerIndex_get_k(KmerIndexObject* self, void* closure) {
+    return PyLong_FromLong(self->index->k);
+}
+
+static PyObject* KmerIndex_get_num_kmers_a(
+    KmerIndexObject* self,
+    void* closure
+) {
+    return PyLong_FromUnsignedLongLong(self->index->num_kmers_A);
+}
+
+static PyObject* KmerIndex_get_num_kmers_b(
+    KmerIndexObject* self,
+    void* closure
+) {
+    return PyLong_FromUnsignedLongLong(self->index->num_kmers_B);
+}
+
+static PyObject* KmerIndex_get_has_bloom_filter(
+    KmerIndexObject* self,
+    void* closure
+) {
+    return PyBool_FromLong(self->index->bloom != NULL);
+}
+
+static PyGetSetDef KmerIndex_getset[] = {
+    {
+        "index_type",
+        (getter) KmerIndex_get_index_type,
+        NULL,
+        "the C code of the data structure the k-mers are stored in",
+        NULL,
+    },
+    {"k", (getter) KmerIndex_get_k, NULL, "the k-mer size", NULL},
+    {
+        "num_kmers_a",
+        (getter) KmerIndex_get_num_kmers_a,
+        NULL,
+        "the number of k-mers unique to haplotype A",
+        NULL,
+    },
+    {
+        "num_kmers_b",
+        (getter) KmerIndex_get_num_kmers_b,
+        NULL,
+        "the number of k-mers unique to haplotype B",
+        NULL,
+    },
+    {
+        "has_bloom_filter",
+        (getter) KmerIndex_get_has_bloom_filter,
+        NULL,
+        "whether the index has a Bloom filter in front of it",
+        NULL,
+    },
+    {NULL},
+};
+
+static PyTypeObject KmerIndexType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "trio_binning.kmers_c.KmerIndex",
+    .tp_doc = PyDoc_STR(
+        "An index of k-mers labelled by the haplotype they are unique to,\n"
+        "made by create_kmer_index or load_kmer_index"
+    ),
+    .tp_basicsize = sizeof(KmerIndexObject),
+    .tp_itemsize = 0,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_dealloc = (destructor) KmerIndex_dealloc,
+    .tp_methods = KmerIndex_methods,
+    .tp_getset = KmerIndex_getset,
+};
+
+PyDoc_STRVAR(
+    create_kmer_index_doc,
+    "create_kmer_index(hap_a_path, hap_b_path, index_type, bloom_filter, "
+    "threads)\n"
+    "--\n\n"
+    "Read files of k-mers unique to haplotypes A and B into a KmerIndex."
+);
+
+static PyObject* kmers_c_create_kmer_index(PyObject* module, PyObject* args) {
+    PyObject *hap_A_path, *hap_B_path, *unreadable_path = NULL;
+    int index_type, use_bloom_filter, num_threads;
+    kmer_index* index;
+
+    if (
+        !PyArg_ParseTuple(
+            args, "O&O&ipi",
+            PyUnicode_FSConverter, &hap_A_path,
+            PyUnicode_FSConverter, &hap_B_path,
+            &index_type, &use_bloom_filter, &num_threads
+        )
+    )
+    {
+        return NULL;
+    }
+    // a file that cannot be read is an OSError, like any other
+    if (access(PyBytes_AS_STRING(hap_A_path), R_OK))
+        unreadable_path = hap_A_path;
+    else if (access(PyBytes_AS_STRING(hap_B_path), R_OK))
+        unreadable_path = hap_B_path;
+    if (unreadable_path)
+    {
+        PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, unreadable_path);
+        Py_DECREF(hap_A_path);
+        Py_DECREF(hap_B_path);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    index = create_kmer_index(
+        PyBytes_AS_STRING(hap_A_path), PyBytes_AS_STRING(hap_B_path),
+        index_type, use_bloom_filter, num_threads
+    );
+    Py_END_ALLOW_THREADS
+
+    if (!index)
+    {
+        PyErr_Format(
+            PyExc_ValueError,
+            "Could not create k-mer index from %s and %s.",
+            PyBytes_AS_STRING(hap_A_path),
+            PyBytes_AS_STRING(hap_B_path)
+        );
+    }
+    Py_DECREF(hap_A_path);
+    Py_DECREF(hap_B_path);
+
+    return index ? wrap_kmer_index(index) : NULL;
+}
+
+PyDoc_STRVAR(
+    load_kmer_index_doc,
+    "load_kmer_index(path, verify)\n"
+    "--\n\n"
+    "Memory-map an index file written by KmerIndex.write into a KmerIndex."
+);
+
+static PyObject* kmers_c_load_kmer_index(PyObject* module, PyObject* args) {
+    PyObject* path;
+    int verify;
+    kmer_index* index;
+
+    if (!PyArg_ParseTuple(args, "O&p", PyUnicode_FSConverter, &path, &verify))
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    index = load_kmer_index(PyBytes_AS_STRING(path), verify);
+    Py_END_ALLOW_THREADS
+
+    if (!index)
+    {
+        PyErr_Format(
+            PyExc_ValueError,
+            "Could not load k-mer index from %s.",
+            PyBytes_AS_STRING(path)
+        );
+    }
+    Py_DECREF(path);
+
+    return index ? wrap_kmer_index(index) : NULL;
+}
+
+PyDoc_STRVAR(
+    remove_kmer_index_doc,
+    "remove_kmer_index(path)\n"
+    "--\n\n"
+    "Remove an index file or shared memory object written by\n"
+    "KmerIndex.write."
+);
+
+static PyObject* kmers_c_remove_kmer_index(PyObject* module, PyObject* args) {
+    PyObject* path;
+
+    if (!PyArg_ParseTuple(args, "O&", PyUnicode_FSConverter, &path))
+        return NULL;
+
+    if (remove_kmer_index(PyBytes_AS_STRING(path)))
+    {
+        PyErr_SetFromErrnoWithFilenameObject(PyExc_OSError, path);
+        Py_DECREF(path);
+        return NULL;
+    }
+
+    Py_DECREF(path);
+    Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(
+    kmer_to_int_doc,
+    "kmer_to_int(kmer)\n"
+    "--\n\n"
+    "Convert a k-mer of up to 32 bases, given as a bytes-like object, to\n"
+    "integer format."
+);
+
+static PyObject* kmers_c_kmer_to_int(PyObject* module, PyObject* args) {
+    Py_buffer kmer;
+    uint64_t kmer_int;
+
+    if (!PyArg_ParseTuple(args, "y*", &kmer))
+        return NULL;
+    if (kmer.len > MAX_SHORT_K)
+    {
+        PyErr_Format(
+            PyExc_ValueError, "k-mer must not be longer than %d", MAX_SHORT_K
+        );
+        PyBuffer_Release(&kmer);
+        return NULL;
+    }
+
+    kmer_int = kmer_to_int(kmer.buf, kmer.len);
+    PyBuffer_Release(&kmer);
+    return PyLong_FromUnsignedLongLong(kmer_int);
+}
+
+PyDoc_STRVAR(
+    reverse_complement_doc,
+    "reverse_complement(kmer)\n"
+    "--\n\n"
+    "Reverse complement a k-mer of up to 255 bases, given as a bytes-like\n"
+    "object, and return it as bytes. Bases other than [ACGT] become N."
+);
+
+static PyObject* kmers_c_reverse_complement(PyObject* module, PyObject* args) {
+    Py_buffer kmer;
+    PyObject* out_kmer;
+
+    if (!PyArg_ParseTuple(args, "y*", &kmer))
+        return NULL;
+    if (kmer.len > UCHAR_MAX)
+    {
+        PyErr_Format(
+            PyExc_ValueError, "k-mer must not be longer than %d", UCHAR_MAX
+        );
+        PyBuffer_Release(&kmer);
+        return NULL;
+    }
+
+    // bases other than [ACGT] are left as they are initialized
+    out_kmer = PyBytes_FromStringAndSize(NULL, kmer.len);
+    if (out_kmer)
+    {
+        memset(PyBytes_AS_STRING(out_kmer), 'N', kmer.len);
+        reverse_complement(kmer.buf, PyBytes_AS_STRING(out_kmer), kmer.len);
+    }
+    PyBuffer_Release(&kmer);
+    return out_kmer;
+}
+
+static PyMethodDef kmers_c_methods[] = {
+    {
+        "create_kmer_index",
+        kmers_c_create_kmer_index,
+        METH_VARARGS,
+        create_kmer_index_doc,
+    },
+    {
+        "load_kmer_index",
+        kmers_c_load_kmer_index,
+        METH_VARARGS,
+        load_kmer_index_doc,
+    },
+    {
+        "remove_kmer_index",
+        kmers_c_remove_kmer_index,
+        METH_VARARGS,
+        remove_kmer_index_doc,
+    },
+    {"kmer_to_int", kmers_c_kmer_to_int, METH_VARARGS, kmer_to_int_doc},
+    {
+        "reverse_complement",
+        kmers_c_reverse_complement,
+        METH_VARARGS,
+        reverse_complement_doc,
+    },
+    {NULL},
+};
+
+static struct PyModuleDef kmers_c_module = {
+    PyModuleDef_HEAD_INIT,
+    .m_name = "trio_binning.kmers_c",
+    .m_doc = PyDoc_STR("C implementation of k-mer indexes"),
+    .m_size = -1,
+    .m_methods = kmers_c_methods,
+};
+
+PyMODINIT_FUNC PyInit_kmers_c(void) {
+    PyObject* module;
+
+    if (PyType_Ready(&KmerIndexType) < 0)
+        return NULL;
+
+    module = PyModule_Create(&kmers_c_module);
+    if (!module)
+        return NULL;
+
+    Py_INCREF(&KmerIndexType);
+    if (PyModule_AddObject(module, "KmerIndex", (PyObject*) &KmerIndexType))
+    {
+        Py_DECREF(&KmerIndexType);
+        Py_DECREF(module);
+        return NULL;
+    }
+
+    return module;
+}
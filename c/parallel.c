@@ -0,0 +1,841 @@
+#include "kmers.h"
+#include <pthread.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+/*
+ * The fewest slots a region of a hash set can have when it is filled in
+ * parallel. Regions much smaller than this would make k-mers spill out of
+ * their region's neighbour often enough to slow down the serial pass.
+ */
+#define MIN_REGION_SLOTS 4096
+
+/*
+ * The number of regions per thread a hash set is split into when it is
+ * filled in parallel, so that threads that finish early can take more
+ */
+#define REGIONS_PER_THREAD 16
+
+/*
+ * The fewest keys per thread for which sorting in parallel is worthwhile
+ */
+#define MIN_PARALLEL_SORT_KEYS 65536
+
+/*
+ * A file memory-mapped for reading
+ */
+typedef struct {
+    char* data;
+    size_t size;
+} mapped_file;
+
+/*
+ * Memory-map a file for reading.
+ *
+ * Returns: 0 on success, -1 on failure
+ */
+static int map_file(char* path, mapped_file* file) {
+    int fd;
+    struct stat file_stat;
+
+    fd = open(path, O_RDONLY);
+    if (fd < 0 || fstat(fd, &file_stat))
+    {
+        perror(path);
+        if (fd >= 0)
+            close(fd);
+        return -1;
+    }
+
+    file->size = file_stat.st_size;
+    file->data = NULL;
+    if (file->size > 0)
+    {
+        file->data = mmap(NULL, file->size, PROT_READ, MAP_PRIVATE, fd, 0);
+        if (file->data == MAP_FAILED)
+        {
+            perror(path);
+            close(fd);
+            return -1;
+        }
+        madvise(file->data, file->size, MADV_SEQUENTIAL);
+    }
+
+    close(fd);
+    return 0;
+}
+
+static void unmap_file(mapped_file* file) {
+    if (file->data)
+        munmap(file->data, file->size);
+}
+
+/*
+ * Run a function on each of an array of jobs, one thread per job, and wait
+ * for them all to finish. A job whose thread cannot be started is run in
+ * this thread instead.
+ *
+ * Args:
+ *     worker: the function to run, which is passed a pointer to its job
+ *     jobs: array of jobs
+ *     job_size: the size of each job in bytes
+ *     num_jobs: the number of jobs
+ */
+static void run_threads(
+    void* (*worker)(void*),
+    void* jobs,
+    size_t job_size,
+    int num_jobs
+) {
+    pthread_t* threads = malloc(num_jobs * sizeof(pthread_t));
+    char* started = malloc(num_jobs);
+    int i;
+
+    for (i = 0; i < num_jobs; i++)
+    {
+        started[i] = !pthread_create(
+            &threads[i], NULL, worker, (char*) jobs + i * job_size
+        );
+    }
+    for (i = 0; i < num_jobs; i++)
+    {
+        if (started[i])
+            pthread_join(threads[i], NULL);
+        else
+            worker((char*) jobs + i * job_size);
+    }
+
+    free(threads);
+    free(started);
+}
+
+/*
+ * Split a file into chunks that each start at the beginning of a line.
+ *
+ * Args:
+ *     file: the file to split
+ *     num_chunks: the number of chunks to split it into
+ *     bounds: set to the num_chunks + 1 offsets where the chunks start,
+ *         followed by the size of the file
+ */
+static void split_lines(mapped_file* file, int num_chunks, size_t* bounds) {
+    size_t position;
+    char* newline;
+    int i;
+
+    bounds[0] = 0;
+    for (i = 1; i < num_chunks; i++)
+    {
+        position = file->size / num_chunks * i;
+        if (position < bounds[i - 1])
+            position = bounds[i - 1];
+
+        newline = position < file->size
+            ? memchr(file->data + position, '\n', file->size - position)
+            : NULL;
+        bounds[i] = newline ? (size_t) (newline - file->data) + 1 : file->size;
+    }
+    bounds[num_chunks] = file->size;
+}
+
+/*
+ * Job for `count_worker`: count the newlines in one chunk of a file
+ */
+typedef struct {
+    mapped_file* file;
+    size_t start;
+    size_t end;
+    uint64_t num_lines;
+} count_job;
+
+static void* count_worker(void* data) {
+    count_job* job = (count_job*) data;
+    char* position = job->file->data + job->start;
+    char* end = job->file->data + job->end;
+
+    job->num_lines = 0;
+    while ((position = memchr(position, '\n', end - position)))
+    {
+        job->num_lines++;
+        position++;
+    }
+
+    return NULL;
+}
+
+/*
+ * Count the k-mers in a file, one per line, and find their size, the same
+ * as `peek_at_file` but counting several chunks of the file at once.
+ *
+ * Args:
+ *     kmer_file_path: path to the file of k-mers
+ *     num_kmers: set to the number of k-mers in the file
+ *     num_threads: the number of threads to count with
+ *
+ * Returns: the k-mer size, 0 if the file is empty, or -1 if it cannot be
+ *     read
+ */
+int peek_at_file_parallel(
+    char* kmer_file_path,
+    uint64_t* num_kmers,
+    int num_threads
+) {
+    mapped_file file;
+    count_job* jobs;
+    size_t* bounds;
+    char* newline;
+    int i, k;
+
+    *num_kmers = 0;
+    if (map_file(kmer_file_path, &file))
+        return -1;
+    if (file.size == 0)
+    {
+        fprintf(stderr, "Found no k-mers in %s.\n", kmer_file_path);
+        return 0;
+    }
+
+    newline = memchr(file.data, '\n', file.size);
+    k = newline ? newline - file.data : (int) file.size;
+
+    jobs = malloc(num_threads * sizeof(count_job));
+    bounds = malloc((num_threads + 1) * sizeof(size_t));
+    split_lines(&file, num_threads, bounds);
+    for (i = 0; i < num_threads; i++)
+    {
+        jobs[i].file = &file;
+        jobs[i].start = bounds[i];
+        jobs[i].end = bounds[i + 1];
+    }
+    run_threads(count_worker, jobs, sizeof(count_job), num_threads);
+
+    for (i = 0; i < num_threads; i++)
+        *num_kmers += jobs[i].num_lines;
+    // the last line need not end with a newline
+    if (file.data[file.size - 1] != '\n')
+        (*num_kmers)++;
+
+    fprintf(
+        stderr,
+        "Found %" PRIu64 " %d-mers in %s.\n",
+        *num_kmers,
+        k,
+        kmer_file_path
+    );
+
+    free(jobs);
+    free(bounds);
+    unmap_file(&file);
+    return k;
+}
+
+/*
+ * Job for `parse_worker`: encode the k-mers in one chunk of a file, and
+ * either count them or write them out, grouped by the region of the hash
+ * set that their home slots are in
+ */
+typedef struct {
+    mapped_file* file;
+    size_t start;
+    size_t end;
+    unsigned char k;
+
+    /*
+     * 0 to count the k-mers in each region, 1 to write them to `kmers`
+     */
+    int pass;
+
+    /*
+     * If nonzero, the k-mers are grouped by hash region: the region of a
+     * k-mer is (hash & region_mask) >> region_shift. Otherwise, they all
+     * go in region 0.
+     */
+    int partition;
+    uint64_t region_mask;
+    int region_shift;
+
+    /*
+     * For each region, the number of k-mers counted in this chunk in the
+     * first pass, or the next position in `kmers` to write to in the second
+     */
+    uint64_t* offsets;
+    uint64_t* kmers;
+} parse_job;
+
+static void* parse_worker(void* data) {
+    parse_job* job = (parse_job*) data;
+    char* line = job->file->data + job->start;
+    char* end = job->file->data + job->end;
+    char* next;
+    uint64_t kmer_int, region = 0;
+    size_t length;
+
+    for (; line < end; line = next)
+    {
+        next = memchr(line, '\n', end - line);
+        next = next ? next + 1 : end;
+        length = next - line - (next[-1] == '\n');
+        if (length < job->k)
+            continue;
+
+        kmer_int = kmer_to_canonical_int(line, job->k);
+        if (job->partition)
+        {
+            region = (hash_function(kmer_int) & job->region_mask)
+                >> job->region_shift;
+        }
+
+        if (job->pass == 0)
+            job->offsets[region]++;
+        else
+            job->kmers[job->offsets[region]++] = kmer_int;
+    }
+
+    return NULL;
+}
+
+/*
+ * Encode every k-mer in a file, several chunks of the file at once.
+ *
+ * Args:
+ *     file: the file of k-mers, one per line
+ *     k: the k-mer size
+ *     num_threads: the number of threads to encode with
+ *     partition: if nonzero, group the k-mers by region of a hash set
+ *     region_mask: if partitioning, the slot mask of the hash set
+ *     region_shift: if partitioning, the shift that turns a slot into a
+ *         region
+ *     num_regions: the number of regions if partitioning, or 1
+ *     region_starts: set to the num_regions + 1 positions in the returned
+ *         array where each region starts, followed by the number of k-mers
+ *
+ * Returns: the canonical integer k-mers, or NULL if there is not enough
+ *     memory for them
+ */
+static uint64_t* parse_kmer_file_parallel(
+    mapped_file* file,
+    unsigned char k,
+    int num_threads,
+    int partition,
+    uint64_t region_mask,
+    int region_shift,
+    uint64_t num_regions,
+    uint64_t* region_starts
+) {
+    parse_job* jobs = malloc(num_threads * sizeof(parse_job));
+    size_t* bounds = malloc((num_threads + 1) * sizeof(size_t));
+    uint64_t* offsets = calloc(num_threads * num_regions, sizeof(uint64_t));
+    uint64_t* kmers = NULL;
+    uint64_t region, total = 0, count;
+    int i;
+
+    split_lines(file, num_threads, bounds);
+    for (i = 0; i < num_threads; i++)
+    {
+        jobs[i].file = file;
+        jobs[i].start = bounds[i];
+        jobs[i].end = bounds[i + 1];
+        jobs[i].k = k;
+        jobs[i].pass = 0;
+        jobs[i].partition = partition;
+        jobs[i].region_mask = region_mask;
+        jobs[i].region_shift = region_shift;
+        jobs[i].offsets = offsets + i * num_regions;
+    }
+    run_threads(parse_worker, jobs, sizeof(parse_job), num_threads);
+
+    // each chunk writes its k-mers in each region after those of the chunks
+    // before it, so the k-mers keep the order they have in the file
+    for (region = 0; region < num_regions; region++)
+    {
+        region_starts[region] = total;
+        for (i = 0; i < num_threads; i++)
+        {
+            count = offsets[i * num_regions + region];
+            offsets[i * num_regions + region] = total;
+            total += count;
+        }
+    }
+    region_starts[num_regions] = total;
+
+    kmers = malloc(total * sizeof(uint64_t) + 1);
+    if (kmers)
+    {
+        for (i = 0; i < num_threads; i++)
+        {
+            jobs[i].pass = 1;
+            jobs[i].kmers = kmers;
+        }
+        run_threads(parse_worker, jobs, sizeof(parse_job), num_threads);
+    }
+
+    free(jobs);
+    free(bounds);
+    free(offsets);
+    return kmers;
+}
+
+/*
+ * Read every k-mer in a file into an array, several chunks of the file at
+ * once.
+ *
+ * Args:
+ *     kmer_file_path: path to the file of k-mers, one per line
+ *     k: the k-mer size
+ *     num_threads: the number of threads to read with
+ *     num_kmers: set to the number of k-mers read
+ *
+ * Returns: the canonical integer k-mers, in the order they are in the
+ *     file, or NULL if the file cannot be read or there is not enough
+ *     memory
+ */
+uint64_t* read_kmer_file_parallel(
+    char* kmer_file_path,
+    unsigned char k,
+    int num_threads,
+    uint64_t* num_kmers
+) {
+    mapped_file file;
+    uint64_t region_starts[2];
+    uint64_t* kmers;
+
+    fprintf(
+        stderr,
+        "Reading k-mers in %s with %d threads...\n",
+        kmer_file_path,
+        num_threads
+    );
+    if (map_file(kmer_file_path, &file))
+        return NULL;
+
+    kmers = parse_kmer_file_parallel(
+        &file, k, num_threads, 0, 0, 0, 1, region_starts
+    );
+    *num_kmers = region_starts[1];
+
+    unmap_file(&file);
+    return kmers;
+}
+
+/*
+ * A k-mer that could not be inserted in parallel, and its label
+ */
+typedef struct {
+    uint64_t kmer_int;
+    unsigned char label;
+} deferred_kmer;
+
+/*
+ * Job for `insert_worker`: insert the k-mers of every other region of a
+ * hash set
+ */
+typedef struct {
+    hash_set* set;
+    uint64_t* kmers;
+    uint64_t* region_starts;
+    uint64_t num_regions;
+    uint64_t region_size;
+    unsigned char label;
+
+    /*
+     * 0 to insert the k-mers of the even regions, 1 for the odd ones
+     */
+    int parity;
+
+    /*
+     * Counter shared between the jobs, of the regions taken so far
+     */
+    uint64_t* next_region;
+
+    /*
+     * K-mers that would have been placed beyond the region after their own,
+     * to be inserted afterwards
+     */
+    deferred_kmer* deferred;
+    uint64_t num_deferred;
+    uint64_t deferred_capacity;
+
+    /*
+     * Set to 1 if there was not enough memory to set a k-mer aside
+     */
+    int failed;
+} insert_job;
+
+static void* insert_worker(void* data) {
+    insert_job* job = (insert_job*) data;
+    uint64_t region, limit, i, kmer_int;
+    unsigned char label;
+    deferred_kmer* deferred;
+
+    while (1)
+    {
+        region = 2 * __atomic_fetch_add(job->next_region, 1, __ATOMIC_RELAXED)
+            + job->parity;
+        if (region >= job->num_regions)
+            break;
+
+        // while the regions of one parity are being filled, k-mers may be
+        // pushed forward into the next region, which is of the other parity,
+        // but no further, so no two threads write the same slots
+        limit = ((region + 2) * job->region_size) & (job->set->hash_size - 1);
+        for (
+            i = job->region_starts[region];
+            i < job->region_starts[region + 1];
+            i++
+        )
+        {
+            kmer_int = job->kmers[i];
+            label = job->label;
+            if (add_int_to_hash_within(job->set, &kmer_int, &label, limit))
+                continue;
+
+            if (job->num_deferred == job->deferred_capacity)
+            {
+                deferred = realloc(
+                    job->deferred,
+                    (2 * job->deferred_capacity + 16) * sizeof(deferred_kmer)
+                );
+                if (!deferred)
+                {
+                    job->failed = 1;
+                    return NULL;
+                }
+                job->deferred = deferred;
+                job->deferred_capacity = 2 * job->deferred_capacity + 16;
+            }
+            job->deferred[job->num_deferred].kmer_int = kmer_int;
+            job->deferred[job->num_deferred].label = label;
+            job->num_deferred++;
+        }
+    }
+
+    return NULL;
+}
+
+/*
+ * Add every k-mer in a file to a hash set using several threads.
+ *
+ * The file is encoded in chunks at once, and the k-mers are grouped by the
+ * region of the hash set that their home slots are in. The even regions
+ * are then filled at once, followed by the odd ones. The rare k-mer that
+ * would be pushed more than one region past its own is set aside and
+ * inserted at the end.
+ *
+ * Args:
+ *     set: the hash set to add the k-mers to (modifies)
+ *     kmer_file_path: path to the file of k-mers, one per line
+ *     k: the k-mer size
+ *     label: the haplotype label to give the k-mers
+ *     num_threads: the number of threads to use
+ *
+ * Returns: 0 on success, -1 if the file cannot be read or there is not
+ *     enough memory
+ */
+int fill_hash_set_parallel(
+    hash_set* set,
+    char* kmer_file_path,
+    unsigned char k,
+    unsigned char label,
+    int num_threads
+) {
+    mapped_file file;
+    insert_job* jobs;
+    uint64_t* kmers;
+    uint64_t* region_starts;
+    uint64_t num_regions = 1, next_region, i, num_deferred = 0;
+    int region_shift = 0, parity, num_jobs, j, failed = 0;
+
+    while (
+        num_regions < (uint64_t) num_threads * REGIONS_PER_THREAD
+        && set->hash_size / (num_regions * 2) >= MIN_REGION_SLOTS
+    )
+    {
+        num_regions <<= 1;
+    }
+    while ((UINT64_C(1) << region_shift) < set->hash_size / num_regions)
+        region_shift++;
+
+    fprintf(
+        stderr,
+        "Adding k-mers in %s to index with %d threads...\n",
+        kmer_file_path,
+        num_threads
+    );
+    if (map_file(kmer_file_path, &file))
+        return -1;
+
+    region_starts = malloc((num_regions + 1) * sizeof(uint64_t));
+    kmers = parse_kmer_file_parallel(
+        &file, k, num_threads, 1, set->hash_size - 1, region_shift,
+        num_regions, region_starts
+    );
+    unmap_file(&file);
+    if (!kmers)
+    {
+        fprintf(stderr, "Could not allocate memory for k-mers.\n");
+        free(region_starts);
+        return -1;
+    }
+
+    if (num_regions < 4)
+    {
+        // the hash set is too small to split up
+        for (i = 0; i < region_starts[num_regions]; i++)
+            add_int_to_hash(set, kmers[i], label);
+        free(kmers);
+        free(region_starts);
+        return 0;
+    }
+
+    num_jobs = (uint64_t) num_threads < num_regions / 2
+        ? num_threads
+        : (int) (num_regions / 2);
+    jobs = calloc(num_jobs, sizeof(insert_job));
+    if (!jobs)
+    {
+        fprintf(stderr, "Could not allocate memory for k-mers.\n");
+        free(kmers);
+        free(region_starts);
+        return -1;
+    }
+    for (parity = 0; parity < 2 && !failed; parity++)
+    {
+        next_region = 0;
+        for (j = 0; j < num_jobs; j++)
+        {
+            jobs[j].set = set;
+            jobs[j].kmers = kmers;
+            jobs[j].region_starts = region_starts;
+            jobs[j].num_regions = num_regions;
+            jobs[j].region_size = set->hash_size / num_regions;
+            jobs[j].label = label;
+            jobs[j].parity = parity;
+            jobs[j].next_region = &next_region;
+        }
+        run_threads(insert_worker, jobs, sizeof(insert_job), num_jobs);
+        for (j = 0; j < num_jobs; j++)
+            failed |= jobs[j].failed;
+    }
+
+    if (failed)
+    {
+        fprintf(stderr, "Could not allocate memory for k-mers.\n");
+        for (j = 0; j < num_jobs; j++)
+            free(jobs[j].deferred);
+        free(jobs);
+        free(kmers);
+        free(region_starts);
+        return -1;
+    }
+
+    for (j = 0; j < num_jobs; j++)
+    {
+        for (i = 0; i < jobs[j].num_deferred; i++)
+        {
+            add_int_to_hash(
+                set, jobs[j].deferred[i].kmer_int, jobs[j].deferred[i].label
+            );
+        }
+        num_deferred += jobs[j].num_deferred;
+        free(jobs[j].deferred);
+    }
+    if (num_deferred)
+    {
+        fprintf(
+            stderr,
+            "Inserted %" PRIu64 " k-mers that crossed regions afterwards.\n",
+            num_deferred
+        );
+    }
+
+    free(jobs);
+    free(kmers);
+    free(region_starts);
+    return 0;
+}
+
+/*
+ * Job for `bloom_filter_worker`: add a range of k-mers to a Bloom filter
+ */
+typedef struct {
+    bloom_filter* filter;
+    uint64_t* kmers;
+    uint64_t start;
+    uint64_t end;
+} bloom_filter_job;
+
+static void* bloom_filter_worker(void* data) {
+    bloom_filter_job* job = (bloom_filter_job*) data;
+    uint64_t i;
+
+    for (i = job->start; i < job->end; i++)
+    {
+        if (job->kmers[i] != EMPTY_KMER)
+            add_int_to_bloom_filter_atomic(job->filter, job->kmers[i]);
+    }
+
+    return NULL;
+}
+
+/*
+ * Add k-mers to a Bloom filter using several threads.
+ *
+ * Args:
+ *     filter: the Bloom filter to add the k-mers to (modifies)
+ *     kmers: the k-mers to add, which may include empty hash slots
+ *         (EMPTY_KMER), which are skipped
+ *     num_slots: the length of `kmers`
+ *     num_threads: the number of threads to use
+ */
+void fill_bloom_filter_parallel(
+    bloom_filter* filter,
+    uint64_t* kmers,
+    uint64_t num_slots,
+    int num_threads
+) {
+    bloom_filter_job* jobs = malloc(num_threads * sizeof(bloom_filter_job));
+    int i;
+
+    for (i = 0; i < num_threads; i++)
+    {
+        jobs[i].filter = filter;
+        jobs[i].kmers = kmers;
+        jobs[i].start = num_slots / num_threads * i;
+        jobs[i].end = i == num_threads - 1
+            ? num_slots
+            : num_slots / num_threads * (i + 1);
+    }
+    run_threads(
+        bloom_filter_worker, jobs, sizeof(bloom_filter_job), num_threads
+    );
+
+    free(jobs);
+}
+
+/*
+ * Job for `radix_sort_worker`: count or move one range of keys for one
+ * pass of a radix sort
+ */
+typedef struct {
+    uint64_t* from;
+    uint64_t* to;
+    uint64_t start;
+    uint64_t end;
+    int shift;
+
+    /*
+     * 0 to count the keys with each byte, 1 to move them to `to`
+     */
+    int pass;
+
+    /*
+     * The number of keys in the range with each byte in the first pass, or
+     * the next position in `to` for each byte in the second
+     */
+    uint64_t counts[256];
+} radix_sort_job;
+
+static void* radix_sort_worker(void* data) {
+    radix_sort_job* job = (radix_sort_job*) data;
+    uint64_t i;
+
+    if (job->pass == 0)
+    {
+        memset(job->counts, 0, sizeof(job->counts));
+        for (i = job->start; i < job->end; i++)
+            job->counts[(job->from[i] >> job->shift) & 0xff]++;
+    }
+    else
+    {
+        for (i = job->start; i < job->end; i++)
+        {
+            job->to[job->counts[(job->from[i] >> job->shift) & 0xff]++] =
+                job->from[i];
+        }
+    }
+
+    return NULL;
+}
+
+/*
+ * Sort an array of integers in the same way as `radix_sort`, using several
+ * threads for each pass.
+ *
+ * Args:
+ *     keys: the integers to sort (modifies)
+ *     scratch: a buffer at least as long as `keys`, for temporary storage
+ *     n: the number of integers in `keys`
+ *     key_bits: the number of low bits the integers can have set
+ *     num_threads: the number of threads to use
+ */
+void radix_sort_parallel(
+    uint64_t* keys,
+    uint64_t* scratch,
+    uint64_t n,
+    int key_bits,
+    int num_threads
+) {
+    radix_sort_job* jobs;
+    uint64_t* from = keys;
+    uint64_t* to = scratch;
+    uint64_t* swap;
+    uint64_t total, count;
+    int shift, digit, i;
+
+    if (num_threads <= 1 || n < (uint64_t) num_threads * MIN_PARALLEL_SORT_KEYS)
+    {
+        radix_sort(keys, scratch, n, key_bits);
+        return;
+    }
+
+    jobs = malloc(num_threads * sizeof(radix_sort_job));
+    for (shift = 0; shift < key_bits; shift += 8)
+    {
+        for (i = 0; i < num_threads; i++)
+        {
+            jobs[i].from = from;
+            jobs[i].to = to;
+            jobs[i].start = n / num_threads * i;
+            jobs[i].end = i == num_threads - 1 ? n : n / num_threads * (i + 1);
+            jobs[i].shift = shift;
+            jobs[i].pass = 0;
+        }
+        run_threads(
+            radix_sort_worker, jobs, sizeof(radix_sort_job), num_threads
+        );
+
+        // every key has the same byte here, so this pass would change nothing
+        digit = (from[0] >> shift) & 0xff;
+        for (i = 0, count = 0; i < num_threads; i++)
+            count += jobs[i].counts[digit];
+        if (count == n)
+            continue;
+
+        // each range moves its keys with each byte after those of the ranges
+        // before it, which keeps the sort stable
+        for (digit = 0, total = 0; digit < 256; digit++)
+        {
+            for (i = 0; i < num_threads; i++)
+            {
+                count = jobs[i].counts[digit];
+                jobs[i].counts[digit] = total;
+                total += count;
+            }
+        }
+        for (i = 0; i < num_threads; i++)
+            jobs[i].pass = 1;
+        run_threads(
+            radix_sort_worker, jobs, sizeof(radix_sort_job), num_threads
+        );
+
+        swap = from;
+        from = to;
+        to = swap;
+    }
+
+    if (from != keys)
+        memcpy(keys, from, n * sizeof(uint64_t));
+    free(jobs);
+}
@@ -0,0 +1,310 @@
+#include "kmers.h"
+
+/*
+ * Sort an array of integers using a least-significant-digit radix sort,
+ * one byte at a time.
+ *
+ * Args:
+ *     keys: the integers to sort (modifies)
+ *     scratch: a buffer at least as long as `keys`, for temporary storage
+ *     n: the number of integers in `keys`
+ *     key_bits: the number of low bits the integers can have set, so that
+ *         passes over higher bytes can be skipped (e.g., 2k for k-mers)
+ */
+void radix_sort(uint64_t* keys, uint64_t* scratch, uint64_t n, int key_bits) {
+    uint64_t counts[256], i, total, count;
+    uint64_t* from = keys;
+    uint64_t* to = scratch;
+    uint64_t* swap;
+    int shift;
+
+    if (n == 0)
+        return;
+
+    for (shift = 0; shift < key_bits; shift += 8)
+    {
+        memset(counts, 0, sizeof(counts));
+        for (i = 0; i < n; i++)
+            counts[(from[i] >> shift) & 0xff]++;
+
+        // every key has the same byte here, so this pass would change nothing
+        if (counts[(from[0] >> shift) & 0xff] == n)
+            continue;
+
+        for (i = 0, total = 0; i < 256; i++)
+        {
+            count = counts[i];
+            counts[i] = total;
+            total += count;
+        }
+        for (i = 0; i < n; i++)
+            to[counts[(from[i] >> shift) & 0xff]++] = from[i];
+
+        swap = from;
+        from = to;
+        to = swap;
+    }
+
+    if (from != keys)
+        memcpy(keys, from, n * sizeof(uint64_t));
+}
+
+/*
+ * Get the number of 64-bit words in the label bit vector of a sorted set
+ */
+uint64_t sorted_set_labels_size(uint64_t num_kmers) {
+    return (num_kmers + 63) / 64;
+}
+
+/*
+ * Estimate the memory needed for a sorted set, so that it can be reported
+ * before attempting to allocate it.
+ *
+ * Args:
+ *     num_kmers: the number of k-mers that are going to be put inside
+ *
+ * Returns: the number of bytes the finished sorted set takes up
+ */
+uint64_t estimate_sorted_set_memory(uint64_t num_kmers) {
+    return sizeof(sorted_set)
+        + num_kmers * sizeof(uint64_t)
+        + sorted_set_labels_size(num_kmers) * sizeof(uint64_t);
+}
+
+/*
+ * Create a sorted set from the k-mers unique to each haplotype.
+ *
+ * K-mers that appear more than once are only stored once, and a k-mer
+ * listed for both haplotypes counts towards haplotype A.
+ *
+ * Args:
+ *     kmers_A: canonical integer k-mers unique to haplotype A, in any order
+ *         (modifies, by sorting)
+ *     num_kmers_A: the number of k-mers in `kmers_A`
+ *     kmers_B: canonical integer k-mers unique to haplotype B, in any order
+ *         (modifies, by sorting)
+ *     num_kmers_B: the number of k-mers in `kmers_B`
+ *     k: the k-mer size
+ *     num_threads: the number of threads to sort with
+ *
+ * Returns: the sorted set, or NULL if there is not enough memory for it
+ */
+sorted_set* create_sorted_set(
+    uint64_t* kmers_A,
+    uint64_t num_kmers_A,
+    uint64_t* kmers_B,
+    uint64_t num_kmers_B,
+    unsigned char k,
+    int num_threads
+) {
+    uint64_t i = 0, j = 0, n = 0, kmer_int;
+    uint64_t* scratch;
+    sorted_set* out_sorted_set;
+    int in_A;
+
+    scratch = malloc(
+        (num_kmers_A > num_kmers_B ? num_kmers_A : num_kmers_B)
+        * sizeof(uint64_t) + 1
+    );
+    out_sorted_set = malloc(sizeof(sorted_set));
+    out_sorted_set->kmers = malloc(
+        (num_kmers_A + num_kmers_B) * sizeof(uint64_t) + 1
+    );
+    out_sorted_set->labels = calloc(
+        sorted_set_labels_size(num_kmers_A + num_kmers_B) + 1, sizeof(uint64_t)
+    );
+    if (!scratch || !out_sorted_set->kmers || !out_sorted_set->labels)
+    {
+        fprintf(stderr, "Could not allocate memory for sorted array.\n");
+        free(scratch);
+        free_sorted_set(out_sorted_set);
+        return NULL;
+    }
+
+    fprintf(stderr, "Sorting k-mers...\n");
+    radix_sort_parallel(kmers_A, scratch, num_kmers_A, 2 * k, num_threads);
+    radix_sort_parallel(kmers_B, scratch, num_kmers_B, 2 * k, num_threads);
+    free(scratch);
+
+    // merge the two sorted lists, dropping duplicates
+    while (i < num_kmers_A || j < num_kmers_B)
+    {
+        if (j >= num_kmers_B || (i < num_kmers_A && kmers_A[i] <= kmers_B[j]))
+            kmer_int = kmers_A[i];
+        else
+            kmer_int = kmers_B[j];
+
+        in_A = i < num_kmers_A && kmers_A[i] == kmer_int;
+        while (i < num_kmers_A && kmers_A[i] == kmer_int)
+            i++;
+        while (j < num_kmers_B && kmers_B[j] == kmer_int)
+            j++;
+
+        out_sorted_set->kmers[n] = kmer_int;
+        if (!in_A)
+            out_sorted_set->labels[n / 64] |= UINT64_C(1) << (n % 64);
+        n++;
+    }
+
+    out_sorted_set->num_kmers = n;
+    out_sorted_set->kmers = realloc(
+        out_sorted_set->kmers, n * sizeof(uint64_t) + 1
+    );
+    out_sorted_set->labels = realloc(
+        out_sorted_set->labels,
+        sorted_set_labels_size(n) * sizeof(uint64_t) + 1
+    );
+
+    return out_sorted_set;
+}
+
+/*
+ * Free a sorted set and the arrays inside of it.
+ */
+void free_sorted_set(sorted_set* set) {
+    free(set->kmers);
+    free(set->labels);
+    free(set);
+}
+
+/*
+ * Get the haplotype label of the i-th k-mer in a sorted set
+ */
+static inline unsigned char sorted_set_label(sorted_set* set, uint64_t i) {
+    return (set->labels[i / 64] >> (i % 64)) & 1 ? HAPLOTYPE_B : HAPLOTYPE_A;
+}
+
+/*
+ * Find the position of the first k-mer in a sorted set that is not less
+ * than a given k-mer, searching forward from a position known to be no
+ * later than it. The search gallops forward in doubling steps and then
+ * bisects the last step, so it costs O(log d) for a distance d.
+ *
+ * Args:
+ *     set: the sorted set to search
+ *     start: a position at or before the one being searched for
+ *     kmer_int: the canonical integer k-mer to search for
+ *
+ * Returns: the position, which is set->num_kmers if every k-mer in the set
+ *     is less than `kmer_int`
+ */
+static uint64_t gallop(sorted_set* set, uint64_t start, uint64_t kmer_int) {
+    uint64_t low = start, high = start, step = 1, middle;
+
+    while (high < set->num_kmers && set->kmers[high] < kmer_int)
+    {
+        low = high + 1;
+        high += step;
+        step <<= 1;
+    }
+    if (high > set->num_kmers)
+        high = set->num_kmers;
+
+    while (low < high)
+    {
+        middle = low + (high - low) / 2;
+        if (set->kmers[middle] < kmer_int)
+            low = middle + 1;
+        else
+            high = middle;
+    }
+
+    return low;
+}
+
+/*
+ * Look up a canonical integer k-mer in a sorted set.
+ *
+ * Args:
+ *     kmer_int: the canonical integer representation of the k-mer, i.e.,
+ *         the lesser of the k-mer and its reverse complement
+ *     set: sorted set in which to look up the k-mer
+ *
+ * Returns: the haplotype label of the k-mer if it is in the set, EMPTY
+ *     otherwise
+ */
+unsigned char kmer_in_sorted_set(uint64_t kmer_int, sorted_set* set) {
+    uint64_t position = gallop(set, 0, kmer_int);
+
+    if (position < set->num_kmers && set->kmers[position] == kmer_int)
+        return sorted_set_label(set, position);
+    return EMPTY;
+}
+
+/*
+ * Count the k-mers in a read that are unique to each haplotype, looking
+ * them all up in a sorted set in one batch.
+ *
+ * All the k-mers of the read are encoded and sorted first, so that they
+ * can be found in a single forward pass over the sorted set, each search
+ * starting where the last one left off. K-mers ruled out by the Bloom
+ * filter, if there is one, are dropped before sorting.
+ *
+ * Args:
+ *     read: sequence of the read, which need not be null-terminated
+ *     read_length: the number of bases in `read`
+ *     set: sorted set of k-mers labelled by haplotype
+ *     bloom: Bloom filter of the k-mers in `set`, to rule out most k-mers
+ *         before looking them up, or NULL to look up every k-mer
+ *     k: the k-mer size of the sorted set
+ *     buffer: room for 2 * `read_length` integers, in which the k-mers of
+ *         the read are encoded and sorted, so that a batch of reads can
+ *         share one (modifies)
+ *     count_A: set to the number of k-mers in the read unique to haplotype A
+ *     count_B: set to the number of k-mers in the read unique to haplotype B
+ */
+void count_kmers_in_read_sorted(
+    char* read,
+    uint64_t read_length,
+    sorted_set* set,
+    bloom_filter* bloom,
+    unsigned char k,
+    uint64_t* buffer,
+    int* count_A,
+    int* count_B
+) {
+    uint64_t num_kmers = 0, i, position = 0;
+    uint64_t* kmers = buffer;
+    uint64_t* scratch = buffer + read_length;
+    unsigned char label = EMPTY;
+    kmer_roller roller;
+
+    *count_A = 0;
+    *count_B = 0;
+
+    init_kmer_roller(&roller, k);
+    for (i = 0; i < read_length; i++)
+    {
+        if (
+            roll_kmer(&roller, read[i], &kmers[num_kmers])
+            && (!bloom || kmer_in_bloom_filter(kmers[num_kmers], bloom))
+        )
+        {
+            num_kmers++;
+        }
+    }
+
+    radix_sort(kmers, scratch, num_kmers, 2 * k);
+
+    for (i = 0; i < num_kmers; i++)
+    {
+        // repeated k-mers in the read are next to each other after sorting
+        if (i == 0 || kmers[i] != kmers[i - 1])
+        {
+            position = gallop(set, position, kmers[i]);
+            if (position < set->num_kmers && set->kmers[position] == kmers[i])
+                label = sorted_set_label(set, position);
+            else
+                label = EMPTY;
+        }
+
+        switch (label) {
+            case HAPLOTYPE_A:
+                (*count_A)++;
+                break;
+            case HAPLOTYPE_B:
+                (*count_B)++;
+                break;
+        }
+    }
+}
@@ -1,3 +1,24 @@
 from setuptools import Extension, setup
 
-setup(ext_modules=[Extension(name="trio_binning.kmers_c", sources=["c/kmers.c"])])
+setup(
+    ext_modules=[
+        Extension(
+            name="trio_binning.kmers_c",
+            sources=[
+                "c/kmers.c",
+                "c/hash_set.c",
+                "c/hash_set_128.c",
+                "c/sorted_set.c",
+                "c/compressed_set.c",
+                "c/bloom_filter.c",
+                "c/parallel.c",
+                "c/kmers_module.c",
+            ],
+            depends=["c/kmers.h"],
+            define_macros=[("KMERS_NO_MAIN", None)],
+            libraries=["rt"],
+            extra_compile_args=["-pthread"],
+            extra_link_args=["-pthread"],
+        )
+    ]
+)
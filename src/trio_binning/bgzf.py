@@ -0,0 +1,433 @@
+"""Reading and writing gzipped files with more than one thread.
+
+A gzip file is a single stream that can only be inflated from start to
+end, but its inflation can at least run in a thread of its own, ahead
+of whatever is parsing it. A BGZF file, as made by bgzip, is instead a
+series of small gzip members of at most 64 KiB each, which can be
+inflated, and deflated, by several threads at once. Any gzip reader can
+read a BGZF file, and tools like samtools faidx can index one so that
+it can be read from the middle.
+
+Inflation uses the Intel ISA-L library if python-isal is installed,
+which is several times faster than zlib, and zlib otherwise. Either
+way, the GIL is released while inflating and deflating.
+"""
+
+import io
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Deque, Iterator, List, Optional, Tuple, cast
+
+from trio_binning.pipeline import batched, ordered_map, read_ahead
+
+try:
+    from isal import isal_zlib as inflate_zlib
+except ImportError:
+    inflate_zlib = zlib  # type: ignore
+
+COMPRESSED_CHUNK_SIZE = 1 << 20
+"""Number of bytes of a gzip file to read at a time"""
+
+BLOCKS_PER_BATCH = 64
+"""Number of BGZF blocks to inflate or deflate together, about 4 MiB of
+them"""
+
+BGZF_BLOCK_SIZE = 0xFF00
+"""Number of bytes to deflate into each BGZF block, which bgzip also uses
+so that even a block that does not compress fits in 64 KiB"""
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+"""Start of every BGZF block: the gzip magic number, the deflate
+compression method, and the flag for an extra field"""
+
+BGZF_MAX_BLOCK_SIZE = 1 << 16
+"""Largest size of a compressed BGZF block"""
+
+BGZF_HEADER = struct.Struct("<4sxxxxxxHccHH")
+"""Fixed part of the header of a BGZF block: the gzip magic number,
+compression method and flags, the length of the extra field, and the
+"BC" subfield giving the size of the block minus 1"""
+
+BGZF_FULL_HEADER = struct.Struct("<4sIBBHccHH")
+"""Header of a BGZF block, with the modification time, extra flags and
+operating system fields that BGZF_HEADER skips"""
+
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+"""Empty block that marks the end of a BGZF file"""
+
+
+def is_bgzf(fp: io.BufferedReader) -> bool:
+    """Check whether a gzip file is a BGZF file.
+
+    Looks at the header of the first member, without moving the
+    position in the file.
+    """
+    header = fp.peek(BGZF_HEADER.size)[: BGZF_HEADER.size]
+    if len(header) < BGZF_HEADER.size:
+        return False
+    magic, extra_length, subfield_1, subfield_2, _, _ = BGZF_HEADER.unpack(header)
+    return (
+        magic == BGZF_MAGIC and extra_length >= 6 and subfield_1 + subfield_2 == b"BC"
+    )
+
+
+class ChunkReader(io.RawIOBase):
+    """A file that reads the chunks of bytes from an iterator
+
+    Reads return at most one chunk, without copying it if the whole of
+    it is asked for.
+
+    Args:
+        chunks: the contents of the file, in chunks of any size
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.chunk = b""
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.readall()
+        while not self.chunk:
+            self.chunk = next(self.chunks, None)
+            if self.chunk is None:
+                self.chunk = b""
+                return b""
+        if size >= len(self.chunk):
+            data, self.chunk = self.chunk, b""
+        else:
+            data, self.chunk = self.chunk[:size], self.chunk[size:]
+        return data
+
+    def readall(self):
+        data = self.chunk + b"".join(self.chunks)
+        self.chunk = b""
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def read_range(fp: BinaryIO, length: int) -> Iterator[bytes]:
+    """Read at most `length` bytes of a file, from where it is, in chunks"""
+    while length > 0:
+        chunk = fp.read(min(COMPRESSED_CHUNK_SIZE, length))
+        if not chunk:
+            return
+        length -= len(chunk)
+        yield chunk
+
+
+def inflate_gzip(fp: BinaryIO) -> Iterator[bytes]:
+    """Inflate a gzip file of any number of members.
+
+    Args:
+        fp: the gzip file, opened for reading bytes
+
+    Yields:
+        the contents of the file, in chunks
+
+    Raises:
+        EOFError: if the file ends in the middle of a member
+    """
+    inflater = inflate_zlib.decompressobj(31)
+    in_member = False
+    while True:
+        compressed = fp.read(COMPRESSED_CHUNK_SIZE)
+        if not compressed:
+            break
+        while compressed:
+            in_member = True
+            yield inflater.decompress(compressed)
+            if not inflater.eof:
+                break
+            # the start of another member, e.g., of concatenated files
+            compressed = inflater.unused_data
+            inflater = inflate_zlib.decompressobj(31)
+            in_member = False
+    if in_member:
+        raise EOFError("Compressed file ended before the end of a member.")
+
+
+def split_bgzf_blocks(fp: BinaryIO) -> Iterator[bytes]:
+    """Split a BGZF file into its blocks, without inflating them.
+
+    Args:
+        fp: the BGZF file, opened for reading bytes
+
+    Yields:
+        each block, a gzip member of its own
+
+    Raises:
+        ValueError: if the file is not a BGZF file
+    """
+    data = b""
+    position = 0
+    while True:
+        if len(data) - position < BGZF_HEADER.size:
+            data = data[position:] + fp.read(COMPRESSED_CHUNK_SIZE)
+            position = 0
+            if not data:
+                return
+            if len(data) < BGZF_HEADER.size:
+                raise EOFError("Compressed file ended in the middle of a block.")
+        magic, _, subfield_1, subfield_2, _, block_size = BGZF_HEADER.unpack_from(
+            data, position
+        )
+        if magic != BGZF_MAGIC or subfield_1 + subfield_2 != b"BC":
+            raise ValueError("Not a BGZF file.")
+        block_end = position + block_size + 1
+        if block_end > len(data):
+            data = data[position:] + fp.read(max(COMPRESSED_CHUNK_SIZE, block_size + 1))
+            position = 0
+            if block_size + 1 > len(data):
+                raise EOFError("Compressed file ended in the middle of a block.")
+            continue
+        yield data[position:block_end]
+        position = block_end
+
+
+def inflate_bgzf_blocks(blocks: List[bytes]) -> bytes:
+    """Inflate a batch of BGZF blocks, checking their checksums"""
+    return b"".join([inflate_zlib.decompress(block, 31) for block in blocks])
+
+
+def open_gzip(filename: str, threads: int = 1) -> BinaryIO:
+    """Open a gzip file for reading its contents as bytes.
+
+    Args:
+        filename: the path to the file
+        threads: the number of threads to inflate the file with. A
+            gzip file is inflated in a thread ahead of the caller if
+            this is more than 1, and a BGZF file with this many.
+
+    Returns:
+        the contents of the file, as a file opened for reading bytes
+    """
+    fp = cast(io.BufferedReader, open(filename, "rb"))
+    chunks: Iterator[bytes]
+    if is_bgzf(fp):
+        chunks = ordered_map(
+            inflate_bgzf_blocks,
+            batched(split_bgzf_blocks(fp), BLOCKS_PER_BATCH),
+            threads,
+        )
+    else:
+        chunks = inflate_gzip(fp)
+    if threads > 1:
+        chunks = read_ahead(chunks, 2 * threads)
+    return cast(BinaryIO, ChunkReader(chunks))
+
+
+def find_bgzf_block(fp: BinaryIO, offset: int) -> int:
+    """Find the first BGZF block that starts at or after an offset.
+
+    Looks for the start of a block within the next 64 KiB, which must
+    have one unless it is the end of the file, and makes sure it is the
+    start of a block, rather than the same bytes inside of one, by
+    inflating the block and checking its checksum.
+
+    Args:
+        fp: the BGZF file, opened for reading bytes
+        offset: the offset in the file to look from
+
+    Returns:
+        the offset of the block, or of the end of the file if there
+        is no block after `offset`
+
+    Raises:
+        ValueError: if the file is not a BGZF file
+    """
+    fp.seek(offset)
+    data = fp.read(2 * BGZF_MAX_BLOCK_SIZE)
+    position = data.find(BGZF_MAGIC)
+    while 0 <= position <= len(data) - BGZF_HEADER.size:
+        _, _, subfield_1, subfield_2, _, block_size = BGZF_HEADER.unpack_from(
+            data, position
+        )
+        block = data[position : position + block_size + 1]
+        if subfield_1 + subfield_2 == b"BC" and len(block) == block_size + 1:
+            try:
+                inflate_zlib.decompress(block, 31)
+                return offset + position
+            except inflate_zlib.error:
+                pass
+        position = data.find(BGZF_MAGIC, position + 1)
+    if len(data) < 2 * BGZF_MAX_BLOCK_SIZE:
+        return offset + len(data)
+    raise ValueError("Not a BGZF file.")
+
+
+def inflate_bgzf_range(
+    filename: str, start: int, end: int, threads: int = 1
+) -> Iterator[bytes]:
+    """Inflate the blocks in part of a BGZF file.
+
+    Args:
+        filename: the path to the file
+        start: the offset of the first block to inflate, as found by
+            `find_bgzf_block`
+        end: the offset of the block after the last one to inflate
+        threads: the number of threads to inflate the blocks with
+
+    Yields:
+        the contents of the blocks, in chunks
+    """
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        blocks = split_bgzf_blocks(
+            cast(BinaryIO, ChunkReader(read_range(fp, end - start)))
+        )
+        chunks = ordered_map(
+            inflate_bgzf_blocks, batched(blocks, BLOCKS_PER_BATCH), threads
+        )
+        if threads > 1:
+            chunks = read_ahead(chunks, 2 * threads)
+        yield from chunks
+
+
+def deflate_bgzf_blocks(data: bytes, level: int) -> List[Tuple[bytes, int]]:
+    """Deflate data into BGZF blocks.
+
+    Args:
+        data: the data to deflate, which is split into blocks of
+            `BGZF_BLOCK_SIZE` bytes
+        level: the compression level, from 0, none, to 9, the smallest
+
+    Returns:
+        each block, and the number of bytes of `data` in it
+    """
+    blocks = []
+    view = memoryview(data)
+    for start in range(0, len(view), BGZF_BLOCK_SIZE):
+        uncompressed = view[start : start + BGZF_BLOCK_SIZE]
+        deflater = zlib.compressobj(level, zlib.DEFLATED, -15)
+        deflated = deflater.compress(uncompressed) + deflater.flush()
+        if len(deflated) > BGZF_MAX_BLOCK_SIZE - BGZF_FULL_HEADER.size - 8:
+            # data that does not compress, so store it as it is instead
+            deflater = zlib.compressobj(0, zlib.DEFLATED, -15)
+            deflated = deflater.compress(uncompressed) + deflater.flush()
+        block_size = BGZF_FULL_HEADER.size + len(deflated) + 8
+        header = BGZF_FULL_HEADER.pack(
+            BGZF_MAGIC, 0, 0, 255, 6, b"B", b"C", 2, block_size - 1
+        )
+        footer = struct.pack("<II", zlib.crc32(uncompressed), len(uncompressed))
+        blocks.append((header + deflated + footer, len(uncompressed)))
+    return blocks
+
+
+class BgzfWriter(io.BufferedIOBase):
+    """A BGZF file, opened for writing bytes
+
+    Whatever is written is buffered until there are `BLOCKS_PER_BATCH`
+    blocks of it, which are then deflated together, by a pool of threads
+    if there is more than one, while more is written. Writing a batch of
+    records at once with `writelines` is cheaper than writing them one
+    at a time.
+
+    `flush` only writes out whole blocks; the rest is written, along
+    with the end-of-file marker, by `close`.
+
+    Args:
+        filename: the path of the file to write
+        level: the compression level, from 0, none, to 9, the smallest
+        threads: the number of threads to deflate blocks with
+        index: True to also write a bgzip index of the file, with
+            ".gzi" added to `filename`, for reading it from the middle
+    """
+
+    def __init__(
+        self, filename: str, level: int = 9, threads: int = 1, index: bool = False
+    ):
+        if not 0 <= level <= 9:
+            raise ValueError(f"Compression level must be from 0 to 9, not {level}.")
+        self.file = open(filename, "wb")
+        self.filename = filename
+        self.level = level
+        self.threads = threads
+        self.buffer: List[bytes] = []
+        self.buffer_size = 0
+        self.executor = ThreadPoolExecutor(threads) if threads > 1 else None
+        self.pending: Deque[Future] = deque()
+        self.offsets: Optional[List[Tuple[int, int]]] = [] if index else None
+        self.compressed_offset = 0
+        self.uncompressed_offset = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.writelines((data,))
+        return len(data)
+
+    def writelines(self, lines):
+        if self.closed:
+            raise ValueError("write to closed file")
+        lines = [bytes(line) for line in lines]
+        self.buffer.extend(lines)
+        self.buffer_size += sum(map(len, lines))
+        if self.buffer_size >= BLOCKS_PER_BATCH * BGZF_BLOCK_SIZE:
+            self._deflate(False)
+
+    def flush(self):
+        if not self.closed:
+            self._deflate(False)
+            self._write_pending(0)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._deflate(True)
+            self._write_pending(0)
+            self.file.write(BGZF_EOF)
+            if self.offsets is not None:
+                with open(self.filename + ".gzi", "wb") as index_file:
+                    index_file.write(struct.pack("<Q", len(self.offsets)))
+                    for offsets in self.offsets:
+                        index_file.write(struct.pack("<QQ", *offsets))
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+            self.file.close()
+            super().close()
+
+    def _deflate(self, final: bool):
+        """Deflate the buffer, or only its whole blocks unless `final`"""
+        data = b"".join(self.buffer)
+        end = len(data) if final else len(data) // BGZF_BLOCK_SIZE * BGZF_BLOCK_SIZE
+        self.buffer = [data[end:]] if end < len(data) else []
+        self.buffer_size = len(data) - end
+        if end == 0:
+            return
+        if self.executor is None:
+            self._write_blocks(deflate_bgzf_blocks(data[:end], self.level))
+        else:
+            self.pending.append(
+                self.executor.submit(deflate_bgzf_blocks, data[:end], self.level)
+            )
+            # keep the threads busy, but the memory bounded
+            self._write_pending(2 * self.threads)
+
+    def _write_pending(self, max_pending: int):
+        """Write deflated batches until at most `max_pending` are left"""
+        while len(self.pending) > max_pending:
+            self._write_blocks(self.pending.popleft().result())
+
+    def _write_blocks(self, blocks: List[Tuple[bytes, int]]):
+        for block, uncompressed_size in blocks:
+            self.file.write(block)
+            self.compressed_offset += len(block)
+            self.uncompressed_offset += uncompressed_size
+            if self.offsets is not None:
+                # where each block after the first starts, as bgzip -i
+                # writes them
+                self.offsets.append((self.compressed_offset, self.uncompressed_offset))
@@ -0,0 +1,81 @@
+"""Build a binary k-mer index.
+
+This is a script for reading lists of k-mers unique to each haplotype
+into an index and saving it to a binary file, which classify-by-kmers
+can then load almost instantly with its --index option instead of
+re-reading the lists every time it runs.
+"""
+
+import argparse
+
+from trio_binning import kmers
+
+
+def parse_args():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "haplotype_a_kmers",
+        help="a list of k-mers unique to haplotype A, one per line",
+    )
+    parser.add_argument(
+        "haplotype_b_kmers",
+        help="a list of k-mers unique to haplotype B, one per line",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="kmer_index.bin",
+        help="path to write the index to, or 'shm:NAME' to put it in a shared "
+        "memory object that every classify-by-kmers run on this machine can use "
+        "without a copy of its own",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=sorted(kmers.INDEX_TYPES),
+        default="hash",
+        help="data structure to store the k-mers in: 'hash' has the fastest "
+        "lookups, 'sorted' needs only about 8 bytes per k-mer, and 'compressed' "
+        "needs only a few bytes per k-mer but has the slowest lookups",
+    )
+    parser.add_argument(
+        "--bloom-filter",
+        action="store_true",
+        help="also build a Bloom filter of the k-mers, which uses about 1.5 more "
+        "bytes per k-mer but speeds up classification by ruling out most "
+        "k-mers without looking them up",
+        default=False,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads to build the index with",
+    )
+    args = parser.parse_args()
+
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+
+    return args
+
+
+def main():
+    """Main method of program"""
+    args = parse_args()
+
+    kmer_index = kmers.create_kmer_index(
+        args.haplotype_a_kmers,
+        args.haplotype_b_kmers,
+        args.index_type,
+        args.bloom_filter,
+        args.threads,
+    )
+    kmers.write_kmer_index(kmer_index, args.output)
+
+
+if __name__ == "__main__":
+    main()
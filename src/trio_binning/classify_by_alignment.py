@@ -91,19 +91,19 @@ def classify_single(
     aligner_hap_a: mappy.Aligner,
     aligner_hap_b: mappy.Aligner,
     reads_to_classify: Iterator[seq.Read],
-    hap_a_out: seq.TextOrGzip,
-    hap_b_out: seq.TextOrGzip,
-    hap_u_out: seq.TextOrGzip,
+    hap_a_out: seq.RecordWriter[bytes],
+    hap_b_out: seq.RecordWriter[bytes],
+    hap_u_out: seq.RecordWriter[bytes],
 ):
     for read in reads_to_classify:
         alignment_a = max(aligner_hap_a.align(read.seq), key=lambda a: a.mlen)
         alignment_b = max(aligner_hap_b.align(read.seq), key=lambda a: a.mlen)
         if alignment_a.mlen > alignment_b.mlen:
-            print(read, file=hap_a_out)
+            hap_a_out.write(bytes(read))
         elif alignment_a.mlen < alignment_b.mlen:
-            print(read, file=hap_b_out)
+            hap_b_out.write(bytes(read))
         else:
-            print(read, file=hap_u_out)
+            hap_u_out.write(bytes(read))
 
 
 def classify_paired(
@@ -5,10 +5,31 @@ based on the presence of k-mers.
 """
 
 import argparse
+import sys
+from array import array
+from contextlib import ExitStack
+from functools import partial
 from os import path
-from typing import Tuple
+from typing import Callable, List, Optional, TextIO, Tuple
 
-from trio_binning import kmers, seq
+from trio_binning import kmers, seq, server
+from trio_binning.pipeline import BackgroundWriter, batched, ordered_map, read_ahead
+from trio_binning.score_table import ScoreTableWriter
+
+BATCH_BASES = 4000000
+"""Number of bases of reads to count the k-mers of in each call into the C
+extension"""
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """Parse a part of the reads given as i/N"""
+    try:
+        number, count = map(int, shard.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not of the form i/N: '{shard}'")
+    if not 1 <= number <= count:
+        raise argparse.ArgumentTypeError(f"i must be from 1 to N: '{shard}'")
+    return number, count
 
 
 def parse_args():
@@ -22,14 +43,66 @@ def parse_args():
     )
     parser.add_argument(
         "haplotype_a_kmers",
-        type=kmers.create_kmer_hash_set,
+        nargs="?",
         help="a list of k-mers unique to haplotype A, one per line",
     )
     parser.add_argument(
         "haplotype_b_kmers",
-        type=kmers.create_kmer_hash_set,
+        nargs="?",
         help="a list of k-mers unique to haplotype B, one per line",
     )
+    parser.add_argument(
+        "--index",
+        help="a binary k-mer index made by build-kmer-index, to use instead of "
+        "the lists of k-mers, or 'shm:NAME' for one it put in shared memory",
+    )
+    parser.add_argument(
+        "--server",
+        help="a Unix domain socket that serve-kmer-index is listening on, to have "
+        "it classify the reads with the index it has loaded instead of loading "
+        "one",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=sorted(kmers.INDEX_TYPES),
+        default="hash",
+        help="data structure to store the k-mers in: 'hash' has the fastest "
+        "lookups, 'sorted' needs only about 8 bytes per k-mer, and 'compressed' "
+        "needs only a few bytes per k-mer but has the slowest lookups (ignored "
+        "with --index)",
+    )
+    parser.add_argument(
+        "--bloom-filter",
+        action="store_true",
+        help="also build a Bloom filter of the k-mers, which uses about 1.5 more "
+        "bytes per k-mer but speeds up classification by ruling out most "
+        "k-mers without looking them up (ignored with --index)",
+        default=False,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads to build the index with, to count the k-mers in "
+        "reads with, and to inflate gzipped input and compress the output with. "
+        "Reading the input and writing each output also run in threads of their "
+        "own.",
+    )
+    parser.add_argument(
+        "--verify-index",
+        action="store_true",
+        help="verify the checksum of the index given with --index before using it",
+        default=False,
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="classify only the ith of N parts of the reads, given as i/N, so "
+        "that N machines can classify them together; merge-shards concatenates "
+        "their outputs. Uncompressed and bgzipped reads are split into ranges of "
+        "bytes, and gzipped ones into every Nth read.",
+    )
     parser.add_argument(
         "--haplotype-a-out-prefix",
         default="hapA",
@@ -51,17 +124,92 @@ def parse_args():
         help="don't gzip the output",
         default=False,
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--ids-only",
+        action="store_true",
+        help="instead of the reads in each bin, write only their names, one per "
+        "line, to PREFIX.ids, e.g., hapA.ids, for extract-bin to get the reads "
+        "from later",
+        default=False,
+    )
+    parser.add_argument(
+        "--score-table",
+        help="instead of printing a table of the scores of each read, write the "
+        "name, length, counts of haplotype A and B k-mers and bin of each read to "
+        "the columns of this .npz file, which numpy.load reads",
+    )
+    parser.add_argument(
+        "--early-stop",
+        type=float,
+        metavar="Z",
+        help="stop counting the k-mers of a read once the score of one haplotype "
+        "leads the other by Z standard deviations, i.e., |A - B| >= Z * sqrt(A + "
+        "B), checked every %d bases, which saves most of the time spent on long "
+        "reads. The scores of such a read are those of the part counted, whose "
+        "length is added to the table of scores." % kmers.DECISION_SEGMENT_LENGTH,
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(1, 10),
+        metavar="{1..9}",
+        default=9,
+        help="gzip compression level of the output, from 1, the fastest, to 9, "
+        "the smallest",
+    )
+    parser.add_argument(
+        "--bgzf-index",
+        action="store_true",
+        help="also write a bgzip index of each gzipped output, e.g., "
+        "hapA.fastq.gz.gzi, for reading it from the middle",
+        default=False,
+    )
+    args = parser.parse_args()
 
+    kmer_lists = args.haplotype_a_kmers or args.haplotype_b_kmers
+    if sum(map(bool, (args.index, args.server, kmer_lists))) > 1:
+        parser.error("give only one of --index, --server or lists of k-mers")
+    if not (args.index or args.server) and not (
+        args.haplotype_a_kmers and args.haplotype_b_kmers
+    ):
+        parser.error(
+            "give either --index, --server or lists of k-mers for both haplotypes"
+        )
+
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    if args.bgzf_index and (args.no_gzip_output or args.ids_only):
+        parser.error("--bgzf-index needs gzipped output")
+    if args.early_stop is not None and args.early_stop <= 0:
+        parser.error("--early-stop must be positive")
+
+    return args
 
-def calculate_scaling_factors(
-    haplotype_a_kmers: kmers.HashSet, haplotype_b_kmers: kmers.HashSet
-) -> Tuple[float, float]:
+
+def calculate_scaling_factors(kmer_index: kmers.KmerIndex) -> Tuple[float, float]:
     """Calculate the scaling factors for k-mer scores
 
     Args:
-        haplotype_a_kmers: set of k-mers in haplotype A
-        haplotype_b_kmers: set of k-mers in haplotype B
+        kmer_index: index of k-mers unique to haplotypes A and B
+
+    Returns:
+        scaling_factor_a: scaling factor by which haplotype A counts
+            should be multiplied
+        scaling_factor_b: scaling factor by which haplotype B counts
+            should be multiplied
+    """
+    return scaling_factors_for(*kmers.get_number_kmers_in_index(kmer_index))
+
+
+def scaling_factors_for(num_kmers_a: int, num_kmers_b: int) -> Tuple[float, float]:
+    """Calculate the scaling factors for k-mer scores
+
+    Scales the counts of the haplotype with fewer k-mers up, as if both
+    haplotypes had as many k-mers as the other.
+
+    Args:
+        num_kmers_a: the number of k-mers unique to haplotype A
+        num_kmers_b: the number of k-mers unique to haplotype B
 
     Returns:
         scaling_factor_a: scaling factor by which haplotype A counts
@@ -69,52 +217,280 @@ def calculate_scaling_factors(
         scaling_factor_b: scaling factor by which haplotype B counts
             should be multiplied
     """
-    num_kmers_a = kmers.get_number_kmers_in_set(haplotype_a_kmers)
-    num_kmers_b = kmers.get_number_kmers_in_set(haplotype_b_kmers)
     max_num_kmers = max(num_kmers_a, num_kmers_b)
     scaling_factor_a = 1.0 * max_num_kmers / num_kmers_a
     scaling_factor_b = 1.0 * max_num_kmers / num_kmers_b
     return scaling_factor_a, scaling_factor_b
 
 
-def main():
-    """Main method of program"""
-    args = parse_args()
+def count_kmers_in_batch(
+    kmer_index: kmers.KmerIndex,
+    batch: List[seq.RawRead],
+    early_stop: float = 0.0,
+    scaling_factors: Tuple[float, float] = (1.0, 1.0),
+) -> Tuple[List[seq.RawRead], array, array, array]:
+    """Count the k-mers unique to each haplotype in a batch of reads
 
-    reads = seq.open_fastx_read(args.reads)
+    Args:
+        kmer_index: index of k-mers unique to haplotypes A and B
+        batch: the reads to count the k-mers of
+        early_stop: how many standard deviations apart the scores of a
+            read must be to stop counting its k-mers, or 0 to count
+            them all, as for `kmers.count_kmers_in_reads_until_decided`
+        scaling_factors: the factors to multiply the counts of haplotype
+            A and B by to get their scores
 
-    haplotype_a_outfile, haplotype_b_outfile, unclassified_outfile = seq.open_outfiles(
-        args.haplotype_a_out_prefix,
-        args.haplotype_b_out_prefix,
-        args.unclassified_out_prefix,
-        path.splitext(args.reads.rstrip(".gz"))[1],
-        not args.no_gzip_output,
+    Returns:
+        batch: the reads, unchanged
+        hap_a_counts: the number of k-mers in each read unique to
+            haplotype A
+        hap_b_counts: the number of k-mers in each read unique to
+            haplotype B
+        scanned: the number of bases of each read whose k-mers were
+            counted
+    """
+    hap_a_counts, hap_b_counts, scanned = kmers.count_kmers_in_reads_until_decided(
+        (read.seq for read in batch), kmer_index, early_stop, scaling_factors
     )
+    return batch, hap_a_counts, hap_b_counts, scanned
+
 
-    scaling_factor_a, scaling_factor_b = calculate_scaling_factors(
-        args.haplotype_a_kmers,
-        args.haplotype_b_kmers,
+def format_read_name(read: seq.RawRead) -> bytes:
+    """Format the name of a read as a line of a list of read names"""
+    return read.name + b"\n"
+
+
+def classify_reads(
+    kmer_index: kmers.KmerIndex,
+    reads_path: str,
+    haplotype_a_prefix: str,
+    haplotype_b_prefix: str,
+    unclassified_prefix: str,
+    gzip_output: bool,
+    threads: int = 1,
+    scores_file: Optional[TextIO] = None,
+    compression_level: int = 9,
+    ids_only: bool = False,
+    shard: Optional[Tuple[int, int]] = None,
+    score_table: Optional[str] = None,
+    early_stop: Optional[float] = None,
+    bgzf_index: bool = False,
+):
+    """Classify the reads in a file into bins
+
+    Writes the reads in each bin to a file of their own, and a table
+    of the name, bin, haplotype A score and haplotype B score of each
+    read to `scores_file`, or a `score_table.ScoreTableWriter` table to
+    `score_table`. With `early_stop`, the table of scores also has the
+    number of bases of each read whose k-mers were counted.
+
+    Args:
+        kmer_index: index of k-mers unique to haplotypes A and B
+        reads_path: path to the reads, in fasta/q format, gzipped or not
+        haplotype_a_prefix: path prefix for haplotype A output file
+        haplotype_b_prefix: path prefix for haplotype B output file
+        unclassified_prefix: path prefix for unclassified output file
+        gzip_output: True to gzip output files, False otherwise
+        threads: number of threads to count the k-mers in reads with,
+            and to inflate gzipped input and compress the output with.
+            Reading the input and writing each output also run in
+            threads of their own.
+        scores_file: the file to write the table of scores to; by
+            default, standard output
+        compression_level: the gzip compression level of the output,
+            from 1, the fastest, to 9, the smallest
+        ids_only: True to write only the names of the reads in each
+            bin, one per line, to a file of the prefix plus ".ids",
+            which is never gzipped
+        shard: to classify only the ith of N parts of the reads, i and
+            N, as for `seq.open_fastx_read_raw`
+        score_table: the path of an .npz file to write a compact table
+            of the name, length, haplotype A and B k-mer counts and bin
+            of each read to, instead of writing scores to `scores_file`
+        early_stop: to stop counting the k-mers of a read once its
+            scores are this many standard deviations apart, as for
+            `kmers.count_kmers_in_reads_until_decided`, rather than
+            counting all of them
+        bgzf_index: True to also write a bgzip index of each gzipped
+            output, with ".gzi" added to its path
+    """
+    if threads < 1:
+        raise ValueError(f"Number of threads must be at least 1, not {threads}.")
+
+    reads = seq.open_fastx_read_raw(reads_path, threads, shard)
+
+    format_read: Callable[[seq.RawRead], bytes]
+    if ids_only:
+        outfile_extension = ".ids"
+        gzip_output = False
+        format_read = format_read_name
+    else:
+        outfile_extension = path.splitext(reads_path.rstrip(".gz"))[1]
+        format_read = bytes
+
+    haplotype_a_outfile, haplotype_b_outfile, unclassified_outfile = seq.open_outfiles(
+        haplotype_a_prefix,
+        haplotype_b_prefix,
+        unclassified_prefix,
+        outfile_extension,
+        gzip_output,
+        compression_level,
+        threads,
+        bgzf_index,
     )
 
-    for read in reads:
-        hap_a_count, hap_b_count = kmers.count_kmers_in_read(
-            read.seq, args.haplotype_a_kmers, args.haplotype_b_kmers
+    scaling_factors = calculate_scaling_factors(kmer_index)
+    scaling_factor_a, scaling_factor_b = scaling_factors
+
+    # reading and parsing the input, counting k-mers, and writing each
+    # output run at the same time, connected by bounded queues of
+    # batches of reads
+    batches = read_ahead(
+        batched(reads, BATCH_BASES, lambda read: len(read.seq)), 2 * threads
+    )
+    scores = seq.RecordWriter(scores_file if scores_file is not None else sys.stdout)
+    outfiles = (haplotype_a_outfile, haplotype_b_outfile, unclassified_outfile)
+    with ExitStack() as stack:
+        for outfile in outfiles:
+            stack.enter_context(outfile)
+        # each output is written, and compressed, in a thread of its own,
+        # which is stopped before the files are closed
+        haplotype_a_writer, haplotype_b_writer, unclassified_writer = (
+            stack.enter_context(BackgroundWriter(outfile.writelines, 2 * threads))
+            for outfile in outfiles
         )
+        scores_writer: BackgroundWriter
+        if score_table is None:
+            scores_writer = BackgroundWriter(scores.writelines, 2 * threads)
+        else:
+            table = stack.enter_context(
+                ScoreTableWriter(
+                    score_table, *kmers.get_number_kmers_in_index(kmer_index)
+                )
+            )
+            scores_writer = BackgroundWriter(
+                lambda columns: table.write(*columns), 2 * threads
+            )
+        stack.enter_context(scores_writer)
+        for batch, hap_a_counts, hap_b_counts, scanned in ordered_map(
+            partial(
+                count_kmers_in_batch,
+                kmer_index,
+                early_stop=early_stop or 0.0,
+                scaling_factors=scaling_factors,
+            ),
+            batches,
+            threads,
+        ):
+            haplotype_a_records: List[bytes] = []
+            haplotype_b_records: List[bytes] = []
+            unclassified_records: List[bytes] = []
+            read_bins: List[str] = []
+            for read, hap_a_count, hap_b_count in zip(
+                batch, hap_a_counts, hap_b_counts
+            ):
+                hap_a_score = hap_a_count * scaling_factor_a
+                hap_b_score = hap_b_count * scaling_factor_b
 
-        hap_a_score = hap_a_count * scaling_factor_a
-        hap_b_score = hap_b_count * scaling_factor_b
+                if hap_a_score > hap_b_score:
+                    read_bin = "A"
+                    haplotype_a_records.append(format_read(read))
+                elif hap_b_score > hap_a_score:
+                    read_bin = "B"
+                    haplotype_b_records.append(format_read(read))
+                else:
+                    read_bin = "U"
+                    unclassified_records.append(format_read(read))
+                read_bins.append(read_bin)
 
-        if hap_a_score > hap_b_score:
-            read_bin = "A"
-            read.print(file=haplotype_a_outfile)
-        elif hap_b_score > hap_a_score:
-            read_bin = "B"
-            read.print(file=haplotype_b_outfile)
-        else:
-            read_bin = "U"
-            read.print(file=unclassified_outfile)
+            haplotype_a_writer.write(haplotype_a_records)
+            haplotype_b_writer.write(haplotype_b_records)
+            unclassified_writer.write(unclassified_records)
+            if score_table is not None:
+                scores_writer.write(
+                    (
+                        [read.name for read in batch],
+                        [len(read.seq) for read in batch],
+                        hap_a_counts,
+                        hap_b_counts,
+                        "".join(read_bins).encode(),
+                        scanned,
+                    )
+                )
+            elif early_stop:
+                scores_writer.write(
+                    [
+                        f"{read.name.decode('utf-8')}\t{read_bin}\t"
+                        f"{hap_a_count * scaling_factor_a}\t"
+                        f"{hap_b_count * scaling_factor_b}\t{read_scanned}\n"
+                        for read, read_bin, hap_a_count, hap_b_count, read_scanned in (
+                            zip(batch, read_bins, hap_a_counts, hap_b_counts, scanned)
+                        )
+                    ]
+                )
+            else:
+                scores_writer.write(
+                    [
+                        f"{read.name.decode('utf-8')}\t{read_bin}\t"
+                        f"{hap_a_count * scaling_factor_a}\t"
+                        f"{hap_b_count * scaling_factor_b}\n"
+                        for read, read_bin, hap_a_count, hap_b_count in zip(
+                            batch, read_bins, hap_a_counts, hap_b_counts
+                        )
+                    ]
+                )
+    # the scores go to a file that the caller opened, and closes
+    scores.flush()
+
+
+def main():
+    """Main method of program"""
+    args = parse_args()
+
+    if args.server:
+        with server.KmerIndexClient(args.server) as client:
+            client.classify(
+                args.reads,
+                args.haplotype_a_out_prefix,
+                args.haplotype_b_out_prefix,
+                args.unclassified_out_prefix,
+                not args.no_gzip_output,
+                args.threads,
+                compression_level=args.compression_level,
+                ids_only=args.ids_only,
+                shard=args.shard,
+                score_table=args.score_table,
+                early_stop=args.early_stop,
+                bgzf_index=args.bgzf_index,
+            )
+        return
+
+    if args.index:
+        kmer_index = kmers.load_kmer_index(args.index, args.verify_index)
+    else:
+        kmer_index = kmers.create_kmer_index(
+            args.haplotype_a_kmers,
+            args.haplotype_b_kmers,
+            args.index_type,
+            args.bloom_filter,
+            args.threads,
+        )
 
-        print("\t".join(map(str, [read.name, read_bin, hap_a_score, hap_b_score])))
+    classify_reads(
+        kmer_index,
+        args.reads,
+        args.haplotype_a_out_prefix,
+        args.haplotype_b_out_prefix,
+        args.unclassified_out_prefix,
+        not args.no_gzip_output,
+        args.threads,
+        compression_level=args.compression_level,
+        ids_only=args.ids_only,
+        shard=args.shard,
+        score_table=args.score_table,
+        early_stop=args.early_stop,
+        bgzf_index=args.bgzf_index,
+    )
 
 
 if __name__ == "__main__":
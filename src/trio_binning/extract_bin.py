@@ -0,0 +1,106 @@
+"""Extract the reads in bins from a fasta/q file.
+
+This is a script for splitting reads into bins by lists of their names,
+such as the ones classify-by-kmers writes with --ids-only, reading the
+reads only once. The reads named in each list, e.g., hapA.ids, are
+written to a file named for the list, e.g., hapA.fastq.gz.
+"""
+
+import argparse
+from contextlib import ExitStack
+from os import path
+from typing import Dict, List
+
+from trio_binning import seq
+
+
+def parse_args():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "reads",
+        help="reads to extract bins from, in fasta/q format. Can be gzipped.",
+    )
+    parser.add_argument(
+        "ids",
+        nargs="+",
+        help="lists of the names of the reads in each bin, one per line. The reads "
+        "in a list are written to its path, minus any '.ids', plus the extension "
+        "of the reads. A read named in more than one list is written to the last.",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads to inflate gzipped input and compress the output "
+        "with",
+    )
+    parser.add_argument(
+        "--no-gzip-output",
+        action="store_true",
+        help="don't gzip the output",
+        default=False,
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(1, 10),
+        metavar="{1..9}",
+        default=9,
+        help="gzip compression level of the output, from 1, the fastest, to 9, "
+        "the smallest",
+    )
+    parser.add_argument(
+        "--bgzf-index",
+        action="store_true",
+        help="also write a bgzip index of each gzipped output, e.g., "
+        "hapA.fastq.gz.gzi, for reading it from the middle",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    if args.bgzf_index and args.no_gzip_output:
+        parser.error("--bgzf-index needs gzipped output")
+
+    return args
+
+
+def read_names(ids_path: str) -> List[bytes]:
+    """Read a list of read names, one per line"""
+    with open(ids_path, "rb") as ids_file:
+        return [name for name in ids_file.read().splitlines() if name]
+
+
+def main():
+    """Main method of program"""
+    args = parse_args()
+
+    outfile_extension = path.splitext(args.reads.rstrip(".gz"))[1]
+    with ExitStack() as outfiles:
+        outfile_for_name: Dict[bytes, seq.RecordWriter[bytes]] = {}
+        for ids_path in args.ids:
+            prefix = ids_path[: -len(".ids")] if ids_path.endswith(".ids") else ids_path
+            outfile = outfiles.enter_context(
+                seq.open_outfile(
+                    prefix + outfile_extension,
+                    not args.no_gzip_output,
+                    args.compression_level,
+                    args.threads,
+                    args.bgzf_index,
+                )
+            )
+            outfile_for_name.update(dict.fromkeys(read_names(ids_path), outfile))
+
+        for read in seq.open_fastx_read_raw(args.reads, args.threads):
+            outfile = outfile_for_name.get(read.name)
+            if outfile is not None:
+                outfile.write(bytes(read))
+
+
+if __name__ == "__main__":
+    main()
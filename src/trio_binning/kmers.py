@@ -1,159 +1,367 @@
 """Functions for counting k-mers quickly.
 
-This module contains functions that interface with the C library for
-counting k-mers, in order to hide all the ugly C pointer stuff from
+This module contains functions that interface with the C extension for
+counting k-mers, in order to hide the details of the extension from
 python code that just wants to count k-mers.
 
->>> hapA = kmers.create_kmer_hash_set("../c/hapA.txt")
-Found 7 13-mers in file.
->>> hapB = kmers.create_kmer_hash_set("../c/hapB.txt")
-Found 6 13-mers in file.
->>> kmers.count_kmers_in_read("GAGGAGATTTAGAGTGTGAGTCGAGCATAGAGATATATA", hapA, hapB)
+>>> index = kmers.create_kmer_index("../c/hapA.txt", "../c/hapB.txt")
+Found 7 13-mers in ../c/hapA.txt.
+Found 6 13-mers in ../c/hapB.txt.
+>>> kmers.count_kmers_in_read("GAGGAGATTTAGAGTGTGAGTCGAGCATAGAGATATATA", index)
 (1, 2)
 """
 import sys
-from ctypes import (
-    POINTER,
-    Structure,
-    byref,
-    c_char_p,
-    c_int,
-    c_ubyte,
-    c_uint64,
-    cdll,
-    pointer,
-)
-from importlib.machinery import EXTENSION_SUFFIXES
-from os.path import dirname, isfile, join
-from typing import TYPE_CHECKING, Tuple
-
-correct_library_file = ""
-for extension in EXTENSION_SUFFIXES:
-    possible_library_file = join(dirname(__file__), "kmers_c" + extension)
-    if isfile(possible_library_file):
-        correct_library_file = possible_library_file
-
-if correct_library_file == "":
-    raise ImportError("Cannot load kmers_c library. Is it installed correctly?")
-lib = cdll.LoadLibrary(correct_library_file)
-
-
-class _HashSet(Structure):
-    """Container for a c struct containing a k-mer hash set
-
-    This is just a container for a c struct. It is necessary to define
-    it here in order to allow python code interfacing with code taking
-    a pointer to this struct as an object, or returning a pointer to it
-    as an argument, to understand what is getting passed or returned.
-
-    `HashSet` (no underscore) is a pointer to this class, and the
-    actual type that gets accepted and returned by the C functions.
-    """
+from array import array
+from itertools import accumulate
+from os.path import isfile
+from typing import Iterable, Tuple, Union
+
+from trio_binning import kmers_c
+from trio_binning.kmers_c import KmerIndex
+
+INDEX_TYPES = {"hash": 0, "sorted": 1, "compressed": 2}
+"""Data structures a k-mer index can be stored in, and their C codes
+
+"hash" is a hash table, which has the fastest lookups. "sorted" is a
+sorted array, which needs only about 8 bytes per k-mer but has slower
+lookups. "compressed" is an Elias-Fano coded sorted array, which needs
+only about 2k - log2(number of k-mers) + 4 bits per k-mer, e.g., under
+2 bytes per k-mer for 3 billion 21-mers, with lookups slower still.
+"""
 
-    _fields_: list = [
-        ("kmers", POINTER(c_uint64)),
-        ("full", POINTER(c_ubyte)),
-        ("hash_size", c_int),
-        ("k", c_ubyte),
-        ("num_kmers", c_int),
-    ]
 
+SHARED_MEMORY_PREFIX = "shm:"
+"""Prefix of an index path that names a POSIX shared memory object, e.g.,
+"shm:parents", rather than a file
 
-create_kmer_hash_set_c = lib.create_kmer_hash_set
-create_kmer_hash_set_c.argtypes = [c_char_p]
-create_kmer_hash_set_c.restype = POINTER(_HashSet)
+An index written to shared memory stays there, using memory, until it is
+removed with `remove_kmer_index` or the machine restarts. Every process
+that loads it uses the same copy rather than one of its own.
+"""
 
-count_kmers_in_read_c = lib.count_kmers_in_read
-count_kmers_in_read_c.argtypes = [
-    c_char_p,
-    POINTER(_HashSet),
-    POINTER(_HashSet),
-    POINTER(c_int),
-    POINTER(c_int),
-]
 
-kmer_to_int_c = lib.kmer_to_int
-kmer_to_int_c.argtypes = [c_char_p, c_ubyte]
-kmer_to_int_c.restype = c_uint64
+MAX_K = 64
+"""Longest k-mers an index can hold. Only the "hash" index type supports
+k-mers longer than 32."""
 
 
-def kmer_to_int(kmer: str) -> int:
-    """Convert a kmer to integer format"""
-    return kmer_to_int_c(bytes(kmer, "utf-8"), c_ubyte(len(kmer)))
+DECISION_SEGMENT_LENGTH = 4096
+"""Number of bases of a read whose k-mers are counted between checks of
+whether it is clear which haplotype the read comes from, by
+`count_kmers_in_reads_until_decided`"""
 
 
-reverse_complement_c = lib.reverse_complement
-reverse_complement_c.argtypes = [c_char_p, c_char_p, c_ubyte]
+def kmer_to_int(kmer: str) -> int:
+    """Convert a kmer to integer format"""
+    if len(kmer) > 32:
+        # base i is at bits 2i, so the second half of the k-mer starts at
+        # bit 64, just past what the C function can return
+        return kmer_to_int(kmer[:32]) | kmer_to_int(kmer[32:]) << 64
+    return kmers_c.kmer_to_int(kmer.encode("utf-8"))
 
 
 def reverse_complement(kmer: str) -> str:
     """Reverse complement a k-mer"""
-    out_kmer = bytes("x" * len(kmer), "utf-8")
-    reverse_complement_c(bytes(kmer, "utf-8"), out_kmer, len(kmer))
-    return out_kmer.decode("utf-8")
+    return kmers_c.reverse_complement(kmer.encode("utf-8")).decode("utf-8")
+
 
+def create_kmer_index(
+    hap_a_kmer_file_path: str,
+    hap_b_kmer_file_path: str,
+    index_type: str = "hash",
+    bloom_filter: bool = False,
+    threads: int = 1,
+) -> KmerIndex:
+    """Read lists of k-mers unique to each haplotype into an index.
 
-# this is ugly as sin, but necessary because mypy is ok with `pointer`
-# as a subscriptable type while python runtime is not
-if TYPE_CHECKING:
-    HashSet = pointer[_HashSet]
-else:
-    HashSet = pointer
+    Reads two lists of k-mers into a single quickly searchable table,
+    in which each k-mer is labelled with the haplotype it is unique
+    to, so that looking up a k-mer takes only one search. K-mers of
+    up to `MAX_K` bases are supported; those longer than 32 bases are
+    stored as 128-bit integers, which only the "hash" index type
+    supports.
+
+    Args:
+        hap_a_kmer_file_path: the path to a file containing the k-mers
+            unique to haplotype A, one per line.
+        hap_b_kmer_file_path: the path to a file containing the k-mers
+            unique to haplotype B, one per line.
+        index_type: the data structure to store the k-mers in; one of
+            the keys of `INDEX_TYPES`
+        bloom_filter: True to also build a Bloom filter of the k-mers,
+            which takes about 1.5 more bytes per k-mer but lets most
+            k-mers that are not in the index be ruled out without
+            searching the index for them
+        threads: the number of threads to read the k-mers and build
+            the index with. Indexes of k-mers longer than 32 bases are
+            always built with one.
+
+    Returns:
+        a quickly searchable index of these k-mers that can be passed
+        to `count_kmers_in_read`
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type}.")
+    if threads < 1:
+        raise ValueError(f"Number of threads must be at least 1, not {threads}.")
+
+    for kmer_file_path in (hap_a_kmer_file_path, hap_b_kmer_file_path):
+        if not isfile(kmer_file_path):
+            raise IOError(
+                f"Specified file {kmer_file_path} does not exist or is not file."
+            )
+
+    print(
+        f"Reading k-mers in {hap_a_kmer_file_path} and {hap_b_kmer_file_path}...",
+        file=sys.stderr,
+    )
+
+    return kmers_c.create_kmer_index(
+        hap_a_kmer_file_path,
+        hap_b_kmer_file_path,
+        INDEX_TYPES[index_type],
+        bloom_filter,
+        threads,
+    )
 
 
-def create_kmer_hash_set(kmer_file_path: str) -> HashSet:
-    """Read a list of k-mers into a set.
+def write_kmer_index(kmer_index: KmerIndex, index_file_path: str):
+    """Write a k-mer index to a binary file.
 
-    Reads a list of k-mers into a quickly searchable hash set.
+    The file contains the finished table, and Bloom filter if there
+    is one, along with a versioned
+    header and a checksum, so that it can be loaded again with
+    `load_kmer_index` without re-reading the k-mer lists.
 
     Args:
-        kmer_file_path: the path to a file containing a set of k-mers,
-            one per line.
+        kmer_index: the index to write
+        index_file_path: the path of the file to write, or the name of
+            a shared memory object to write it to, prefixed with
+            `SHARED_MEMORY_PREFIX`. Files on tmpfs and hugetlbfs are
+            also shared by every process that loads them.
+    """
+    kmer_index.write(index_file_path)
+
+
+def load_kmer_index(index_file_path: str, verify: bool = False) -> KmerIndex:
+    """Load a k-mer index from a binary file.
+
+    Memory-maps a file written by `write_kmer_index`, so that the
+    index is ready to use almost immediately no matter how big it is.
+
+    Args:
+        index_file_path: the path to the index file, or the name of a
+            shared memory object prefixed with `SHARED_MEMORY_PREFIX`
+        verify: True to check the checksum of the index, which requires
+            reading the whole file
 
     Returns:
-        a quickly searchable set of these k-mers that can be passed to
-        `count_kmers_in_read`
+        an index that can be passed to `count_kmers_in_read`
     """
-    if not isfile(kmer_file_path):
-        raise IOError(f"Specified file {kmer_file_path} does not exist or is not file.")
+    if not index_file_path.startswith(SHARED_MEMORY_PREFIX) and not isfile(
+        index_file_path
+    ):
+        raise IOError(
+            f"Specified file {index_file_path} does not exist or is not file."
+        )
+
+    return kmers_c.load_kmer_index(index_file_path, verify)
+
 
-    print(f"Reading k-mers in {kmer_file_path}...", file=sys.stderr)
+def remove_kmer_index(index_file_path: str):
+    """Remove an index written by `write_kmer_index`.
 
-    return create_kmer_hash_set_c(kmer_file_path.encode("utf-8"))
+    Mostly useful for freeing the memory used by an index in shared
+    memory. Processes that have already loaded the index can keep
+    using it; its memory is freed once the last of them is done.
+
+    Args:
+        index_file_path: the path to the index file, or the name of a
+            shared memory object prefixed with `SHARED_MEMORY_PREFIX`
+    """
+    kmers_c.remove_kmer_index(index_file_path)
 
 
 def count_kmers_in_read(
-    read: str, kmers_hap_a: HashSet, kmers_hap_b: HashSet
+    read: Union[str, bytes], kmer_index: KmerIndex
 ) -> Tuple[int, int]:
-    """Count k-mers in read and two sets
+    """Count k-mers in read unique to each haplotype
 
-    Counts the k-mers in a read, keeping track of how many are in two
-    different sets, respectively.
+    Counts the k-mers in a read, keeping track of how many are unique
+    to haplotype A and haplotype B, respectively.
 
     Args:
-        read: a string containing a DNA sequence read. May only contain
-            [ACGT].
-        kmers_hap_a: a hash set containing all k-mers in haplotype A
-        kmers_hap_b: a hash set containing all k-mers in haplotype B
+        read: a string containing a DNA sequence read, or the read as
+            bytes or any other object supporting the buffer protocol,
+            which is read without copying it. Windows containing
+            characters other than [ACGTacgt] are skipped.
+        kmer_index: an index of k-mers unique to each haplotype
 
     Returns:
         A tuple of two ints, where the first is the number of k-mers in
-        the read found in the haplotype A set, and the second is the
-        number of k-mers in the read found in the haplotype B set
+        the read unique to haplotype A, and the second is the number of
+        k-mers in the read unique to haplotype B
+    """
+    if isinstance(read, str):
+        read = read.encode("utf-8")
+    return kmer_index.count_kmers_in_read(read)
+
+
+def count_kmers_in_read_buffer(
+    reads: bytes, offsets: array, kmer_index: KmerIndex
+) -> Tuple[array, array]:
+    """Count k-mers unique to each haplotype in each of a batch of reads
+
+    Counts the k-mers in many reads with a single call into the C
+    extension, which avoids the overhead of a call per read and does
+    not hold the GIL while counting. Neither the reads nor the offsets
+    are copied.
+
+    Args:
+        reads: the sequences of the reads, one after another, as bytes
+            or any other object supporting the buffer protocol, e.g., a
+            bytearray, memoryview or numpy uint8 array
+        offsets: the offsets into `reads` at which each read starts,
+            followed by the offset at which the last one ends, so that
+            read i is `reads[offsets[i]:offsets[i + 1]]`, as an array of
+            type "Q" or any other buffer of unsigned 64-bit integers,
+            e.g., a numpy uint64 array
+        kmer_index: an index of k-mers unique to each haplotype
+
+    Returns:
+        A tuple of two arrays of type "i", the first of which has the
+        number of k-mers in each read unique to haplotype A, and the
+        second the number unique to haplotype B
     """
-    count_a, count_b = c_int(), c_int()
-
-    count_kmers_in_read_c(
-        read.encode("utf-8"),
-        kmers_hap_a,
-        kmers_hap_b,
-        byref(count_a),
-        byref(count_b),
+    num_reads = max(len(offsets) - 1, 0)
+    counts_a = array("i", [0]) * num_reads
+    counts_b = array("i", [0]) * num_reads
+
+    kmer_index.count_kmers_in_reads(reads, offsets, counts_a, counts_b)
+
+    return counts_a, counts_b
+
+
+def count_kmers_in_reads(
+    reads: Iterable[Union[str, bytes]], kmer_index: KmerIndex
+) -> Tuple[array, array]:
+    """Count k-mers unique to each haplotype in each of a batch of reads
+
+    Packs the reads into a single buffer and counts them all with
+    `count_kmers_in_read_buffer`.
+
+    Args:
+        reads: strings or bytes containing DNA sequence reads.
+            Windows containing characters other than [ACGTacgt] are
+            skipped.
+        kmer_index: an index of k-mers unique to each haplotype
+
+    Returns:
+        A tuple of two arrays of type "i", the first of which has the
+        number of k-mers in each read unique to haplotype A, and the
+        second the number unique to haplotype B
+    """
+    return count_kmers_in_read_buffer(*pack_reads(reads), kmer_index)
+
+
+def count_kmers_in_read_buffer_until_decided(
+    reads: bytes,
+    offsets: array,
+    kmer_index: KmerIndex,
+    bound: float,
+    scaling_factors: Tuple[float, float] = (1.0, 1.0),
+) -> Tuple[array, array, array]:
+    """Count k-mers unique to each haplotype in each of a batch of reads
+    until it is clear which haplotype each read comes from
+
+    Like `count_kmers_in_read_buffer`, but stops counting the k-mers of
+    a read once its scores, its counts times the scaling factors, are at
+    least `bound` standard deviations apart, i.e., once
+    |score A - score B| >= bound * sqrt(score A + score B), which is
+    checked every `DECISION_SEGMENT_LENGTH` bases. Most of a long read
+    that clearly comes from one haplotype is then never looked at.
+
+    Args:
+        reads: the sequences of the reads, one after another
+        offsets: the offsets into `reads` at which each read starts,
+            followed by the offset at which the last one ends
+        kmer_index: an index of k-mers unique to each haplotype
+        bound: how many standard deviations apart the scores of a read
+            must be to stop counting its k-mers, or 0 to count them all
+        scaling_factors: the factors to multiply the counts of haplotype
+            A and B by to get their scores
+
+    Returns:
+        A tuple of three arrays, the first two of type "i" with the
+        number of k-mers counted in each read unique to haplotype A and
+        B, and the third of type "Q" with the number of bases at the
+        start of each read whose k-mers were counted, which is less
+        than its length if it was decided early
+    """
+    num_reads = max(len(offsets) - 1, 0)
+    counts_a = array("i", [0]) * num_reads
+    counts_b = array("i", [0]) * num_reads
+    scanned = array("Q", [0]) * num_reads
+
+    scale_a, scale_b = scaling_factors
+    kmer_index.count_kmers_in_reads(
+        reads,
+        offsets,
+        counts_a,
+        counts_b,
+        scanned=scanned,
+        bound=bound,
+        scale_a=scale_a,
+        scale_b=scale_b,
+    )
+
+    return counts_a, counts_b, scanned
+
+
+def count_kmers_in_reads_until_decided(
+    reads: Iterable[Union[str, bytes]],
+    kmer_index: KmerIndex,
+    bound: float,
+    scaling_factors: Tuple[float, float] = (1.0, 1.0),
+) -> Tuple[array, array, array]:
+    """Count k-mers unique to each haplotype in each of a batch of reads
+    until it is clear which haplotype each read comes from
+
+    Packs the reads into a single buffer and counts them all with
+    `count_kmers_in_read_buffer_until_decided`, which see.
+    """
+    return count_kmers_in_read_buffer_until_decided(
+        *pack_reads(reads), kmer_index, bound, scaling_factors
     )
 
-    return count_a.value, count_b.value
+
+def pack_reads(reads: Iterable[Union[str, bytes]]) -> Tuple[bytes, array]:
+    """Pack reads one after another into a single buffer
+
+    Returns:
+        the sequences of the reads, one after another, and an array of
+        type "Q" of the offsets at which each read starts, followed by
+        the offset at which the last one ends
+    """
+    sequences = [
+        read.encode("utf-8") if isinstance(read, str) else read for read in reads
+    ]
+    offsets = array("Q", [0])
+    offsets.extend(accumulate(map(len, sequences)))
+    return b"".join(sequences), offsets
+
+
+def get_index_type(kmer_index: KmerIndex) -> str:
+    """Look up the data structure an index is stored in"""
+    index_types = {code: name for name, code in INDEX_TYPES.items()}
+    return index_types[kmer_index.index_type]
+
+
+def has_bloom_filter(kmer_index: KmerIndex) -> bool:
+    """Check whether an index has a Bloom filter in front of it"""
+    return kmer_index.has_bloom_filter
 
 
-def get_number_kmers_in_set(kmer_hash_set: HashSet) -> int:
-    """Look up the number of k-mers in a hash set"""
-    return kmer_hash_set.contents.num_kmers
+def get_number_kmers_in_index(kmer_index: KmerIndex) -> Tuple[int, int]:
+    """Look up the number of k-mers unique to each haplotype in an index"""
+    return kmer_index.num_kmers_a, kmer_index.num_kmers_b
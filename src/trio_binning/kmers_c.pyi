@@ -0,0 +1,37 @@
+"""Type stubs for the C extension in c/kmers_module.c"""
+
+from typing import Tuple
+
+class KmerIndex:
+    @property
+    def index_type(self) -> int: ...
+    @property
+    def k(self) -> int: ...
+    @property
+    def num_kmers_a(self) -> int: ...
+    @property
+    def num_kmers_b(self) -> int: ...
+    @property
+    def has_bloom_filter(self) -> bool: ...
+    def write(self, path: str) -> None: ...
+    def count_kmers_in_read(self, read: bytes) -> Tuple[int, int]: ...
+    def count_kmers_in_reads(
+        self,
+        reads: bytes,
+        offsets: object,
+        counts_a: object,
+        counts_b: object,
+        *,
+        scanned: object = ...,
+        bound: float = ...,
+        scale_a: float = ...,
+        scale_b: float = ...,
+    ) -> None: ...
+
+def create_kmer_index(
+    hap_a_path: str, hap_b_path: str, index_type: int, bloom_filter: bool, threads: int
+) -> KmerIndex: ...
+def load_kmer_index(path: str, verify: bool) -> KmerIndex: ...
+def remove_kmer_index(path: str) -> None: ...
+def kmer_to_int(kmer: bytes) -> int: ...
+def reverse_complement(kmer: bytes) -> bytes: ...
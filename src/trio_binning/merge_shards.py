@@ -0,0 +1,97 @@
+"""Merge the outputs of classify-by-kmers run on parts of the reads.
+
+This is a script for concatenating the files that classify-by-kmers
+--shard writes for each part of a file of reads, in order, into the
+file it would have written for the whole: a bin of reads, a list of
+read names, or a table of scores, printed or written to an .npz file
+with --score-table. Gzipped bins are concatenated without inflating
+them.
+"""
+
+import argparse
+from itertools import chain
+from os import path
+from typing import List
+
+from trio_binning import bgzf, score_table
+
+
+def parse_args():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "output",
+        help="file to write the merged output to",
+    )
+    parser.add_argument(
+        "shards",
+        nargs="+",
+        help="the outputs for each part of the reads, from the first to the last",
+    )
+    args = parser.parse_args()
+
+    if path.exists(args.output) and any(
+        path.samefile(args.output, shard) for shard in args.shards
+    ):
+        parser.error("the output can't also be one of the shards")
+
+    return args
+
+
+def merge_files(output_path: str, shard_paths: List[str]):
+    """Concatenate files, e.g., the outputs for each part of the reads
+
+    A BGZF file ends with an empty block marking the end of the file,
+    which is left out of each file but the last, since some readers
+    stop at it.
+
+    Args:
+        output_path: the path to write the concatenated files to
+        shard_paths: the paths of the files to concatenate, in order
+    """
+    ends_with_eof = False
+    with open(output_path, "wb") as output:
+        for shard_path in shard_paths:
+            size = path.getsize(shard_path)
+            with open(shard_path, "rb") as shard:
+                shard.seek(max(size - len(bgzf.BGZF_EOF), 0))
+                ends_with_eof = shard.read() == bgzf.BGZF_EOF
+                if ends_with_eof:
+                    size -= len(bgzf.BGZF_EOF)
+                shard.seek(0)
+                for chunk in bgzf.read_range(shard, size):
+                    output.write(chunk)
+        if ends_with_eof:
+            output.write(bgzf.BGZF_EOF)
+
+
+def merge_score_tables(output_path: str, shard_paths: List[str]):
+    """Concatenate the rows of .npz tables of scores
+
+    Args:
+        output_path: the path to write the concatenated table to
+        shard_paths: the paths of the tables to concatenate, in order
+    """
+    tables = (score_table.read_score_table(shard_path) for shard_path in shard_paths)
+    first_table = next(tables)
+    num_kmers = first_table["num_kmers_a"], first_table["num_kmers_b"]
+    with score_table.ScoreTableWriter(output_path, *num_kmers) as output:
+        for table in chain([first_table], tables):
+            if (table["num_kmers_a"], table["num_kmers_b"]) != num_kmers:
+                raise ValueError("The tables were made with different indexes.")
+            output.write(*(table[column] for column in score_table.COLUMNS))
+
+
+def main():
+    """Main method of program"""
+    args = parse_args()
+    if args.output.endswith(".npz"):
+        merge_score_tables(args.output, args.shards)
+    else:
+        merge_files(args.output, args.shards)
+
+
+if __name__ == "__main__":
+    main()
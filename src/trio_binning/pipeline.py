@@ -0,0 +1,245 @@
+"""Helpers for running the stages of a classifier at the same time.
+
+Reading, counting and writing are connected by bounded buffers, so that
+a fast stage waits for a slow one instead of holding more and more
+batches of reads in memory.
+"""
+
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Deque,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TypeVar,
+)
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+_END = object()
+"""Marks the end of the items passed from a background thread"""
+
+POLL_INTERVAL = 0.1
+"""Seconds that a thread waiting for room in a buffer waits at a time
+before checking whether it has been told to stop"""
+
+
+def batched(
+    items: Iterable[T], batch_size: int, size: Callable[[T], int] = lambda item: 1
+) -> Iterator[List[T]]:
+    """Group items into lists.
+
+    Args:
+        items: the items to group
+        batch_size: the total size of the items in each list, which
+            the last item in a list may take it past, and which the last
+            list may fall short of
+        size: a function giving the size of an item; by default, every
+            item has a size of 1, so that `batch_size` is the number of
+            items in each list
+
+    Yields:
+        lists of consecutive items
+    """
+    batch: List[T] = []
+    total_size = 0
+    for item in items:
+        batch.append(item)
+        total_size += size(item)
+        if total_size >= batch_size:
+            yield batch
+            batch = []
+            total_size = 0
+    if batch:
+        yield batch
+
+
+def read_ahead(items: Iterable[T], max_items: int) -> Iterator[T]:
+    """Iterate over items in a background thread.
+
+    Runs the iteration, e.g., the reading and parsing of an input file,
+    in a separate thread that stays up to `max_items` items ahead of
+    the caller. An exception raised while iterating is raised again in
+    the caller. If the caller stops iterating early, e.g., because of
+    an exception or by closing the iterator, the thread stops too, and
+    closes `items` if it can be closed.
+
+    Args:
+        items: the items to iterate over
+        max_items: the most items to have waiting for the caller
+
+    Returns:
+        an iterator over the items, in order
+
+    Raises:
+        ValueError: if `max_items` is less than 1
+    """
+    if max_items < 1:
+        raise ValueError(f"max_items must be at least 1, not {max_items}")
+    return _read_ahead(items, max_items)
+
+
+def _read_ahead(items: Iterable[T], max_items: int) -> Iterator[T]:
+    buffer: "queue.Queue" = queue.Queue(max_items)
+    stopped = threading.Event()
+    iterator = iter(items)
+
+    def put(item) -> bool:
+        """Put an item in the buffer, unless the caller stops first"""
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except BaseException as error:
+            put(error)
+            return
+        finally:
+            # e.g., to close the input file as soon as it is not needed
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+        put(_END)
+
+    # a daemon thread, so that the program can exit if the thread is
+    # still waiting for an item from `items` when the caller stops
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+class BackgroundWriter(Generic[T]):
+    """Write items in a background thread.
+
+    The counterpart of `read_ahead`: passes each item written to it to
+    `write`, e.g., to compress and write a batch of reads to a file, in
+    a separate thread that lets up to `max_items` items wait for it, so
+    that the caller only waits when `write` falls behind. An exception
+    raised by `write` is raised again in the caller, by the next call
+    to `write` or `close`. The thread is stopped by `close`, or at the
+    end of a `with` block.
+
+    Args:
+        write: the function to pass each item to
+        max_items: the most items to have waiting for `write`
+
+    Raises:
+        ValueError: if `max_items` is less than 1
+    """
+
+    def __init__(self, write: Callable[[T], object], max_items: int):
+        if max_items < 1:
+            raise ValueError(f"max_items must be at least 1, not {max_items}")
+        self.buffer: "queue.Queue" = queue.Queue(max_items)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._consume, args=(write,), daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # the error the caller stopped for matters more than any here
+            self._stop()
+
+    def _consume(self, write: Callable[[T], object]):
+        while True:
+            item = self.buffer.get()
+            if item is _END:
+                return
+            if self.error is None:
+                try:
+                    write(item)
+                except BaseException as error:
+                    # keep taking items, so that the caller never waits
+                    # for a thread that has stopped writing them
+                    self.error = error
+
+    def write(self, item: T):
+        """Pass an item to `write`, once there is room for it"""
+        if self.error is not None:
+            raise self.error
+        self.buffer.put(item)
+
+    def close(self):
+        """Wait for every item to be written, and stop the thread"""
+        self._stop()
+        if self.error is not None:
+            raise self.error
+
+    def _stop(self):
+        if self.thread.is_alive():
+            self.buffer.put(_END)
+            self.thread.join()
+
+
+def ordered_map(
+    function: Callable[[T], U], items: Iterable[T], threads: int
+) -> Iterator[U]:
+    """Apply a function to items using several threads.
+
+    Unlike `ThreadPoolExecutor.map`, this takes items from `items` only
+    as results are consumed, keeping at most two per thread in flight,
+    so that it can be used on an input too big to fit in memory. This
+    only speeds things up if `function` spends most of its time with
+    the GIL released, e.g., in a C extension.
+
+    Args:
+        function: the function to apply to each item
+        items: the items to apply it to
+        threads: the number of threads to use. With 1, `function` is
+            applied in the calling thread.
+
+    Returns:
+        an iterator over the result of `function` for each item, in the
+        order of `items`
+
+    Raises:
+        ValueError: if `threads` is less than 1
+    """
+    if threads < 1:
+        raise ValueError(f"threads must be at least 1, not {threads}")
+    return _ordered_map(function, items, threads)
+
+
+def _ordered_map(
+    function: Callable[[T], U], items: Iterable[T], threads: int
+) -> Iterator[U]:
+    if threads == 1:
+        yield from map(function, items)
+        return
+
+    pending: Deque[Future] = deque()
+    with ThreadPoolExecutor(threads) as executor:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,256 @@
+"""Bin reads again from their saved k-mer counts.
+
+This is a script for classifying reads into bins with a different rule
+than classify-by-kmers did, from the table of their k-mer counts that
+it wrote with --score-table, without loading an index or counting
+k-mers again. It writes lists of the names of the reads in each bin,
+or, given the reads, splits them into bins in one pass.
+"""
+
+import argparse
+import sys
+from array import array
+from os import path
+from typing import Iterable, Iterator, Tuple
+
+from trio_binning import score_table, seq
+from trio_binning.classify_by_kmers import scaling_factors_for
+
+
+def parse_args():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "score_table",
+        help="table of the k-mer counts of each read, written by classify-by-kmers "
+        "--score-table",
+    )
+    parser.add_argument(
+        "--reads",
+        help="the reads that were classified, to split into bins, in the same order "
+        "as in the table. Without these, only the names of the reads in each bin "
+        "are written, one per line, to PREFIX.ids.",
+    )
+    parser.add_argument(
+        "--min-hits",
+        type=int,
+        default=0,
+        help="the fewest k-mers of its haplotype that a read must have to be put in "
+        "its bin",
+    )
+    parser.add_argument(
+        "--ratio",
+        type=float,
+        default=1.0,
+        help="how many times higher the score of one haplotype must be than that of "
+        "the other for a read to be put in its bin",
+    )
+    parser.add_argument(
+        "--unscaled",
+        action="store_true",
+        help="compare the counts of k-mers of each haplotype as they are, rather "
+        "than scaling up those of the haplotype with fewer k-mers in the index",
+        default=False,
+    )
+    parser.add_argument(
+        "--allow-partial",
+        action="store_true",
+        help="bin reads whose k-mers were only partly counted, because "
+        "classify-by-kmers stopped early with --early-stop, from the counts of the "
+        "part counted, rather than refusing to",
+        default=False,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads to inflate gzipped reads and compress the output "
+        "with",
+    )
+    parser.add_argument(
+        "--haplotype-a-out-prefix",
+        default="hapA",
+        help="prefix for haplotype A output file",
+    )
+    parser.add_argument(
+        "--haplotype-b-out-prefix",
+        default="hapB",
+        help="prefix for haplotype B output file",
+    )
+    parser.add_argument(
+        "--unclassified-out-prefix",
+        default="unclassified",
+        help="prefix for unclassified output file",
+    )
+    parser.add_argument(
+        "--no-gzip-output",
+        action="store_true",
+        help="don't gzip the output",
+        default=False,
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        choices=range(1, 10),
+        metavar="{1..9}",
+        default=9,
+        help="gzip compression level of the output, from 1, the fastest, to 9, "
+        "the smallest",
+    )
+    parser.add_argument(
+        "--bgzf-index",
+        action="store_true",
+        help="also write a bgzip index of each gzipped output, e.g., "
+        "hapA.fastq.gz.gzi, for reading it from the middle",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    if args.bgzf_index and (args.no_gzip_output or not args.reads):
+        parser.error("--bgzf-index needs gzipped reads, given with --reads")
+
+    return args
+
+
+def bin_reads(
+    counts_a: array,
+    counts_b: array,
+    scaling_factors: Tuple[float, float],
+    min_hits: int = 0,
+    ratio: float = 1.0,
+) -> bytes:
+    """Decide the bin of each read from its k-mer counts
+
+    A read is put in the bin of the haplotype with the higher score,
+    its count of k-mers times the scaling factor, if that score is at
+    least `ratio` times the other and its count is at least `min_hits`,
+    and is left unclassified otherwise. With the defaults, this is the
+    rule that classify-by-kmers uses.
+
+    Args:
+        counts_a: the number of k-mers in each read unique to haplotype A
+        counts_b: the number of k-mers in each read unique to haplotype B
+        scaling_factors: the factors to multiply the counts of haplotype
+            A and B by, e.g., from `classify_by_kmers.scaling_factors_for`
+        min_hits: the fewest k-mers of its haplotype that a read must
+            have to be put in its bin
+        ratio: how many times higher one score must be than the other
+
+    Returns:
+        the bin of each read, b"A", b"B" or b"U"
+    """
+    scaling_factor_a, scaling_factor_b = scaling_factors
+    bins = bytearray(b"U") * len(counts_a)
+    for i, (count_a, count_b) in enumerate(zip(counts_a, counts_b)):
+        score_a = count_a * scaling_factor_a
+        score_b = count_b * scaling_factor_b
+        if score_a > score_b and score_a >= ratio * score_b and count_a >= min_hits:
+            bins[i] = ord("A")
+        elif score_b > score_a and score_b >= ratio * score_a and count_b >= min_hits:
+            bins[i] = ord("B")
+    return bytes(bins)
+
+
+def match_reads(
+    reads: Iterable[seq.RawRead], names: Iterable[bytes]
+) -> Iterator[seq.RawRead]:
+    """Check that the reads are the ones in a table, in the same order
+
+    Yields:
+        the reads
+
+    Raises:
+        ValueError: if a read is not the one in its row of the table,
+            or there are more or fewer reads than rows
+    """
+    names = iter(names)
+    for read in reads:
+        if read.name != next(names, None):
+            raise ValueError(
+                f"Read {read.name.decode()} is not in its row of the table; the "
+                "reads must be the same ones, in the same order, as were classified."
+            )
+        yield read
+    if next(names, None) is not None:
+        raise ValueError("There are fewer reads than rows in the table.")
+
+
+def main():
+    """Main method of program"""
+    args = parse_args()
+
+    table = score_table.read_score_table(args.score_table)
+    partly_counted = sum(
+        scanned < length for scanned, length in zip(table["scanned"], table["length"])
+    )
+    if partly_counted:
+        print(
+            f"{partly_counted} reads in {args.score_table} were only partly counted, "
+            "because classify-by-kmers stopped early with --early-stop, so their "
+            "counts are lower than those of the whole reads.",
+            file=sys.stderr,
+        )
+        if not args.allow_partial:
+            print(
+                "Classify them again without --early-stop, or give --allow-partial "
+                "to bin them from the counts of the parts counted.",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+    if args.unscaled:
+        scaling_factors = 1.0, 1.0
+    else:
+        scaling_factors = scaling_factors_for(
+            table["num_kmers_a"], table["num_kmers_b"]
+        )
+    bins = bin_reads(
+        table["count_a"], table["count_b"], scaling_factors, args.min_hits, args.ratio
+    )
+
+    if args.reads:
+        outfile_extension = path.splitext(args.reads.rstrip(".gz"))[1]
+        gzip_output = not args.no_gzip_output
+        records = map(
+            bytes,
+            match_reads(
+                seq.open_fastx_read_raw(args.reads, args.threads), table["name"]
+            ),
+        )
+    else:
+        outfile_extension = ".ids"
+        gzip_output = False
+        records = (name + b"\n" for name in table["name"])
+
+    haplotype_a_outfile, haplotype_b_outfile, unclassified_outfile = seq.open_outfiles(
+        args.haplotype_a_out_prefix,
+        args.haplotype_b_out_prefix,
+        args.unclassified_out_prefix,
+        outfile_extension,
+        gzip_output,
+        args.compression_level,
+        args.threads,
+        args.bgzf_index,
+    )
+    outfile_for_bin = {
+        ord("A"): haplotype_a_outfile,
+        ord("B"): haplotype_b_outfile,
+        ord("U"): unclassified_outfile,
+    }
+    with haplotype_a_outfile, haplotype_b_outfile, unclassified_outfile:
+        for record, read_bin in zip(records, bins):
+            outfile_for_bin[read_bin].write(record)
+
+    print(
+        f"{bins.count(b'A')} reads in haplotype A, {bins.count(b'B')} in haplotype "
+        f"B and {bins.count(b'U')} unclassified",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Compact tables of the k-mer counts of each read.
+
+A table of scores printed as text takes gigabytes for hundreds of
+millions of short reads, and as long again to parse. A
+`ScoreTableWriter` instead writes the name, length, counts of haplotype
+A and B k-mers, bin, and number of bases whose k-mers were counted of
+each read to the columns of an .npz file, as `numpy.savez_compressed`
+would, which `numpy.load` reads in no time.
+Along with the numbers of k-mers in the index that the scores are
+scaled by, the counts are enough to bin the reads again without
+counting their k-mers again. Neither writing nor reading a table needs
+numpy.
+
+Each column of the table is collected in a temporary file of its own as
+batches of reads are written to it, and the columns are put together
+into the .npz file when it is closed.
+"""
+
+import ast
+import shutil
+import struct
+import sys
+import tempfile
+import zipfile
+from array import array
+from typing import Dict, Iterable, List, Tuple, Union
+
+COLUMNS = ("name", "length", "count_a", "count_b", "bin", "scanned")
+"""Columns of a table of scores, in order"""
+
+BYTE_ORDER = "<" if sys.byteorder == "little" else ">"
+"""numpy's code for the byte order of the machine, which numbers are
+written in"""
+
+NUMBER_TYPES = {
+    "length": ("Q", "u8"),
+    "count_a": ("i", "i4"),
+    "count_b": ("i", "i4"),
+    "scanned": ("Q", "u8"),
+}
+"""The array typecode and numpy type of each column of numbers"""
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+"""Start of an .npy file, of version 1.0 of the format"""
+
+NAMES_CHUNK_SIZE = 1 << 22
+"""Number of bytes of read names to pad to the same width at a time"""
+
+ScoreTable = Dict[str, Union[List[bytes], array, bytes, int]]
+
+
+def npy_header(dtype: str, shape: Tuple[int, ...]) -> bytes:
+    """Make the header of an .npy file
+
+    Args:
+        dtype: the numpy type of the array, e.g., "<i4"
+        shape: the shape of the array, e.g., (length,) for a column or
+            () for a single number
+    """
+    header = f"{{'descr': '{dtype}', 'fortran_order': False, 'shape': {shape}, }}"
+    # padded with spaces, so that the data is aligned to 64 bytes
+    header += " " * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % 64) + "\n"
+    return NPY_MAGIC + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class ScoreTableWriter:
+    """Writes a table of the k-mer counts of each read to an .npz file
+
+    The file is written by `close`, or at the end of a `with` block.
+
+    Args:
+        filename: the path of the .npz file to write
+        num_kmers_a: the number of haplotype A k-mers in the index
+            that the reads' k-mers were counted with
+        num_kmers_b: the number of haplotype B k-mers in the index
+    """
+
+    def __init__(self, filename: str, num_kmers_a: int, num_kmers_b: int):
+        self.filename = filename
+        self.num_kmers = {"num_kmers_a": num_kmers_a, "num_kmers_b": num_kmers_b}
+        self.columns = {column: tempfile.TemporaryFile() for column in COLUMNS}
+        self.num_reads = 0
+        self.name_width = 1
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(
+        self,
+        names: List[bytes],
+        lengths: Iterable[int],
+        counts_a: array,
+        counts_b: array,
+        bins: bytes,
+        scanned: Iterable[int],
+    ):
+        """Write the rows of a batch of reads
+
+        Args:
+            names: the name of each read
+            lengths: the length of each read
+            counts_a: the number of k-mers in each read unique to
+                haplotype A, in an array of type "i"
+            counts_b: the number of k-mers in each read unique to
+                haplotype B, in an array of type "i"
+            bins: the bin of each read, b"A", b"B" or b"U"
+            scanned: the number of bases at the start of each read whose
+                k-mers were counted, which is less than its length if
+                counting stopped early
+        """
+        if not names:
+            return
+        self.columns["name"].write(b"\n".join(names) + b"\n")
+        self.name_width = max(self.name_width, max(map(len, names)))
+        self.columns["length"].write(array("Q", lengths).tobytes())
+        self.columns["count_a"].write(counts_a.tobytes())
+        self.columns["count_b"].write(counts_b.tobytes())
+        self.columns["bin"].write(bins)
+        self.columns["scanned"].write(array("Q", scanned).tobytes())
+        self.num_reads += len(names)
+
+    def close(self):
+        """Put the columns together into the .npz file"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            with zipfile.ZipFile(
+                self.filename, "w", zipfile.ZIP_DEFLATED, compresslevel=1
+            ) as npz:
+                for column, column_file in self.columns.items():
+                    column_file.seek(0)
+                    if column == "name":
+                        dtype = f"|S{self.name_width}"
+                    elif column == "bin":
+                        dtype = "|S1"
+                    else:
+                        dtype = BYTE_ORDER + NUMBER_TYPES[column][1]
+                    with npz.open(column + ".npy", "w", force_zip64=True) as npy:
+                        npy.write(npy_header(dtype, (self.num_reads,)))
+                        if column == "name":
+                            self._write_names(column_file, npy)
+                        else:
+                            shutil.copyfileobj(column_file, npy)
+                for name, num_kmers in self.num_kmers.items():
+                    with npz.open(name + ".npy", "w") as npy:
+                        npy.write(npy_header(BYTE_ORDER + "u8", ()))
+                        npy.write(array("Q", [num_kmers]).tobytes())
+        finally:
+            for column_file in self.columns.values():
+                column_file.close()
+
+    def _write_names(self, names_file, npy):
+        """Write the names of the reads, padded with NULs to the same width"""
+        rest = b""
+        while True:
+            chunk = names_file.read(NAMES_CHUNK_SIZE)
+            if not chunk:
+                return
+            names = (rest + chunk).split(b"\n")
+            rest = names.pop()
+            npy.write(b"".join(name.ljust(self.name_width, b"\0") for name in names))
+
+
+def read_score_table(filename: str) -> ScoreTable:
+    """Read a table of scores written by a `ScoreTableWriter`
+
+    Returns:
+        a dict of each column of the table: the names of the reads, as
+        a list of bytes; their lengths, counts of haplotype A and B
+        k-mers and numbers of bases whose k-mers were counted, as
+        arrays; and their bins, as bytes; and of the numbers
+        of haplotype A and B k-mers in the index, "num_kmers_a" and
+        "num_kmers_b"
+    """
+    table: ScoreTable = {}
+    with zipfile.ZipFile(filename) as npz:
+        for column in COLUMNS + ("num_kmers_a", "num_kmers_b"):
+            npy = npz.read(column + ".npy")
+            if not npy.startswith(NPY_MAGIC[:6]):
+                raise ValueError(f"{filename} is not a table of scores.")
+            (header_length,) = struct.unpack_from("<H", npy, len(NPY_MAGIC))
+            data_start = len(NPY_MAGIC) + 2 + header_length
+            header = ast.literal_eval(npy[len(NPY_MAGIC) + 2 : data_start].decode())
+            data = npy[data_start:]
+            if column.startswith("num_kmers"):
+                numbers = array("Q", data)
+                if header["descr"][0] != BYTE_ORDER:
+                    numbers.byteswap()
+                table[column] = numbers[0]
+            elif column == "name":
+                width = int(header["descr"][2:])
+                table[column] = [
+                    data[i : i + width].rstrip(b"\0")
+                    for i in range(0, len(data), width)
+                ]
+            elif column == "bin":
+                table[column] = data
+            else:
+                numbers = array(NUMBER_TYPES[column][0], data)
+                if header["descr"][0] != BYTE_ORDER:
+                    numbers.byteswap()
+                table[column] = numbers
+    return table
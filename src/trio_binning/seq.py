@@ -5,12 +5,36 @@ python but to my knowledge, they are all bloated and slow (e.g.,
 BioPython) or read-only (e.g., screed).
 
 This just has a single function for reading fastx files into a Read
-class, which then has a print function. That's all.
+class, which then has a print function. That's all. For when that is
+too slow, there is also a parser of large blocks of bytes into RawReads.
 """
 import gzip
 import sys
 from dataclasses import dataclass
-from typing import Iterator, Optional, TextIO, Tuple, Union, cast
+from itertools import chain, islice, repeat
+from operator import itemgetter
+from os import path
+from typing import (
+    IO,
+    AnyStr,
+    BinaryIO,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    cast,
+)
+
+from trio_binning import bgzf
+
+CHUNK_SIZE = 1 << 22
+"""Number of bytes of a fastx file to parse at a time"""
+
+WRITE_BUFFER_SIZE = 1 << 22
+"""Number of bytes or characters of records to collect before writing them"""
 
 
 @dataclass
@@ -41,6 +65,10 @@ class Read:
         """
         print(self, file=file)
 
+    def __bytes__(self):
+        """Format the read as `print` does, as bytes"""
+        return f"{self}\n".encode("utf-8")
+
 
 def readfq(fp: TextIO) -> Iterator[Read]:
     """Read a fastx file.
@@ -83,8 +111,288 @@ def readfq(fp: TextIO) -> Iterator[Read]:
                 break
 
 
-def open_fastx_read(filename: str) -> Iterator[Read]:
-    """Open a fasta/q(.gz) file for reading."""
+class RawRead:
+    """A fastx read, as bytes
+
+    Much cheaper to make than a Read, since nothing is decoded and the
+    fields are in slots rather than a dict.
+    """
+
+    __slots__ = ("name", "seq", "qual")
+
+    name: bytes
+    """The name of the read"""
+    seq: bytes
+    """The sequence of the read"""
+    qual: Optional[bytes]
+    """The quality score string of the read"""
+
+    def __init__(self, name: bytes, seq: bytes, qual: Optional[bytes] = None):
+        self.name = name
+        self.seq = seq
+        self.qual = qual
+
+    def __eq__(self, other):
+        if not isinstance(other, RawRead):
+            return NotImplemented
+        return (self.name, self.seq, self.qual) == (other.name, other.seq, other.qual)
+
+    def __repr__(self):
+        return f"RawRead({self.name!r}, {self.seq!r}, {self.qual!r})"
+
+    def __bytes__(self):
+        """Format the read in fastq format if it has a quality score
+        string, or fasta format otherwise, with a trailing newline"""
+        if self.qual:
+            return b"@%s\n%s\n+\n%s\n" % (self.name, self.seq, self.qual)
+        else:
+            return b">%s\n%s\n" % (self.name, self.seq)
+
+    def to_read(self) -> Read:
+        """Decode the read into a Read"""
+        return Read(
+            self.name.decode("utf-8"),
+            self.seq.decode("utf-8"),
+            self.qual.decode("utf-8") if self.qual is not None else None,
+        )
+
+
+def _parse_fasta_record(
+    data: bytes, start: int, final: bool
+) -> Optional[Tuple[RawRead, int]]:
+    """Parse the fasta record whose header line starts at `start`
+
+    Returns:
+        the record and the position just past it, or None if `data`
+        ends before the record does and `final` is False
+    """
+    header_end = data.find(b"\n", start)
+    if header_end < 0:
+        if not final:
+            return None
+        header_end = len(data)
+    name = data[start + 1 : header_end].partition(b" ")[0]
+
+    end = data.find(b"\n>", header_end)
+    if end < 0:
+        if not final:
+            return None
+        end = len(data)
+    return RawRead(name, data[header_end + 1 : end].replace(b"\n", b"")), end + 1
+
+
+def _parse_fastq_record(
+    data: bytes, start: int, final: bool
+) -> Optional[Tuple[RawRead, int]]:
+    """Parse the fastq record whose header line starts at `start`
+
+    Handles sequences and quality strings broken over several lines in
+    the same way as `readfq`.
+
+    Returns:
+        the record and the position just past it, or None if `data`
+        ends before the record does and `final` is False
+    """
+    length = len(data)
+    header_end = data.find(b"\n", start)
+    if header_end < 0:
+        if not final:
+            return None
+        header_end = length
+    name = data[start + 1 : header_end].partition(b" ")[0]
+
+    # the usual four-line record
+    seq_end = data.find(b"\n", header_end + 1)
+    if 0 <= seq_end < length - 1 and data[seq_end + 1] == ord("+"):
+        plus_end = data.find(b"\n", seq_end + 1)
+        qual_end = data.find(b"\n", plus_end + 1) if plus_end >= 0 else -1
+        if qual_end >= 0 and qual_end - plus_end - 1 == seq_end - header_end - 1:
+            return (
+                RawRead(
+                    name,
+                    data[header_end + 1 : seq_end],
+                    data[plus_end + 1 : qual_end],
+                ),
+                qual_end + 1,
+            )
+
+    lines: List[bytes] = []
+    line_start = header_end + 1
+    while line_start < length and data[line_start] not in b"@+>":
+        line_end = data.find(b"\n", line_start)
+        if line_end < 0:
+            if not final:
+                return None
+            line_end = length
+        lines.append(data[line_start:line_end])
+        line_start = line_end + 1
+    seq = b"".join(lines)
+    if line_start >= length and not final:
+        return None
+    if line_start >= length or data[line_start] != ord("+"):
+        return RawRead(name, seq), line_start
+
+    # read quality lines until there is as much quality as sequence
+    line_start = data.find(b"\n", line_start) + 1
+    lines, qual_length = [], 0
+    while line_start > 0 and line_start < length:
+        line_end = data.find(b"\n", line_start)
+        if line_end < 0:
+            if not final:
+                return None
+            line_end = length
+        lines.append(data[line_start:line_end])
+        qual_length += line_end - line_start
+        line_start = line_end + 1
+        if qual_length >= len(seq):
+            return RawRead(name, seq, b"".join(lines)), line_start
+    if not final:
+        return None
+    # the file ends before enough quality, so make it a fasta record
+    return RawRead(name, seq), length
+
+
+def _parse_four_line_fastq(data: bytes) -> Optional[Tuple[List[RawRead], int]]:
+    """Parse fastq records of four lines each, all at once
+
+    Splits `data` into lines and checks that they form whole fastq
+    records of one line of sequence and one of quality, which almost all
+    fastq files have. Checking and splitting them all at once is much
+    faster than finding each line.
+
+    Returns:
+        the records and the position in `data` just past the last one,
+        which leaves any incomplete record at the end to be parsed
+        otherwise, or None if `data` is anything but such records
+    """
+    lines = data.split(b"\n")
+    # the last line has no newline yet, so it might be incomplete
+    num_lines = (len(lines) - 1) // 4 * 4
+    headers = lines[0:num_lines:4]
+    seqs = lines[1:num_lines:4]
+    separators = lines[2:num_lines:4]
+    quals = lines[3:num_lines:4]
+    if not (
+        all(map(bytes.startswith, headers, repeat(b"@")))
+        and (
+            b"".join(separators) == b"+" * len(separators)
+            or all(map(bytes.startswith, separators, repeat(b"+")))
+        )
+        and list(map(len, seqs)) == list(map(len, quals))
+    ):
+        return None
+
+    if b" " in b"".join(headers):
+        names = [header[1:].partition(b" ")[0] for header in headers]
+    else:
+        names = list(map(itemgetter(slice(1, None)), headers))
+    # only the few lines after the last record need to be measured
+    position = (
+        len(data) - sum(map(len, lines[num_lines:])) - (len(lines) - 1 - num_lines)
+    )
+    return list(map(RawRead, names, seqs, quals)), position
+
+
+def _parse_records(data: bytes, final: bool) -> Tuple[List[RawRead], int]:
+    """Parse as many whole fastx records as there are in `data`
+
+    Args:
+        data: fastx records, the first of which starts at the beginning
+        final: True if `data` runs to the end of the file, so that the
+            last record ends with it
+
+    Returns:
+        the records, and the position in `data` just past the last one
+    """
+    records: List[RawRead] = []
+    position = 0
+    parsed_fastq = _parse_four_line_fastq(data)
+    if parsed_fastq is not None:
+        records, position = parsed_fastq
+
+    length = len(data)
+    while position < length:
+        if data[position] == ord(">"):
+            parsed = _parse_fasta_record(data, position, final)
+        elif data[position] == ord("@"):
+            parsed = _parse_fastq_record(data, position, final)
+        else:
+            # not a header line, so skip it, as readfq does
+            line_end = data.find(b"\n", position)
+            if line_end < 0:
+                if final:
+                    position = length
+                break
+            position = line_end + 1
+            continue
+        if parsed is None:
+            break
+        record, position = parsed
+        records.append(record)
+    return records, position
+
+
+def readfq_batches(
+    fp: BinaryIO, chunk_size: int = CHUNK_SIZE
+) -> Iterator[List[RawRead]]:
+    """Read a fastx file in batches of reads.
+
+    Reads the file `chunk_size` bytes at a time and splits each chunk
+    into records with `bytes.find`, which is many times faster than
+    `readfq`. A record that does not fit in a chunk is carried over to
+    the next one, which is made bigger if needed to fit it.
+
+    Records are parsed as by `readfq`, except that a fasta record ends
+    only where a line starting with ">" does, so a file must not mix
+    fasta and fastq records, and that the last line of a file does not
+    need a newline.
+
+    Args:
+        fp: the file, opened for reading bytes
+        chunk_size: the number of bytes to read at a time
+
+    Yields:
+        a list of the reads in each chunk, which is empty only if a
+        single read is bigger than the chunk
+    """
+    data = b""
+    read_size = chunk_size
+    while True:
+        chunk = fp.read(read_size)
+        final = not chunk
+        data = data + chunk if data else chunk
+        records, position = _parse_records(data, final)
+        if final:
+            if records:
+                yield records
+            return
+        data = data[position:]
+        if records:
+            read_size = chunk_size
+            yield records
+        else:
+            # a read longer than the chunk, so read more of it at a time
+            # rather than parsing it again for every chunk
+            read_size *= 2
+
+
+def readfq_raw(fp: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Iterator[RawRead]:
+    """Read a fastx file into RawReads, using `readfq_batches`"""
+    return chain.from_iterable(readfq_batches(fp, chunk_size))
+
+
+def open_fastx_read(
+    filename: str, shard: Optional[Tuple[int, int]] = None
+) -> Iterator[Read]:
+    """Open a fasta/q(.gz) file for reading.
+
+    Args:
+        filename: the path to the file
+        shard: to read only part of the file, as for
+            `open_fastx_read_raw`
+    """
+    if shard is not None:
+        return (read.to_read() for read in open_fastx_read_raw(filename, shard=shard))
     if filename.endswith(".gz"):
         reads = readfq(cast(TextIO, gzip.open(filename, "rt")))
     else:
@@ -92,7 +400,230 @@ def open_fastx_read(filename: str) -> Iterator[Read]:
     return reads
 
 
-TextOrGzip = Union[TextIO, gzip.GzipFile]
+def open_fastx_read_raw(
+    filename: str, threads: int = 1, shard: Optional[Tuple[int, int]] = None
+) -> Iterator[RawRead]:
+    """Open a fasta/q(.gz) file for reading into RawReads.
+
+    Args:
+        filename: the path to the file
+        threads: the number of threads to inflate a gzipped file with,
+            as for `bgzf.open_gzip`
+        shard: to read only the ith of N parts of the file, i and N,
+            where i is from 1 to N. An uncompressed or BGZF file is
+            split into N ranges of bytes, each holding the reads whose
+            records start in it, which must have four lines each if
+            it is a fastq file. A plain gzip file can only be read from
+            the start, so its ith part is every Nth read from the ith.
+    """
+    if shard is not None:
+        return _open_fastx_shard(filename, shard, threads)
+    if filename.endswith(".gz"):
+        return readfq_raw(bgzf.open_gzip(filename, threads))
+    return readfq_raw(open(filename, "rb"))
+
+
+def _find_record_start(data: bytes, start: int, fastq: bool) -> int:
+    """Find the first record of a fastx file on a line after `start`.
+
+    A line of qualities in a fastq file can also start with "@", so a
+    line that does is only the start of a record if the line two after
+    it starts with "+".
+
+    Returns:
+        the offset of the record in `data`, or -1 if there is none or
+        telling needs more data
+    """
+    marker = b"\n@" if fastq else b"\n>"
+    newline = data.find(marker, start)
+    while newline >= 0:
+        if not fastq:
+            return newline + 1
+        header_end = data.find(b"\n", newline + 1)
+        sequence_end = data.find(b"\n", header_end + 1) if header_end >= 0 else -1
+        if sequence_end < 0 or sequence_end + 1 >= len(data):
+            return -1
+        if data.startswith(b"+", sequence_end + 1):
+            return newline + 1
+        newline = data.find(marker, newline + 1)
+    return -1
+
+
+def _read_shard(
+    chunks: Iterator[bytes], rest: Iterator[bytes], first: bool, fastq: bool
+) -> Iterator[bytes]:
+    """Read the records that start in a range of bytes of a fastx file.
+
+    Unless the range is the start of the file, the records are those
+    from the first one on a line after its start up to the first one
+    on a line after its end, where the next range starts from.
+
+    Args:
+        chunks: the bytes of the range, in chunks
+        rest: the bytes of the file after the range, in chunks
+        first: True if the range is the start of the file
+        fastq: True if the file is a fastq file, False if fasta
+
+    Yields:
+        the bytes of the records, in chunks
+    """
+    # the bytes of the range before the first record in it, while it
+    # has not been found
+    data = b""
+    position = 0 if first else -1
+    for chunk in chunks:
+        if position >= 0:
+            yield chunk
+            continue
+        data += chunk
+        position = _find_record_start(data, 0, fastq)
+        if position >= 0:
+            yield data[position:]
+            data = b""
+
+    # the record that starts in the range and ends after it
+    end_of_range = len(data)
+    end = -1
+    for chunk in rest:
+        data += chunk
+        end = _find_record_start(data, end_of_range, fastq)
+        if end >= 0:
+            break
+    if end < 0:
+        end = len(data)
+    if position < 0:
+        position = _find_record_start(data, 0, fastq)
+        yield data[position:end] if position >= 0 else b""
+    else:
+        yield data[:end]
+
+
+def _read_file_range(filename: str, start: int, end: int) -> Iterator[bytes]:
+    """Read a range of bytes of a file, in chunks"""
+    with open(filename, "rb") as fp:
+        fp.seek(start)
+        yield from bgzf.read_range(cast(BinaryIO, fp), end - start)
+
+
+def _open_fastx_shard(
+    filename: str, shard: Tuple[int, int], threads: int
+) -> Iterator[RawRead]:
+    """Open part of a fasta/q(.gz) file, as for `open_fastx_read_raw`"""
+    number, count = shard
+    if not 1 <= number <= count:
+        raise ValueError(f"Shard must be from 1/{count} to {count}/{count}.")
+    size = path.getsize(filename)
+    start, end = size * (number - 1) // count, size * number // count
+
+    chunks: Iterator[bytes]
+    rest: Iterator[bytes]
+    if filename.endswith(".gz"):
+        with open(filename, "rb") as fp:
+            if not bgzf.is_bgzf(fp):
+                reads = open_fastx_read_raw(filename, threads)
+                return islice(reads, number - 1, None, count)
+            start = bgzf.find_bgzf_block(cast(BinaryIO, fp), start)
+            end = bgzf.find_bgzf_block(cast(BinaryIO, fp), end)
+        first_byte = next(bgzf.inflate_bgzf_range(filename, 0, size), b"")[:1]
+        chunks = bgzf.inflate_bgzf_range(filename, start, end, threads)
+        rest = bgzf.inflate_bgzf_range(filename, end, size)
+    else:
+        first_byte = next(_read_file_range(filename, 0, 1), b"")
+        chunks = _read_file_range(filename, start, end)
+        rest = _read_file_range(filename, end, size)
+
+    records = _read_shard(chunks, rest, number == 1, first_byte == b"@")
+    return readfq_raw(cast(BinaryIO, bgzf.ChunkReader(records)))
+
+
+class RecordWriter(Generic[AnyStr]):
+    """Writes records to a file in bulk.
+
+    Collects the records written to it, e.g., reads or lines of a
+    table, and writes them to the file all at once whenever there are
+    `buffer_size` bytes or characters of them, which is much cheaper
+    than writing each one to the file. The file is closed along with
+    the writer, or at the end of a `with` block.
+
+    Args:
+        file: the file to write to, opened for writing either bytes or
+            text, matching the records
+        buffer_size: the number of bytes or characters of records to
+            collect before writing them
+    """
+
+    def __init__(self, file: IO[AnyStr], buffer_size: int = WRITE_BUFFER_SIZE):
+        self.file: IO[AnyStr] = file
+        self.buffer_size = buffer_size
+        self.records: List[AnyStr] = []
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, record: AnyStr):
+        """Write a record, e.g., the bytes of a read ending in a newline"""
+        self.records.append(record)
+        self.size += len(record)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def writelines(self, records: Iterable[AnyStr]):
+        """Write several records"""
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        """Write the records collected so far to the file"""
+        if self.records:
+            # joined with an empty record, of bytes or of text
+            self.file.write(self.records[0][:0].join(self.records))
+            self.records = []
+            self.size = 0
+        self.file.flush()
+
+    def close(self):
+        """Write the records collected so far and close the file"""
+        self.flush()
+        self.file.close()
+
+
+def open_outfile(
+    filename: str,
+    gzip_output: bool,
+    compression_level: int = 9,
+    threads: int = 1,
+    bgzf_index: bool = False,
+) -> RecordWriter[bytes]:
+    """Open an output file for writing bytes, e.g., of RawReads.
+
+    Args:
+        filename: path of the file, to which ".gz" is added if it is
+            gzipped
+        gzip_output: True to gzip the file, in BGZF format, which any
+            gzip reader can read, or False not to
+        compression_level: the gzip compression level, from 1, the
+            fastest, to 9, the smallest
+        threads: the number of threads to compress the file with
+        bgzf_index: True to also write a bgzip index of a gzipped file,
+            with ".gzi" added to its path
+
+    Returns:
+        a RecordWriter that writes to the file
+    """
+    if not gzip_output:
+        return RecordWriter(open(filename, "wb"))
+    return RecordWriter(
+        cast(
+            BinaryIO,
+            bgzf.BgzfWriter(
+                filename + ".gz", compression_level, threads, index=bgzf_index
+            ),
+        )
+    )
 
 
 def open_outfiles(
@@ -101,15 +632,25 @@ def open_outfiles(
     unclassified_prefix: str,
     outfile_extension: str,
     gzip_output: bool,
-) -> Tuple[TextOrGzip, TextOrGzip, TextOrGzip]:
+    compression_level: int = 9,
+    threads: int = 1,
+    bgzf_index: bool = False,
+) -> Tuple[RecordWriter[bytes], RecordWriter[bytes], RecordWriter[bytes]]:
     """Open output files based on given options.
 
+    Each file is opened with `open_outfile`.
+
     Args:
         haplotype_a_prefix: path prefix for haplotype A output file
         haplotype_b_prefix: path prefix for haplotype B output file
         unclassified_prefix: path prefix for unclassified output file
         outfile_extension: extension for output file (e.g., ".fa")
         gzip_output: True to gzip output files, False otherwise
+        compression_level: the gzip compression level, from 1, the
+            fastest, to 9, the smallest
+        threads: the number of threads to compress each file with
+        bgzf_index: True to also write a bgzip index of each gzipped
+            file
 
     Returns:
         haplotype_a_outfile: writeable outfile for haplotype A
@@ -120,17 +661,18 @@ def open_outfiles(
     haplotype_b_outfile_name = haplotype_b_prefix + outfile_extension
     unclassified_outfile_name = unclassified_prefix + outfile_extension
 
-    haplotype_a_outfile: TextOrGzip
-    haplotype_b_outfile: TextOrGzip
-    unclassified_outfile: TextOrGzip
-
-    if not gzip_output:
-        haplotype_a_outfile = open(haplotype_a_outfile_name, "w")
-        haplotype_b_outfile = open(haplotype_a_outfile_name, "w")
-        unclassified_outfile = open(unclassified_outfile_name, "w")
-    else:
-        haplotype_a_outfile = gzip.open(haplotype_a_outfile_name + ".gz", "wt")
-        haplotype_b_outfile = gzip.open(haplotype_b_outfile_name + ".gz", "wt")
-        unclassified_outfile = gzip.open(unclassified_outfile_name + ".gz", "wt")
+    haplotype_a_outfile = open_outfile(
+        haplotype_a_outfile_name, gzip_output, compression_level, threads, bgzf_index
+    )
+    haplotype_b_outfile = open_outfile(
+        haplotype_b_outfile_name, gzip_output, compression_level, threads, bgzf_index
+    )
+    unclassified_outfile = open_outfile(
+        unclassified_outfile_name,
+        gzip_output,
+        compression_level,
+        threads,
+        bgzf_index,
+    )
 
     return haplotype_a_outfile, haplotype_b_outfile, unclassified_outfile
@@ -0,0 +1,141 @@
+"""Serve a k-mer index to classify-by-kmers.
+
+This is a script for loading a k-mer index once and keeping it loaded,
+so that classify-by-kmers can be run on many small files of reads with
+its --server option without loading the index every time. Requests are
+answered over a Unix domain socket until the server is interrupted or
+terminated.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import stat
+import sys
+
+from trio_binning import kmers
+from trio_binning.server import KmerIndexServer
+
+
+def parse_args():
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "haplotype_a_kmers",
+        nargs="?",
+        help="a list of k-mers unique to haplotype A, one per line",
+    )
+    parser.add_argument(
+        "haplotype_b_kmers",
+        nargs="?",
+        help="a list of k-mers unique to haplotype B, one per line",
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        default="trio_binning.sock",
+        help="path of the Unix domain socket to listen on",
+    )
+    parser.add_argument(
+        "--index",
+        help="a binary k-mer index made by build-kmer-index, to use instead of "
+        "the lists of k-mers, or 'shm:NAME' for one it put in shared memory",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=sorted(kmers.INDEX_TYPES),
+        default="hash",
+        help="data structure to store the k-mers in: 'hash' has the fastest "
+        "lookups, 'sorted' needs only about 8 bytes per k-mer, and 'compressed' "
+        "needs only a few bytes per k-mer but has the slowest lookups (ignored "
+        "with --index)",
+    )
+    parser.add_argument(
+        "--bloom-filter",
+        action="store_true",
+        help="also build a Bloom filter of the k-mers, which uses about 1.5 more "
+        "bytes per k-mer but speeds up classification by ruling out most "
+        "k-mers without looking them up (ignored with --index)",
+        default=False,
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="number of threads to build the index with",
+    )
+    parser.add_argument(
+        "--verify-index",
+        action="store_true",
+        help="verify the checksum of the index given with --index before using it",
+        default=False,
+    )
+    args = parser.parse_args()
+
+    if args.index and (args.haplotype_a_kmers or args.haplotype_b_kmers):
+        parser.error("give either --index or lists of k-mers, not both")
+    if not args.index and not (args.haplotype_a_kmers and args.haplotype_b_kmers):
+        parser.error("give either --index or lists of k-mers for both haplotypes")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+
+    return args
+
+
+def remove_stale_socket(socket_path: str):
+    """Remove a socket left behind by a server that is no longer running
+
+    Raises:
+        IOError: if a server is still listening on the socket, or the
+            path is something other than a socket
+    """
+    if not os.path.exists(socket_path):
+        return
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise IOError(f"{socket_path} exists and is not a socket.")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise IOError(f"A server is already listening on {socket_path}.")
+
+
+def main():
+    """Main method of program"""
+    args = parse_args()
+
+    if args.index:
+        kmer_index = kmers.load_kmer_index(args.index, args.verify_index)
+    else:
+        kmer_index = kmers.create_kmer_index(
+            args.haplotype_a_kmers,
+            args.haplotype_b_kmers,
+            args.index_type,
+            args.bloom_filter,
+            args.threads,
+        )
+
+    remove_stale_socket(args.socket)
+
+    # stop the same way on SIGTERM as on ctrl-c, so that the socket is
+    # removed either way
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    with KmerIndexServer(args.socket, kmer_index) as server:
+        print(f"Listening on {args.socket}.", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
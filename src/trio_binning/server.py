@@ -0,0 +1,330 @@
+"""Classifying reads with a k-mer index loaded by another process.
+
+Loading a big k-mer index can take longer than classifying a small
+file of reads with it. A `KmerIndexServer` loads the index once and then
+answers requests from any number of `KmerIndexClient`s over a Unix
+domain socket, so that each chunk of reads only costs a connection.
+
+Each message on the socket is a line of JSON, which has a "length" key
+giving the number of bytes of payload that follow it, if any. A client
+sends one of these requests, and the server answers with:
+
+    {"command": "info"}
+        {"num_kmers_a": ..., "num_kmers_b": ...}
+    {"command": "count", "reads": N, "length": ...}, followed by the
+    N + 1 offsets of the reads as unsigned 64-bit integers and then
+    their sequences, as for `kmers.count_kmers_in_read_buffer`
+        {"length": ...}, followed by the N counts of haplotype A k-mers
+        and then the N counts of haplotype B k-mers, as 32-bit integers
+    {"command": "classify", "reads": ..., "haplotype_a_prefix": ...,
+    "haplotype_b_prefix": ..., "unclassified_prefix": ...,
+    "gzip_output": ..., "threads": ..., "compression_level": ...,
+    "ids_only": ..., "shard": [i, N] or null, "score_table": ...,
+    "early_stop": ..., "bgzf_index": ...}
+        any number of {"length": ...}, each followed by part of the
+        table of scores, and then {"done": true}
+
+Numbers in payloads are in the byte order of the machine, which both
+ends of a Unix domain socket share. If a request fails, the server
+answers it with {"error": "..."} instead.
+"""
+
+import codecs
+import io
+import json
+import socket
+import socketserver
+import sys
+from array import array
+from os import path
+from typing import Iterable, Optional, TextIO, Tuple, Union
+
+from trio_binning import classify_by_kmers, kmers
+
+SCORES_BUFFER_SIZE = 1 << 20
+"""Number of bytes of the table of scores to send in each message"""
+
+
+class ServerError(Exception):
+    """A request failed on the server"""
+
+
+def send_message(file: io.BufferedIOBase, header: dict, payload: bytes = b""):
+    """Send a message over a socket
+
+    Args:
+        file: the socket, as a file opened for writing bytes
+        header: the JSON header of the message, to which the length of
+            the payload is added if there is one
+        payload: the bytes to send after the header
+    """
+    if payload:
+        header = dict(header, length=len(payload))
+    file.write(json.dumps(header).encode("utf-8") + b"\n")
+    file.write(payload)
+    file.flush()
+
+
+def receive_message(file: io.BufferedIOBase) -> Tuple[dict, bytes]:
+    """Receive a message sent by `send_message`
+
+    Args:
+        file: the socket, as a file opened for reading bytes
+
+    Returns:
+        header: the JSON header of the message
+        payload: the bytes sent after the header, if any
+
+    Raises:
+        EOFError: if the other end closed the socket before sending a
+            whole message
+    """
+    line = file.readline()
+    if not line.endswith(b"\n"):
+        raise EOFError("Connection closed.")
+    header = json.loads(line)
+    payload = file.read(header.get("length", 0))
+    if len(payload) < header.get("length", 0):
+        raise EOFError("Connection closed.")
+    return header, payload
+
+
+class _MessageWriter(io.RawIOBase):
+    """A file that sends whatever is written to it as messages"""
+
+    def __init__(self, file: io.BufferedIOBase):
+        self.file = file
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        send_message(self.file, {}, bytes(data))
+        return len(data)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answers the requests sent over a single connection, in order"""
+
+    server: "KmerIndexServer"
+
+    def handle(self):
+        while True:
+            try:
+                request, payload = receive_message(self.rfile)
+            except EOFError:
+                return
+
+            try:
+                command = request.get("command")
+                if command == "info":
+                    self.info()
+                elif command == "count":
+                    self.count(request, payload)
+                elif command == "classify":
+                    self.classify(request)
+                else:
+                    raise ValueError(f"Unknown command {command}.")
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as error:
+                send_message(self.wfile, {"error": str(error)})
+
+    def info(self):
+        num_kmers_a, num_kmers_b = kmers.get_number_kmers_in_index(
+            self.server.kmer_index
+        )
+        send_message(
+            self.wfile, {"num_kmers_a": num_kmers_a, "num_kmers_b": num_kmers_b}
+        )
+
+    def count(self, request: dict, payload: bytes):
+        # the payload is read without copying it
+        offsets_length = (request["reads"] + 1) * array("Q").itemsize
+        buffer = memoryview(payload)
+        counts_a, counts_b = kmers.count_kmers_in_read_buffer(
+            buffer[offsets_length:],
+            buffer[:offsets_length].cast("Q"),
+            self.server.kmer_index,
+        )
+        send_message(self.wfile, {}, counts_a.tobytes() + counts_b.tobytes())
+
+    def classify(self, request: dict):
+        scores_file = io.TextIOWrapper(
+            io.BufferedWriter(_MessageWriter(self.wfile), SCORES_BUFFER_SIZE),
+            encoding="utf-8",
+        )
+        try:
+            classify_by_kmers.classify_reads(
+                self.server.kmer_index,
+                request["reads"],
+                request["haplotype_a_prefix"],
+                request["haplotype_b_prefix"],
+                request["unclassified_prefix"],
+                request["gzip_output"],
+                request.get("threads", 1),
+                scores_file,
+                request.get("compression_level", 9),
+                request.get("ids_only", False),
+                tuple(request["shard"]) if request.get("shard") else None,
+                request.get("score_table"),
+                request.get("early_stop"),
+                request.get("bgzf_index", False),
+            )
+        finally:
+            scores_file.flush()
+        send_message(self.wfile, {"done": True})
+
+
+class KmerIndexServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answers requests to classify reads with a k-mer index
+
+    Each connection is handled in a thread of its own. Because k-mers
+    are counted without holding the GIL, several clients can use the
+    index at once.
+
+    Args:
+        socket_path: the path of the Unix domain socket to listen on
+        kmer_index: the index to classify reads with
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, kmer_index: kmers.KmerIndex):
+        self.kmer_index = kmer_index
+        super().__init__(socket_path, _RequestHandler)
+
+
+class KmerIndexClient:
+    """Classifies reads with the k-mer index of a `KmerIndexServer`
+
+    Requests are sent over a single connection, which is closed by
+    `close` or at the end of a `with` block.
+
+    Args:
+        socket_path: the path of the Unix domain socket the server is
+            listening on
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(socket_path)
+        self.rfile = self.socket.makefile("rb")
+        self.wfile = self.socket.makefile("wb")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the connection to the server"""
+        self.rfile.close()
+        self.wfile.close()
+        self.socket.close()
+
+    def _receive(self) -> Tuple[dict, bytes]:
+        header, payload = receive_message(self.rfile)
+        if "error" in header:
+            raise ServerError(header["error"])
+        return header, payload
+
+    def get_number_kmers_in_index(self) -> Tuple[int, int]:
+        """Look up the number of k-mers unique to each haplotype in the
+        index"""
+        send_message(self.wfile, {"command": "info"})
+        header, _ = self._receive()
+        return header["num_kmers_a"], header["num_kmers_b"]
+
+    def count_kmers_in_read_buffer(
+        self, reads: bytes, offsets: array
+    ) -> Tuple[array, array]:
+        """Count k-mers unique to each haplotype in each of a batch of
+        reads
+
+        Args:
+            reads: the sequences of the reads, one after another
+            offsets: the offsets into `reads` at which each read starts,
+                followed by the offset at which the last one ends, as an
+                array of type "Q"
+
+        Returns:
+            A tuple of two arrays of type "i", as returned by
+            `kmers.count_kmers_in_read_buffer`
+        """
+        num_reads = max(len(offsets) - 1, 0)
+        send_message(
+            self.wfile,
+            {"command": "count", "reads": num_reads},
+            offsets.tobytes() + bytes(reads),
+        )
+        _, payload = self._receive()
+        counts = array("i", payload)
+        return counts[:num_reads], counts[num_reads:]
+
+    def count_kmers_in_reads(
+        self, reads: Iterable[Union[str, bytes]]
+    ) -> Tuple[array, array]:
+        """Count k-mers unique to each haplotype in each of a batch of
+        reads
+
+        Args:
+            reads: strings or bytes containing DNA sequence reads
+
+        Returns:
+            A tuple of two arrays of type "i", as returned by
+            `kmers.count_kmers_in_reads`
+        """
+        return self.count_kmers_in_read_buffer(*kmers.pack_reads(reads))
+
+    def classify(
+        self,
+        reads_path: str,
+        haplotype_a_prefix: str,
+        haplotype_b_prefix: str,
+        unclassified_prefix: str,
+        gzip_output: bool,
+        threads: int = 1,
+        scores_file: Optional[TextIO] = None,
+        compression_level: int = 9,
+        ids_only: bool = False,
+        shard: Optional[Tuple[int, int]] = None,
+        score_table: Optional[str] = None,
+        early_stop: Optional[float] = None,
+        bgzf_index: bool = False,
+    ):
+        """Classify the reads in a file into bins on the server
+
+        Takes the same arguments as `classify_by_kmers.classify_reads`,
+        except for the index. Paths are relative to the working
+        directory of the client, but the server reads and writes the
+        files, so it must be able to reach them.
+        """
+        send_message(
+            self.wfile,
+            {
+                "command": "classify",
+                "reads": path.abspath(reads_path),
+                "haplotype_a_prefix": path.abspath(haplotype_a_prefix),
+                "haplotype_b_prefix": path.abspath(haplotype_b_prefix),
+                "unclassified_prefix": path.abspath(unclassified_prefix),
+                "gzip_output": gzip_output,
+                "threads": threads,
+                "compression_level": compression_level,
+                "ids_only": ids_only,
+                "shard": shard,
+                "score_table": score_table and path.abspath(score_table),
+                "early_stop": early_stop,
+                "bgzf_index": bgzf_index,
+            },
+        )
+        if scores_file is None:
+            scores_file = sys.stdout
+        # a character can be split between two messages
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        while True:
+            header, payload = self._receive()
+            if header.get("done"):
+                return
+            scores_file.write(decoder.decode(payload))
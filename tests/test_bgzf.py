@@ -0,0 +1,165 @@
+import gzip
+import os
+import struct
+import zlib
+from itertools import accumulate
+from unittest.mock import patch
+
+import pytest
+
+from trio_binning import bgzf, seq
+
+
+def write_bgzf(path, data, block_size=1000):
+    """Write data to a BGZF file in blocks of block_size bytes"""
+    with patch("trio_binning.bgzf.BGZF_BLOCK_SIZE", block_size):
+        with bgzf.BgzfWriter(path) as bgzf_file:
+            bgzf_file.write(data)
+
+
+def test_open_gzip(tmpdir):
+    data = os.urandom(3000).hex().encode() * 100
+    gzip_path = os.path.join(tmpdir, "test.gz")
+    # two members, as when two gzip files are concatenated
+    with open(gzip_path, "wb") as gzip_file:
+        gzip_file.write(gzip.compress(data[:1000]) + gzip.compress(data[1000:]))
+
+    with open(gzip_path, "rb") as gzip_file:
+        assert not bgzf.is_bgzf(gzip_file)
+    with patch("trio_binning.bgzf.COMPRESSED_CHUNK_SIZE", 100):
+        for threads in (1, 3):
+            assert bgzf.open_gzip(gzip_path, threads).read() == data
+
+
+def test_open_gzip_truncated(tmpdir):
+    gzip_path = os.path.join(tmpdir, "test.gz")
+    with open(gzip_path, "wb") as gzip_file:
+        gzip_file.write(gzip.compress(b"GATTACA" * 1000)[:-10])
+
+    with pytest.raises(EOFError):
+        bgzf.open_gzip(gzip_path).read()
+
+
+def test_open_bgzf(tmpdir):
+    data = os.urandom(3000).hex().encode() * 100
+    bgzf_path = os.path.join(tmpdir, "test.bgz")
+    write_bgzf(bgzf_path, data)
+
+    with open(bgzf_path, "rb") as bgzf_file:
+        assert bgzf.is_bgzf(bgzf_file)
+    assert gzip.open(bgzf_path).read() == data
+    # small chunks and batches, to split blocks between chunks and spread
+    # the batches across threads
+    with patch("trio_binning.bgzf.COMPRESSED_CHUNK_SIZE", 100), patch(
+        "trio_binning.bgzf.BLOCKS_PER_BATCH", 2
+    ):
+        for threads in (1, 3):
+            reader = bgzf.open_gzip(bgzf_path, threads)
+            assert reader.read(10) == data[:10]
+            assert reader.read() == data[10:]
+            assert reader.read(10) == b""
+
+
+def test_open_fastx_read_raw_gzip(tmpdir):
+    fastq_path = os.path.join(os.path.dirname(__file__), "data", "test.ccs.fastq.gz")
+    bgzf_path = os.path.join(tmpdir, "test.ccs.fastq.gz")
+    write_bgzf(bgzf_path, gzip.open(fastq_path).read())
+
+    reads = [read.to_read() for read in seq.open_fastx_read_raw(fastq_path)]
+    assert len(reads) == 3
+    assert reads == list(seq.open_fastx_read(fastq_path))
+    for threads in (1, 2):
+        assert list(seq.open_fastx_read_raw(bgzf_path, threads)) == list(
+            seq.open_fastx_read_raw(fastq_path, threads)
+        )
+
+
+def test_find_bgzf_block(tmpdir):
+    bgzf_path = os.path.join(tmpdir, "test.gz")
+    write_bgzf(bgzf_path, os.urandom(3000).hex().encode() * 10)
+    with open(bgzf_path, "rb") as bgzf_file:
+        block_offsets = list(
+            accumulate(map(len, bgzf.split_bgzf_blocks(bgzf_file)), initial=0)
+        )
+        size = block_offsets.pop()
+
+        for offset in range(0, size + 1, 97):
+            block_offset = bgzf.find_bgzf_block(bgzf_file, offset)
+            assert block_offset == min(o for o in block_offsets + [size] if o >= offset)
+        assert b"".join(bgzf.inflate_bgzf_range(bgzf_path, block_offsets[2], size)) == (
+            gzip.open(bgzf_path).read()[2000:]
+        )
+
+
+def test_open_fastx_read_raw_shard_gzip(tmpdir):
+    fastq_path = os.path.join(tmpdir, "test.fastq")
+    with open(fastq_path, "wb") as fastq_file:
+        for i in range(500):
+            fastq_file.write(b"@read%d\n%s\n+\n%s\n" % (i, b"ACGT" * i, b"@" * 4 * i))
+    bgzf_path = os.path.join(tmpdir, "test.bgzf.fastq.gz")
+    write_bgzf(bgzf_path, open(fastq_path, "rb").read())
+    gzip_path = os.path.join(tmpdir, "test.fastq.gz")
+    with open(gzip_path, "wb") as gzip_file:
+        gzip_file.write(gzip.compress(open(fastq_path, "rb").read()))
+
+    reads = list(seq.open_fastx_read_raw(fastq_path))
+    for num_shards in (1, 3, 100):
+        bgzf_shards = [
+            list(seq.open_fastx_read_raw(bgzf_path, 2, (i, num_shards)))
+            for i in range(1, num_shards + 1)
+        ]
+        assert [read for shard in bgzf_shards for read in shard] == reads
+        # every Nth read, since a gzip file can't be read from the middle
+        for i in range(1, num_shards + 1):
+            assert (
+                list(seq.open_fastx_read_raw(gzip_path, shard=(i, num_shards)))
+                == reads[i - 1 :: num_shards]
+            )
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_bgzf_writer(tmpdir, threads):
+    records = [os.urandom(n).hex().encode() + b"\n" for n in range(0, 3000, 7)]
+    bgzf_path = os.path.join(tmpdir, "test.gz")
+    # small blocks and batches, to spread the batches across threads
+    with patch("trio_binning.bgzf.BGZF_BLOCK_SIZE", 1000), patch(
+        "trio_binning.bgzf.BLOCKS_PER_BATCH", 2
+    ):
+        with bgzf.BgzfWriter(bgzf_path, 1, threads, index=True) as bgzf_file:
+            bgzf_file.writelines(records[:100])
+            for record in records[100:]:
+                bgzf_file.write(record)
+    data = b"".join(records)
+
+    assert gzip.open(bgzf_path).read() == data
+    with open(bgzf_path, "rb") as bgzf_file:
+        compressed = bgzf_file.read()
+    assert compressed.endswith(bgzf.BGZF_EOF)
+
+    # each entry in the index is where a block starts, after the first
+    with open(bgzf_path + ".gzi", "rb") as index_file:
+        (num_offsets,) = struct.unpack("<Q", index_file.read(8))
+        offsets = [
+            struct.unpack("<QQ", index_file.read(16)) for _ in range(num_offsets)
+        ]
+    assert num_offsets == len(data) // 1000 + 1
+    assert offsets[-1] == (len(compressed) - len(bgzf.BGZF_EOF), len(data))
+    for compressed_offset, uncompressed_offset in offsets[:-1]:
+        # inflates only the block that starts there
+        block = zlib.decompressobj(31).decompress(compressed[compressed_offset:])
+        assert block == data[uncompressed_offset : uncompressed_offset + 1000]
+
+
+def test_bgzf_writer_incompressible(tmpdir):
+    data = os.urandom(3 * bgzf.BGZF_BLOCK_SIZE)
+    bgzf_path = os.path.join(tmpdir, "test.gz")
+    with bgzf.BgzfWriter(bgzf_path, 9) as bgzf_file:
+        bgzf_file.write(data)
+
+    assert gzip.open(bgzf_path).read() == data
+    block_sizes = list(map(len, bgzf.split_bgzf_blocks(open(bgzf_path, "rb"))))
+    assert len(block_sizes) == 4
+    assert max(block_sizes) <= 1 << 16
+
+    with pytest.raises(ValueError):
+        bgzf.BgzfWriter(bgzf_path, 10)
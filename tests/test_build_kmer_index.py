@@ -0,0 +1,47 @@
+from os.path import dirname, join
+from unittest.mock import patch
+
+import pytest
+
+from trio_binning import kmers
+from trio_binning.build_kmer_index import main
+
+
+def test_build_kmer_index(tmpdir):
+    index_path = join(tmpdir, "index.bin")
+    with patch(
+        "sys.argv",
+        [
+            "build-kmer-index",
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--output",
+            index_path,
+            "--threads",
+            "2",
+        ],
+    ):
+        main()
+
+    kmer_index = kmers.load_kmer_index(index_path, verify=True)
+    assert kmers.get_number_kmers_in_index(kmer_index) == (4, 3)
+
+
+def test_build_kmer_index_zero_threads(capsys, tmpdir):
+    with patch(
+        "sys.argv",
+        [
+            "build-kmer-index",
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--output",
+            join(tmpdir, "index.bin"),
+            "--threads",
+            "0",
+        ],
+    ):
+        with pytest.raises(SystemExit):
+            main()
+
+    _, err = capsys.readouterr()
+    assert "--threads must be at least 1" in err
@@ -1,8 +1,12 @@
+import gzip
+import os
+import struct
 from os.path import dirname, join
 from unittest.mock import patch
 
 import pytest
 
+from trio_binning import bgzf, kmers, score_table
 from trio_binning.classify_by_kmers import main
 from trio_binning.seq import readfq
 
@@ -16,6 +20,28 @@ def test_classify_by_kmers_help(capsys):
     assert "Classify reads into bins" in out
 
 
+def test_classify_by_kmers_zero_threads(capsys, tmpdir):
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--threads",
+            "0",
+        ],
+    ):
+        with pytest.raises(SystemExit):
+            main()
+
+    _, err = capsys.readouterr()
+    assert "--threads must be at least 1" in err
+    assert not os.listdir(tmpdir)
+
+
 def test_classify_by_kmers(capsys, tmpdir):
     with patch(
         "sys.argv",
@@ -55,3 +81,201 @@ def test_classify_by_kmers(capsys, tmpdir):
         assert seq1.qual == seq2.qual
 
     assert num_reads == 1
+
+
+def test_classify_by_kmers_with_index(capsys, tmpdir):
+    index_path = join(tmpdir, "index.bin")
+    kmers.write_kmer_index(
+        kmers.create_kmer_index(
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+        ),
+        index_path,
+    )
+
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            "--index",
+            index_path,
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(tmpdir, "hapB"),
+            "--unclassified-out-prefix",
+            join(tmpdir, "hapU"),
+            "--no-gzip-output",
+        ],
+    ):
+        main()
+
+    out, _ = capsys.readouterr()
+    bins = dict(line.split("\t")[:2] for line in out.strip().split("\n"))
+    assert bins == {
+        "m64234e_220609_193909/2/ccs": "A",
+        "m64234e_220609_193909/3/ccs": "B",
+        "m64234e_220609_193909/6/ccs": "U",
+    }
+
+
+def test_classify_by_kmers_threads(capsys, tmpdir):
+    outputs = []
+    for threads in ("1", "3"):
+        # one read per batch, so that the batches are spread across threads
+        with patch("trio_binning.classify_by_kmers.BATCH_BASES", 1), patch(
+            "sys.argv",
+            [
+                "classify-by-kmers",
+                join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+                join(dirname(__file__), "data", "hapA.txt"),
+                join(dirname(__file__), "data", "hapB.txt"),
+                "--haplotype-a-out-prefix",
+                join(tmpdir, "hapA" + threads),
+                "--haplotype-b-out-prefix",
+                join(tmpdir, "hapB" + threads),
+                "--unclassified-out-prefix",
+                join(tmpdir, "hapU" + threads),
+                "--no-gzip-output",
+                "--threads",
+                threads,
+            ],
+        ):
+            main()
+        out, _ = capsys.readouterr()
+        outputs.append(out)
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].strip().split("\n")) == 3
+
+
+def test_classify_by_kmers_gzip_output(capsys, tmpdir):
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(tmpdir, "hapB"),
+            "--unclassified-out-prefix",
+            join(tmpdir, "hapU"),
+            "--compression-level",
+            "1",
+            "--threads",
+            "2",
+        ],
+    ):
+        main()
+
+    hap_a_out = list(readfq(gzip.open(join(tmpdir, "hapA.fastq.gz"), "rt")))
+    correct_out = list(readfq(open(join(dirname(__file__), "data", "hapA.fastq"))))
+    assert hap_a_out == correct_out
+    with open(join(tmpdir, "hapA.fastq.gz"), "rb") as hap_a_file:
+        assert bgzf.is_bgzf(hap_a_file)
+
+
+def test_classify_by_kmers_bgzf_index(capsys, tmpdir):
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(tmpdir, "hapB"),
+            "--unclassified-out-prefix",
+            join(tmpdir, "hapU"),
+            "--bgzf-index",
+        ],
+    ):
+        main()
+
+    for prefix in ("hapA", "hapB", "hapU"):
+        with open(join(tmpdir, prefix + ".fastq.gz.gzi"), "rb") as index_file:
+            # the number of blocks after the first, and then their offsets
+            (num_offsets,) = struct.unpack("<Q", index_file.read(8))
+            assert len(index_file.read()) == 16 * num_offsets
+
+
+def test_classify_by_kmers_score_table(capsys, tmpdir):
+    outputs = []
+    for score_table_options in ([], ["--score-table", join(tmpdir, "scores.npz")]):
+        with patch(
+            "sys.argv",
+            [
+                "classify-by-kmers",
+                join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+                join(dirname(__file__), "data", "hapA.txt"),
+                join(dirname(__file__), "data", "hapB.txt"),
+                "--haplotype-a-out-prefix",
+                join(tmpdir, "hapA"),
+                "--haplotype-b-out-prefix",
+                join(tmpdir, "hapB"),
+                "--unclassified-out-prefix",
+                join(tmpdir, "hapU"),
+                *score_table_options,
+            ],
+        ):
+            main()
+        out, _ = capsys.readouterr()
+        outputs.append(out)
+
+    # the table is written instead of the printed one
+    assert outputs[1] == ""
+    table = score_table.read_score_table(join(tmpdir, "scores.npz"))
+    rows = [line.split("\t") for line in outputs[0].strip().split("\n")]
+    assert table["name"] == [row[0].encode() for row in rows]
+    assert table["bin"] == "".join(row[1] for row in rows).encode()
+    reads = list(
+        readfq(gzip.open(join(dirname(__file__), "data", "test.ccs.fastq.gz"), "rt"))
+    )
+    assert list(table["length"]) == [len(read.seq) for read in reads]
+    assert table["scanned"] == table["length"]
+    # the raw counts, which the printed scores of haplotype B are scaled up
+    # from, since it has 3 k-mers to haplotype A's 4
+    for row, count_a, count_b in zip(rows, table["count_a"], table["count_b"]):
+        assert float(row[2]) == count_a
+        assert float(row[3]) == pytest.approx(count_b * 4 / 3)
+
+
+def test_classify_by_kmers_early_stop(capsys, tmpdir):
+    read = "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    reads_path = join(tmpdir, "reads.fasta")
+    with open(reads_path, "w") as reads_file:
+        reads_file.write(f">long\n{read * 300}\n>short\n{read}\n")
+
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            reads_path,
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(tmpdir, "hapB"),
+            "--unclassified-out-prefix",
+            join(tmpdir, "hapU"),
+            "--early-stop",
+            "3",
+        ],
+    ):
+        main()
+
+    out, _ = capsys.readouterr()
+    rows = [line.split("\t") for line in out.strip().split("\n")]
+    # the long read is only counted until it is clearly from haplotype A,
+    # which takes two stretches with the scores of haplotype B scaled up
+    assert [(row[0], row[1], row[4]) for row in rows] == [
+        ("long", "A", str(2 * kmers.DECISION_SEGMENT_LENGTH + 20)),
+        ("short", "A", str(len(read))),
+    ]
@@ -0,0 +1,78 @@
+from os.path import dirname, join
+from unittest.mock import patch
+
+import pytest
+
+from trio_binning import classify_by_kmers, extract_bin
+
+
+def classify(tmpdir, *options):
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(tmpdir, "hapB"),
+            "--unclassified-out-prefix",
+            join(tmpdir, "hapU"),
+            "--no-gzip-output",
+            *options,
+        ],
+    ):
+        classify_by_kmers.main()
+
+
+def test_extract_bin(capsys, tmpdir):
+    classify(tmpdir)
+    bins_out, _ = capsys.readouterr()
+    bins = {}
+    for prefix in ("hapA", "hapB", "hapU"):
+        with open(join(tmpdir, prefix + ".fastq")) as bin_file:
+            bins[prefix] = bin_file.read()
+
+    ids_dir = tmpdir.mkdir("ids")
+    classify(ids_dir, "--ids-only")
+    ids_out, _ = capsys.readouterr()
+    assert ids_out == bins_out
+    with open(join(ids_dir, "hapA.ids")) as ids_file:
+        assert ids_file.read() == "m64234e_220609_193909/2/ccs\n"
+
+    with patch(
+        "sys.argv",
+        [
+            "extract-bin",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            join(ids_dir, "hapA.ids"),
+            join(ids_dir, "hapB.ids"),
+            join(ids_dir, "hapU.ids"),
+            "--no-gzip-output",
+        ],
+    ):
+        extract_bin.main()
+
+    for prefix in ("hapA", "hapB", "hapU"):
+        with open(join(ids_dir, prefix + ".fastq")) as bin_file:
+            assert bin_file.read() == bins[prefix]
+
+
+def test_extract_bin_zero_threads(capsys, tmpdir):
+    with patch(
+        "sys.argv",
+        [
+            "extract-bin",
+            join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+            join(tmpdir, "hapA.ids"),
+            "--threads",
+            "0",
+        ],
+    ):
+        with pytest.raises(SystemExit):
+            extract_bin.main()
+
+    _, err = capsys.readouterr()
+    assert "--threads must be at least 1" in err
@@ -1,30 +1,374 @@
 import os.path
+import random
+from array import array
 
 import pytest
 
 from trio_binning import kmers
 
 
-def test_build_kmer_hash():
-    kmers_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
-    kmer_set = kmers.create_kmer_hash_set(kmers_path)
-    assert kmers.get_number_kmers_in_set(kmer_set) == 4
+def test_build_kmer_index(capfd):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path)
+    assert kmers.get_number_kmers_in_index(kmer_index) == (4, 3)
 
+    # the memory needed is reported before the hash is allocated
+    _, err = capfd.readouterr()
+    assert "Allocating hash of 8 slots for 7 k-mers, 88% full" in err
 
-def test_count_kmers_in_read():
+
+@pytest.mark.parametrize("bloom_filter", [False, True])
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_count_kmers_in_read(index_type, bloom_filter):
     hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
     hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
 
-    hap_a_set = kmers.create_kmer_hash_set(hap_a_path)
-    hap_b_set = kmers.create_kmer_hash_set(hap_b_path)
+    kmer_index = kmers.create_kmer_index(
+        hap_a_path, hap_b_path, index_type, bloom_filter
+    )
+    assert kmers.has_bloom_filter(kmer_index) == bloom_filter
 
     assert kmers.count_kmers_in_read(
         "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT",
-        hap_a_set,
-        hap_b_set,
+        kmer_index,
     ) == (2, 1)
 
 
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_count_kmers_in_read_reverse_complement(index_type):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path, index_type)
+
+    read = "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    read_revcomp = kmers.reverse_complement(read)
+    assert kmers.count_kmers_in_read(read_revcomp, kmer_index) == (2, 1)
+    assert kmers.count_kmers_in_read(read.lower(), kmer_index) == (2, 1)
+    # an N breaks every window that overlaps it
+    assert kmers.count_kmers_in_read(read[:10] + "N" + read[11:], kmer_index) == (1, 1)
+
+
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_kmer_in_both_haplotypes(tmpdir, index_type):
+    hap_a_path = os.path.join(tmpdir, "hapA.txt")
+    hap_b_path = os.path.join(tmpdir, "hapB.txt")
+    with open(hap_a_path, "w") as hap_a_file:
+        print("ACGTTGCAA\nCCCCCAAAA", file=hap_a_file)
+    with open(hap_b_path, "w") as hap_b_file:
+        # the reverse complement of a k-mer unique to A, and a duplicate
+        print("TTTTGGGGG\nGGATCCGAT\nGGATCCGAT", file=hap_b_file)
+
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path, index_type)
+
+    assert kmers.count_kmers_in_read("CCCCCAAAA", kmer_index) == (1, 0)
+    assert kmers.count_kmers_in_read("GGATCCGATAAGGATCCGAT", kmer_index) == (0, 2)
+
+
+@pytest.mark.parametrize("k", [33, 41, 64])
+def test_long_kmers(tmpdir, k):
+    rng = random.Random(k)
+    kmers_a = ["".join(rng.choices("ACGT", k=k)) for _ in range(50)]
+    kmers_b = ["".join(rng.choices("ACGT", k=k)) for _ in range(50)]
+    hap_a_path = os.path.join(tmpdir, "hapA.txt")
+    hap_b_path = os.path.join(tmpdir, "hapB.txt")
+    index_path = os.path.join(tmpdir, "index.bin")
+    with open(hap_a_path, "w") as hap_a_file:
+        print("\n".join(kmers_a), file=hap_a_file)
+    with open(hap_b_path, "w") as hap_b_file:
+        print("\n".join(kmers_b), file=hap_b_file)
+    # two k-mers from A, one from B, and the reverse complement of one from B
+    read = (
+        kmers_a[0]
+        + "N"
+        + kmers_a[1]
+        + "N"
+        + kmers_b[0]
+        + "N"
+        + kmers.reverse_complement(kmers_b[1])
+    )
+
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path, bloom_filter=True)
+    assert kmers.count_kmers_in_read(read, kmer_index) == (2, 2)
+    assert kmers.count_kmers_in_read(kmers_a[0][1:], kmer_index) == (0, 0)
+
+    kmers.write_kmer_index(kmer_index, index_path)
+    kmer_index = kmers.load_kmer_index(index_path, verify=True)
+    assert kmers.count_kmers_in_read(read.lower(), kmer_index) == (2, 2)
+
+    with pytest.raises(ValueError):
+        kmers.create_kmer_index(hap_a_path, hap_b_path, "sorted")
+
+
+def test_kmer_too_long(tmpdir):
+    hap_a_path = os.path.join(tmpdir, "hapA.txt")
+    hap_b_path = os.path.join(tmpdir, "hapB.txt")
+    for kmer_file_path in (hap_a_path, hap_b_path):
+        with open(kmer_file_path, "w") as kmer_file:
+            print("A" * (kmers.MAX_K + 1), file=kmer_file)
+
+    with pytest.raises(ValueError):
+        kmers.create_kmer_index(hap_a_path, hap_b_path)
+
+
+def test_kmer_file_missing(tmpdir):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(tmpdir, "hapB.txt")
+
+    # straight to the extension, past the check for a missing file
+    with pytest.raises(FileNotFoundError) as error:
+        kmers.kmers_c.create_kmer_index(hap_a_path, hap_b_path, 0, False, 1)
+    assert error.value.filename == hap_b_path.encode()
+
+
+@pytest.mark.parametrize("index_type", ["sorted", "compressed"])
+def test_index_types_agree(tmpdir, index_type):
+    rng = random.Random(1)
+    hap_a_path = os.path.join(tmpdir, "hapA.txt")
+    hap_b_path = os.path.join(tmpdir, "hapB.txt")
+    for kmer_file_path in (hap_a_path, hap_b_path):
+        with open(kmer_file_path, "w") as kmer_file:
+            for _ in range(3000):
+                print("".join(rng.choices("ACGT", k=11)), file=kmer_file)
+    reads = ["".join(rng.choices("ACGT", k=500)) for _ in range(20)]
+
+    hash_index = kmers.create_kmer_index(hap_a_path, hap_b_path, "hash")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path, index_type)
+
+    for read in reads:
+        assert kmers.count_kmers_in_read(read, kmer_index) == kmers.count_kmers_in_read(
+            read, hash_index
+        )
+
+
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_count_kmers_in_reads(index_type):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path, index_type)
+
+    read = "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    # k-mers must not be found across the boundary between two reads
+    reads = [read, "", read[:30], read[30:], "ACGT", kmers.reverse_complement(read)]
+    counts_a, counts_b = kmers.count_kmers_in_reads(reads, kmer_index)
+
+    assert counts_a.typecode == counts_b.typecode == "i"
+    assert list(zip(counts_a, counts_b)) == [
+        kmers.count_kmers_in_read(read, kmer_index) for read in reads
+    ]
+    assert list(zip(counts_a, counts_b))[0] == (2, 1)
+    assert kmers.count_kmers_in_reads([], kmer_index) == (array("i"), array("i"))
+
+
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_count_kmers_in_reads_until_decided(index_type):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path, index_type)
+
+    read = "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    long_read = read * 300
+    reads = [long_read, read, "", "ACGT" * 3000]
+
+    # without a bound, every k-mer is counted
+    counts_a, counts_b, scanned = kmers.count_kmers_in_reads_until_decided(
+        reads, kmer_index, 0
+    )
+    assert scanned.typecode == "Q"
+    assert (counts_a, counts_b) == kmers.count_kmers_in_reads(reads, kmer_index)
+    assert list(scanned) == list(map(len, reads))
+
+    # the long read is decided by its first stretch
+    counts_a, counts_b, scanned = kmers.count_kmers_in_reads_until_decided(
+        reads, kmer_index, 3
+    )
+    segment = kmers.DECISION_SEGMENT_LENGTH + kmer_index.k - 1
+    assert list(scanned) == [segment, len(read), 0, 12000]
+    assert (counts_a[0], counts_b[0]) == kmers.count_kmers_in_read(
+        long_read[:segment], kmer_index
+    )
+    assert (counts_a[1], counts_b[1]) == (2, 1)
+
+    # no k-mer is counted twice, or missed, across the stretches
+    counts_a, counts_b, scanned = kmers.count_kmers_in_reads_until_decided(
+        reads, kmer_index, 1e9
+    )
+    assert (counts_a, counts_b) == kmers.count_kmers_in_reads(reads, kmer_index)
+    assert list(scanned) == list(map(len, reads))
+
+    # a scaled-up haplotype B can outweigh haplotype A
+    _, _, scanned = kmers.count_kmers_in_reads_until_decided(
+        [long_read], kmer_index, 3, (1.0, 2.0)
+    )
+    assert scanned[0] == len(long_read)
+
+
+def test_count_kmers_in_read_buffer_types():
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path)
+
+    read = b"CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    offsets = array("Q", [0, len(read), 2 * len(read)])
+    for reads in (read * 2, bytearray(read * 2), memoryview(read * 2)):
+        counts_a, counts_b = kmers.count_kmers_in_read_buffer(
+            reads, offsets, kmer_index
+        )
+        assert list(counts_a) == [2, 2] and list(counts_b) == [1, 1]
+        assert kmers.count_kmers_in_read(reads[: len(read)], kmer_index) == (2, 1)
+
+
+def test_count_kmers_in_read_buffer_numpy():
+    numpy = pytest.importorskip("numpy")
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path)
+
+    read = b"CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    offsets = [0, len(read), 2 * len(read)]
+    counts_a, counts_b = kmers.count_kmers_in_read_buffer(
+        numpy.frombuffer(read * 2, dtype=numpy.uint8),
+        numpy.array(offsets, dtype=numpy.uint64),
+        kmer_index,
+    )
+    assert list(counts_a) == [2, 2] and list(counts_b) == [1, 1]
+
+
+def test_kmer_index_cannot_be_created_directly():
+    with pytest.raises(TypeError):
+        kmers.KmerIndex()
+
+
+def test_count_kmers_in_read_buffer_bad_offsets():
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    kmer_index = kmers.create_kmer_index(hap_a_path, hap_b_path)
+
+    with pytest.raises(ValueError):
+        kmers.count_kmers_in_read_buffer(b"ACGT", array("Q", [0, 5]), kmer_index)
+    with pytest.raises(ValueError):
+        kmers.count_kmers_in_read_buffer(b"ACGT", array("Q", [0, 3, 2]), kmer_index)
+    with pytest.raises(ValueError):
+        kmers.count_kmers_in_read_buffer(b"ACGT", array("i", [0, 4]), kmer_index)
+
+
+@pytest.mark.parametrize("bloom_filter", [False, True])
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_build_kmer_index_with_threads(tmpdir, index_type, bloom_filter):
+    rng = random.Random(2)
+    hap_a_kmers = ["".join(rng.choices("ACGT", k=15)) for _ in range(20000)]
+    # some k-mers are in both lists, some more than once, and some as their
+    # reverse complements
+    hap_b_kmers = ["".join(rng.choices("ACGT", k=15)) for _ in range(19000)]
+    hap_b_kmers += hap_a_kmers[:500] + hap_b_kmers[:200]
+    hap_b_kmers += [kmers.reverse_complement(kmer) for kmer in hap_a_kmers[500:800]]
+    hap_a_path = os.path.join(tmpdir, "hapA.txt")
+    hap_b_path = os.path.join(tmpdir, "hapB.txt")
+    for kmer_file_path, kmer_list in (
+        (hap_a_path, hap_a_kmers),
+        (hap_b_path, hap_b_kmers),
+    ):
+        with open(kmer_file_path, "w") as kmer_file:
+            print("\n".join(kmer_list), file=kmer_file)
+    reads = ["".join(rng.choices("ACGT", k=300)) for _ in range(20)]
+    reads += ["".join(hap_a_kmers[i : i + 20]) for i in range(0, 800, 20)]
+    reads += ["".join(hap_b_kmers[i : i + 20]) for i in range(18000, 20000, 20)]
+
+    serial_index = kmers.create_kmer_index(
+        hap_a_path, hap_b_path, index_type, bloom_filter
+    )
+    threaded_index = kmers.create_kmer_index(
+        hap_a_path, hap_b_path, index_type, bloom_filter, threads=4
+    )
+
+    assert kmers.get_number_kmers_in_index(
+        threaded_index
+    ) == kmers.get_number_kmers_in_index(serial_index)
+    for read in reads:
+        assert kmers.count_kmers_in_read(
+            read, threaded_index
+        ) == kmers.count_kmers_in_read(read, serial_index)
+
+
+def test_build_kmer_index_zero_threads():
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    with pytest.raises(ValueError):
+        kmers.create_kmer_index(hap_a_path, hap_b_path, threads=0)
+
+
+@pytest.mark.parametrize("bloom_filter", [False, True])
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_write_and_load_kmer_index(tmpdir, index_type, bloom_filter):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    index_path = os.path.join(tmpdir, "index.bin")
+
+    kmers.write_kmer_index(
+        kmers.create_kmer_index(hap_a_path, hap_b_path, index_type, bloom_filter),
+        index_path,
+    )
+    kmer_index = kmers.load_kmer_index(index_path, verify=True)
+
+    assert kmers.get_index_type(kmer_index) == index_type
+    assert kmers.has_bloom_filter(kmer_index) == bloom_filter
+    assert kmers.get_number_kmers_in_index(kmer_index) == (4, 3)
+    assert kmers.count_kmers_in_read(
+        "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT",
+        kmer_index,
+    ) == (2, 1)
+
+
+@pytest.mark.parametrize("in_shared_memory", [False, True])
+def test_replace_loaded_kmer_index(tmpdir, in_shared_memory):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    if in_shared_memory:
+        index_path = f"{kmers.SHARED_MEMORY_PREFIX}trio_binning_test_{os.getpid()}"
+    else:
+        index_path = os.path.join(tmpdir, "index.bin")
+    read = "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+
+    try:
+        kmers.write_kmer_index(
+            kmers.create_kmer_index(hap_a_path, hap_b_path), index_path
+        )
+        first_index = kmers.load_kmer_index(index_path)
+        # a bigger index with the haplotypes the other way around
+        kmers.write_kmer_index(
+            kmers.create_kmer_index(hap_b_path, hap_a_path, "hash", True),
+            index_path,
+        )
+        second_index = kmers.load_kmer_index(index_path, verify=True)
+    finally:
+        if in_shared_memory:
+            kmers.remove_kmer_index(index_path)
+
+    # the index that was loaded first is left as it was
+    assert kmers.count_kmers_in_read(read, first_index) == (2, 1)
+    assert kmers.count_kmers_in_read(read, second_index) == (1, 2)
+    if not in_shared_memory:
+        assert os.listdir(tmpdir) == ["index.bin"]
+
+
+def test_load_corrupt_kmer_index(tmpdir):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    index_path = os.path.join(tmpdir, "index.bin")
+
+    kmers.write_kmer_index(kmers.create_kmer_index(hap_a_path, hap_b_path), index_path)
+    with open(index_path, "r+b") as index_file:
+        index_file.seek(-1, os.SEEK_END)
+        index_file.write(b"\xff")
+
+    kmers.load_kmer_index(index_path)
+    with pytest.raises(ValueError):
+        kmers.load_kmer_index(index_path, verify=True)
+    with pytest.raises(ValueError):
+        kmers.load_kmer_index(hap_a_path)
+
+
 @pytest.mark.parametrize(
     "kmer_str,kmer_int",
     [
@@ -33,6 +377,8 @@ def test_count_kmers_in_read():
         ("TTTTTTTTTTTTTTTAGGCCCACTTTTT", 72006304612220927),
         ("AAAAAAAAAAAAAAAAAAAAAAAAAA", 0),
         ("GGGAGGGAGGGAGGGAGGGAGGGAGGG", 11868309606246954),
+        ("A" * 32 + "C", 1 << 64),
+        ("T" * 64, (1 << 128) - 1),
     ],
 )
 def test_kmer_to_int(kmer_str, kmer_int):
@@ -51,3 +397,36 @@ def test_kmer_to_int(kmer_str, kmer_int):
 )
 def test_reverse_complement(kmer, revcomp_kmer):
     assert kmers.reverse_complement(kmer) == revcomp_kmer
+
+
+@pytest.mark.parametrize("index_type", ["hash", "sorted", "compressed"])
+def test_kmer_index_in_shared_memory(index_type):
+    hap_a_path = os.path.join(os.path.dirname(__file__), "data", "hapA.txt")
+    hap_b_path = os.path.join(os.path.dirname(__file__), "data", "hapB.txt")
+    index_path = f"{kmers.SHARED_MEMORY_PREFIX}trio_binning_test_{os.getpid()}"
+
+    kmers.write_kmer_index(
+        kmers.create_kmer_index(hap_a_path, hap_b_path, index_type, True),
+        index_path,
+    )
+    try:
+        first_index = kmers.load_kmer_index(index_path, verify=True)
+        second_index = kmers.load_kmer_index(index_path)
+    finally:
+        kmers.remove_kmer_index(index_path)
+
+    # loaded indexes stay usable after the shared memory object is removed
+    for kmer_index in (first_index, second_index):
+        assert kmers.get_index_type(kmer_index) == index_type
+        assert kmers.get_number_kmers_in_index(kmer_index) == (4, 3)
+        assert kmers.count_kmers_in_read(
+            "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT",
+            kmer_index,
+        ) == (2, 1)
+
+    with pytest.raises(ValueError):
+        kmers.load_kmer_index(index_path)
+    with pytest.raises(OSError):
+        kmers.remove_kmer_index(index_path)
+    with pytest.raises(ValueError):
+        kmers.load_kmer_index(kmers.SHARED_MEMORY_PREFIX + "bad/name")
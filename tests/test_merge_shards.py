@@ -0,0 +1,77 @@
+import gzip
+import shutil
+from os.path import dirname, join
+from unittest.mock import patch
+
+from trio_binning import bgzf, classify_by_kmers, merge_shards, score_table
+
+
+def classify(reads_path, out_dir, *options):
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            reads_path,
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(out_dir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(out_dir, "hapB"),
+            "--unclassified-out-prefix",
+            join(out_dir, "hapU"),
+            *options,
+        ],
+    ):
+        classify_by_kmers.main()
+
+
+def test_merge_shards(capsys, tmpdir):
+    reads_path = join(tmpdir, "test.ccs.fastq")
+    with gzip.open(join(dirname(__file__), "data", "test.ccs.fastq.gz")) as reads:
+        with open(reads_path, "wb") as reads_copy:
+            shutil.copyfileobj(reads, reads_copy)
+
+    classify(reads_path, tmpdir)
+    scores, _ = capsys.readouterr()
+
+    shard_dirs = [tmpdir.mkdir(f"shard{i}") for i in (1, 2)]
+    for i, shard_dir in enumerate(shard_dirs, 1):
+        classify(reads_path, shard_dir, "--shard", f"{i}/2")
+        with open(join(shard_dir, "scores.tsv"), "w") as scores_file:
+            scores_file.write(capsys.readouterr()[0])
+
+    for file_name in ("hapA.fastq.gz", "hapB.fastq.gz", "hapU.fastq.gz", "scores.tsv"):
+        with patch(
+            "sys.argv",
+            [
+                "merge-shards",
+                join(tmpdir, "merged_" + file_name),
+                *(join(shard_dir, file_name) for shard_dir in shard_dirs),
+            ],
+        ):
+            merge_shards.main()
+
+    with open(join(tmpdir, "merged_scores.tsv")) as merged_scores:
+        assert merged_scores.read() == scores
+    for prefix in ("hapA", "hapB", "hapU"):
+        with gzip.open(join(tmpdir, f"merged_{prefix}.fastq.gz")) as merged:
+            with gzip.open(join(tmpdir, f"{prefix}.fastq.gz")) as whole:
+                assert merged.read() == whole.read()
+        with open(join(tmpdir, f"merged_{prefix}.fastq.gz"), "rb") as merged:
+            assert merged.read().count(bgzf.BGZF_EOF) == 1
+
+
+def test_merge_shards_score_table(capsys, tmpdir):
+    reads_path = join(dirname(__file__), "data", "test.fastq")
+    classify(reads_path, tmpdir, "--score-table", join(tmpdir, "scores.npz"))
+    shard_paths = [join(tmpdir, f"scores{i}.npz") for i in (1, 2, 3)]
+    for i, shard_path in enumerate(shard_paths, 1):
+        classify(reads_path, tmpdir, "--shard", f"{i}/3", "--score-table", shard_path)
+
+    with patch("sys.argv", ["merge-shards", join(tmpdir, "merged.npz"), *shard_paths]):
+        merge_shards.main()
+
+    merged = score_table.read_score_table(join(tmpdir, "merged.npz"))
+    assert merged == score_table.read_score_table(join(tmpdir, "scores.npz"))
+    assert len(merged["name"]) > 3
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from trio_binning.pipeline import BackgroundWriter, batched, ordered_map, read_ahead
+
+
+def test_batched():
+    assert list(batched(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(batched([], 3)) == []
+    assert list(batched(["ACGT", "A", "ACGTACGT", "AC"], 5, len)) == [
+        ["ACGT", "A"],
+        ["ACGTACGT"],
+        ["AC"],
+    ]
+
+
+def test_read_ahead():
+    assert list(read_ahead(range(100), 4)) == list(range(100))
+
+
+def test_read_ahead_error():
+    def items():
+        yield 1
+        raise ValueError("bad input")
+
+    iterator = read_ahead(items(), 4)
+    assert next(iterator) == 1
+    with pytest.raises(ValueError, match="bad input"):
+        next(iterator)
+
+
+def test_read_ahead_stops_early():
+    closed = []
+
+    def items():
+        try:
+            yield from range(100)
+        finally:
+            closed.append(True)
+
+    threads_before = set(threading.enumerate())
+    iterator = read_ahead(items(), 4)
+    assert next(iterator) == 0
+    iterator.close()
+
+    # the thread stops, rather than waiting forever for room for more
+    # items, and closes the input
+    for thread in set(threading.enumerate()) - threads_before:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert closed == [True]
+
+
+def test_pipeline_needs_room():
+    # an unbounded buffer would defeat the point
+    with pytest.raises(ValueError):
+        read_ahead(range(10), 0)
+    with pytest.raises(ValueError):
+        BackgroundWriter(print, 0)
+    with pytest.raises(ValueError):
+        ordered_map(str, range(10), 0)
+
+
+def test_background_writer():
+    written = []
+
+    def slow_write(item):
+        time.sleep(0.001)
+        written.append(item)
+
+    with BackgroundWriter(slow_write, 2) as writer:
+        for item in range(20):
+            writer.write(item)
+    assert written == list(range(20))
+
+
+def test_background_writer_error():
+    def write(item):
+        if item == 3:
+            raise ValueError("bad output")
+
+    with pytest.raises(ValueError, match="bad output"):
+        with BackgroundWriter(write, 2) as writer:
+            # more items than fit in the queue, which must not block
+            for item in range(20):
+                writer.write(item)
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_ordered_map(threads):
+    def slow_square(x):
+        # later items finish first, to check that the order is kept anyway
+        time.sleep((20 - x) / 5000)
+        return x * x
+
+    assert list(ordered_map(slow_square, range(20), threads)) == [
+        x * x for x in range(20)
+    ]
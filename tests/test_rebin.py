@@ -0,0 +1,112 @@
+from array import array
+from os.path import dirname, join
+from unittest.mock import patch
+
+import pytest
+
+from trio_binning import classify_by_kmers, rebin, score_table
+
+
+def classify(tmpdir, reads_path):
+    with patch(
+        "sys.argv",
+        [
+            "classify-by-kmers",
+            reads_path,
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+            "--haplotype-a-out-prefix",
+            join(tmpdir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(tmpdir, "hapB"),
+            "--unclassified-out-prefix",
+            join(tmpdir, "hapU"),
+            "--no-gzip-output",
+            "--score-table",
+            join(tmpdir, "scores.npz"),
+        ],
+    ):
+        classify_by_kmers.main()
+
+
+def run_rebin(tmpdir, out_dir, *options):
+    with patch(
+        "sys.argv",
+        [
+            "rebin",
+            join(tmpdir, "scores.npz"),
+            "--haplotype-a-out-prefix",
+            join(out_dir, "hapA"),
+            "--haplotype-b-out-prefix",
+            join(out_dir, "hapB"),
+            "--unclassified-out-prefix",
+            join(out_dir, "hapU"),
+            "--no-gzip-output",
+            *options,
+        ],
+    ):
+        rebin.main()
+
+
+def test_rebin(tmpdir):
+    reads_path = join(dirname(__file__), "data", "test.ccs.fastq.gz")
+    classify(tmpdir, reads_path)
+
+    # the same rule as classify-by-kmers, by default
+    out_dir = tmpdir.mkdir("rebinned")
+    run_rebin(tmpdir, out_dir, "--reads", reads_path)
+    for prefix in ("hapA", "hapB", "hapU"):
+        with open(join(tmpdir, prefix + ".fastq")) as classified:
+            with open(join(out_dir, prefix + ".fastq")) as rebinned:
+                assert rebinned.read() == classified.read()
+
+    # a read is left unclassified unless it has enough k-mers
+    run_rebin(tmpdir, out_dir, "--min-hits", "1000")
+    with open(join(out_dir, "hapA.ids")) as hap_a_ids:
+        assert hap_a_ids.read() == ""
+    with open(join(out_dir, "hapU.ids")) as unclassified_ids:
+        assert len(unclassified_ids.read().split()) == 3
+
+    with pytest.raises(ValueError):
+        run_rebin(
+            tmpdir, out_dir, "--reads", join(dirname(__file__), "data", "test.fastq")
+        )
+
+
+def test_rebin_partly_counted(capsys, tmpdir):
+    with score_table.ScoreTableWriter(join(tmpdir, "scores.npz"), 4, 4) as writer:
+        writer.write(
+            [b"read1", b"read2"],
+            [20000, 100],
+            array("i", [30, 0]),
+            array("i", [0, 2]),
+            b"AB",
+            [4096, 100],
+        )
+
+    with pytest.raises(SystemExit):
+        run_rebin(tmpdir, tmpdir)
+    _, err = capsys.readouterr()
+    assert "1 reads in" in err and "--allow-partial" in err
+
+    run_rebin(tmpdir, tmpdir, "--allow-partial")
+    _, err = capsys.readouterr()
+    assert "1 reads in" in err
+    with open(join(tmpdir, "hapA.ids")) as hap_a_ids:
+        assert hap_a_ids.read() == "read1\n"
+
+
+def test_rebin_zero_threads(capsys, tmpdir):
+    with pytest.raises(SystemExit):
+        run_rebin(tmpdir, tmpdir, "--threads", "0")
+    _, err = capsys.readouterr()
+    assert "--threads must be at least 1" in err
+
+
+def test_bin_reads():
+    counts_a = array("i", [0, 3, 3, 10, 1, 0])
+    counts_b = array("i", [0, 4, 2, 4, 1, 1])
+    assert rebin.bin_reads(counts_a, counts_b, (1.0, 1.0)) == b"UBAAUB"
+    assert rebin.bin_reads(counts_a, counts_b, (2.0, 1.0)) == b"UAAAAB"
+    assert rebin.bin_reads(counts_a, counts_b, (1.0, 1.0), min_hits=2) == b"UBAAUU"
+    assert rebin.bin_reads(counts_a, counts_b, (1.0, 1.0), ratio=2.0) == b"UUUAUB"
@@ -0,0 +1,64 @@
+import os
+import zipfile
+from array import array
+
+import pytest
+
+from trio_binning import score_table
+
+
+def write_table(path):
+    with score_table.ScoreTableWriter(path, 4, 3) as writer:
+        writer.write(
+            [b"read1", b"read22"],
+            [100, 20000],
+            array("i", [3, 0]),
+            array("i", [0, 7]),
+            b"AB",
+            [100, 4200],
+        )
+        writer.write([], [], array("i"), array("i"), b"", [])
+        writer.write([b"r3"], [5], array("i", [1]), array("i", [1]), b"U", [5])
+
+
+def test_score_table(tmpdir):
+    path = os.path.join(tmpdir, "scores.npz")
+    write_table(path)
+
+    with zipfile.ZipFile(path) as npz:
+        assert npz.namelist() == [
+            column + ".npy"
+            for column in score_table.COLUMNS + ("num_kmers_a", "num_kmers_b")
+        ]
+        for name in npz.namelist():
+            npy = npz.read(name)
+            assert npy.startswith(score_table.NPY_MAGIC)
+            # the data is aligned to 64 bytes, after a header ending in a newline
+            header_end = npy.index(b"\n") + 1
+            assert header_end % 64 == 0
+
+    assert score_table.read_score_table(path) == {
+        "name": [b"read1", b"read22", b"r3"],
+        "length": array("Q", [100, 20000, 5]),
+        "count_a": array("i", [3, 0, 1]),
+        "count_b": array("i", [0, 7, 1]),
+        "bin": b"ABU",
+        "scanned": array("Q", [100, 4200, 5]),
+        "num_kmers_a": 4,
+        "num_kmers_b": 3,
+    }
+
+
+def test_score_table_numpy(tmpdir):
+    numpy = pytest.importorskip("numpy")
+    path = os.path.join(tmpdir, "scores.npz")
+    write_table(path)
+
+    table = numpy.load(path)
+    assert list(table["name"]) == [b"read1", b"read22", b"r3"]
+    assert list(table["length"]) == [100, 20000, 5]
+    assert list(table["count_a"]) == [3, 0, 1]
+    assert list(table["count_b"]) == [0, 7, 1]
+    assert list(table["bin"]) == [b"A", b"B", b"U"]
+    assert list(table["scanned"]) == [100, 4200, 5]
+    assert table["num_kmers_a"] == 4
@@ -1,5 +1,8 @@
 import os
-from io import StringIO
+import random
+from io import BytesIO, StringIO
+
+import pytest
 
 from trio_binning import seq
 
@@ -41,3 +44,99 @@ def test_write_fastq():
         "@read2\nAGGGGATTTTATTA\n+\n++(*))*+%%%))(\n"
     )
     sio.close()
+
+
+def test_readfq_raw():
+    for file_name in ("test.fa", "test.fastq"):
+        fastx_path = os.path.join(os.path.dirname(__file__), "data", file_name)
+        reads = list(seq.readfq(open(fastx_path)))
+        # small chunks, so that reads are split between them
+        for chunk_size in (1, 10, seq.CHUNK_SIZE):
+            raw_reads = list(seq.readfq_raw(open(fastx_path, "rb"), chunk_size))
+            assert [raw_read.to_read() for raw_read in raw_reads] == reads
+
+
+def test_readfq_raw_multiline():
+    fastx = (
+        b"@read1 first\nGATT\nACA\n+\n@@!!\n!!!\n"
+        b"@read2\nGA\n+\n@+\n"
+        b"@read3\nGATTACA\n+\n!!!!!!!"
+    )
+    for chunk_size in (1, 5, seq.CHUNK_SIZE):
+        assert list(seq.readfq_raw(BytesIO(fastx), chunk_size)) == [
+            seq.RawRead(b"read1", b"GATTACA", b"@@!!!!!"),
+            seq.RawRead(b"read2", b"GA", b"@+"),
+            seq.RawRead(b"read3", b"GATTACA", b"!!!!!!!"),
+        ]
+
+    fasta = b">read1 first\nGATT\n\nACA\n>read2\n>read3\nGA"
+    assert list(seq.readfq_raw(BytesIO(fasta), 3)) == [
+        seq.RawRead(b"read1", b"GATTACA"),
+        seq.RawRead(b"read2", b""),
+        seq.RawRead(b"read3", b"GA"),
+    ]
+
+
+def test_readfq_batches():
+    fastq_path = os.path.join(os.path.dirname(__file__), "data", "test.fastq")
+    batches = list(seq.readfq_batches(open(fastq_path, "rb"), 100))
+    assert len(batches) > 1
+    assert [read for batch in batches for read in batch] == list(
+        seq.readfq_raw(open(fastq_path, "rb"))
+    )
+
+
+def random_reads(num_reads, fastq):
+    rng = random.Random(1)
+    reads = []
+    for i in range(num_reads):
+        length = rng.randint(1, 300)
+        sequence = "".join(rng.choices("ACGT", k=length)).encode()
+        # qualities that start with "@" or "+", to look like other lines
+        quality = "".join(rng.choices("@+I#", k=length)).encode() if fastq else None
+        reads.append(seq.RawRead(b"read%d" % i, sequence, quality))
+    return reads
+
+
+def test_open_fastx_read_raw_shard(tmpdir):
+    for fastq in (True, False):
+        reads = random_reads(200, fastq)
+        fastx_path = os.path.join(tmpdir, "test.fastq" if fastq else "test.fa")
+        with open(fastx_path, "wb") as fastx_file:
+            fastx_file.write(b"".join(map(bytes, reads)))
+
+        for num_shards in (1, 2, 7, 1000):
+            shards = [
+                list(seq.open_fastx_read_raw(fastx_path, shard=(i, num_shards)))
+                for i in range(1, num_shards + 1)
+            ]
+            assert [read for shard in shards for read in shard] == reads
+        assert list(seq.open_fastx_read(fastx_path, (1, 1))) == list(
+            seq.open_fastx_read(fastx_path)
+        )
+
+    with pytest.raises(ValueError):
+        seq.open_fastx_read_raw(fastx_path, shard=(3, 2))
+
+
+def test_write_raw_read():
+    assert bytes(seq.RawRead(b"read1", b"AGAT")) == b">read1\nAGAT\n"
+    assert bytes(seq.RawRead(b"read1", b"AGAT", b"%()%")) == b"@read1\nAGAT\n+\n%()%\n"
+
+
+def test_record_writer():
+    bio = BytesIO()
+    writer = seq.RecordWriter(bio, buffer_size=20)
+    writer.write(bytes(seq.RawRead(b"read1", b"AGAT")))
+    assert bio.getvalue() == b""
+    writer.writelines([bytes(seq.Read("read2", "AGAT", "%()%"))])
+    # written once there are 20 bytes of records
+    assert bio.getvalue() == b">read1\nAGAT\n@read2\nAGAT\n+\n%()%\n"
+
+    sio = StringIO()
+    with seq.RecordWriter(sio) as writer:
+        writer.write("read1\tA\n")
+        writer.write("read2\tB\n")
+        writer.flush()
+        assert sio.getvalue() == "read1\tA\nread2\tB\n"
+    assert sio.closed
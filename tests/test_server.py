@@ -0,0 +1,96 @@
+import threading
+from os.path import dirname, join
+from unittest.mock import patch
+
+import pytest
+
+from trio_binning import classify_by_kmers, kmers
+from trio_binning.server import KmerIndexClient, KmerIndexServer, ServerError
+
+
+@pytest.fixture
+def server_socket(tmpdir):
+    socket_path = join(tmpdir, "server.sock")
+    kmer_index = kmers.create_kmer_index(
+        join(dirname(__file__), "data", "hapA.txt"),
+        join(dirname(__file__), "data", "hapB.txt"),
+    )
+    with KmerIndexServer(socket_path, kmer_index) as server:
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield socket_path
+        server.shutdown()
+        thread.join()
+
+
+def test_count_kmers_with_server(server_socket):
+    kmer_index = kmers.create_kmer_index(
+        join(dirname(__file__), "data", "hapA.txt"),
+        join(dirname(__file__), "data", "hapB.txt"),
+    )
+    read = "CTTATCATGTCTTTGTTTTCAAAGCTTCTTAGAGGTTTTTTTTTTTGGTGTTAATTGGCATAAATTATGGCT"
+    reads = [read, "", read[:30], "ACGT"]
+
+    with KmerIndexClient(server_socket) as client:
+        assert client.get_number_kmers_in_index() == (4, 3)
+        counts_a, counts_b = client.count_kmers_in_reads(reads)
+        assert list(zip(counts_a, counts_b))[0] == (2, 1)
+        assert (counts_a, counts_b) == kmers.count_kmers_in_reads(reads, kmer_index)
+        # bytes too, like the local function
+        encoded_reads = [read.encode() for read in reads]
+        assert client.count_kmers_in_reads(encoded_reads) == (counts_a, counts_b)
+        # and again over the same connection
+        assert client.count_kmers_in_reads([]) == kmers.count_kmers_in_reads(
+            [], kmer_index
+        )
+
+
+def test_classify_by_kmers_with_server(capsys, tmpdir, server_socket):
+    outputs = []
+    for source in (
+        ["--server", server_socket],
+        [
+            join(dirname(__file__), "data", "hapA.txt"),
+            join(dirname(__file__), "data", "hapB.txt"),
+        ],
+    ):
+        with patch(
+            "sys.argv",
+            [
+                "classify-by-kmers",
+                join(dirname(__file__), "data", "test.ccs.fastq.gz"),
+                *source,
+                "--haplotype-a-out-prefix",
+                join(tmpdir, "hapA" + str(len(outputs))),
+                "--haplotype-b-out-prefix",
+                join(tmpdir, "hapB" + str(len(outputs))),
+                "--unclassified-out-prefix",
+                join(tmpdir, "hapU" + str(len(outputs))),
+                "--no-gzip-output",
+            ],
+        ):
+            classify_by_kmers.main()
+        out, _ = capsys.readouterr()
+        outputs.append(out)
+
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0].strip().split("\n")) == 3
+    for prefix in ("hapA", "hapB", "hapU"):
+        with open(join(tmpdir, prefix + "0.fastq")) as server_out, open(
+            join(tmpdir, prefix + "1.fastq")
+        ) as local_out:
+            assert server_out.read() == local_out.read()
+
+
+def test_server_error(tmpdir, server_socket):
+    with KmerIndexClient(server_socket) as client:
+        with pytest.raises(ServerError, match="No such file"):
+            client.classify(
+                join(tmpdir, "missing.fastq"),
+                join(tmpdir, "hapA"),
+                join(tmpdir, "hapB"),
+                join(tmpdir, "hapU"),
+                False,
+            )
+        # the connection can still be used after an error
+        assert client.get_number_kmers_in_index() == (4, 3)